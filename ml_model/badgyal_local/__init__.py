@@ -1,13 +1,62 @@
-import badgyal_local.abstractnet
-import badgyal_local.bgnet
-import badgyal_local.bgtorchnet
-import badgyal_local.bgxltorchnet
-import badgyal_local.board2planes
-import badgyal_local.ggnet
-import badgyal_local.lenet
-import badgyal_local.letorchnet
-import badgyal_local.menet
-import badgyal_local.mgnet
-import badgyal_local.model
-import badgyal_local.policy_index
-import badgyal_local.wdlnet
\ No newline at end of file
+"""
+Submodules and net classes are imported on first attribute access (PEP 562),
+so e.g. `import badgyal_local.board2planes` does not pull in torch, protobuf
+and every net. Note that importing `model` (directly or through any net) sets
+torch's default dtype to float64.
+"""
+import importlib
+
+SUBMODULES = [
+    "abstractnet",
+    "batching",
+    "bgnet",
+    "bgtorchnet",
+    "bgxltorchnet",
+    "board2planes",
+    "disk_cache",
+    "fused_net",
+    "ggnet",
+    "integer_net",
+    "known_positions",
+    "lenet",
+    "letorchnet",
+    "menet",
+    "mgnet",
+    "model",
+    "policy_index",
+    "position_cache",
+    "prefetch",
+    "search",
+    "snapshot",
+    "tensor_file",
+    "tracing",
+    "wdlnet",
+]
+
+# --- Net class -> defining submodule ---
+NET_CLASSES = {
+    "BGNet": "bgnet",
+    "BGTorchNet": "bgtorchnet",
+    "BGXLTorchNet": "bgxltorchnet",
+    "GGNet": "ggnet",
+    "LENet": "lenet",
+    "LETorchNet": "letorchnet",
+    "MENet": "menet",
+    "MGNet": "mgnet",
+    "WDLNet": "wdlnet",
+}
+
+__all__ = SUBMODULES + list(NET_CLASSES)
+
+
+def __getattr__(name):
+    if name in NET_CLASSES:
+        return getattr(importlib.import_module(f"{__name__}.{NET_CLASSES[name]}"), name)
+    if name in SUBMODULES:
+        # --- import_module also sets the submodule as a package attribute, so this runs once ---
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
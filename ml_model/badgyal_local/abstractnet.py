@@ -3,20 +3,28 @@ import badgyal_local.model as model
 import badgyal_local.net as proto_net
 import badgyal_local.proto.net_pb2 as pb
 import chess
-from badgyal_local.board2planes import board2planes, policy2moves, bulk_board2planes
-import pylru
-import sys
+from badgyal_local.board2planes import bulk_board2planes, bulk_policy2moves
+from badgyal_local.position_cache import PositionCache, position_key
+from badgyal_local.disk_cache import DiskCache, network_id, quantization_id
+from badgyal_local.fused_net import FusedNet
+from badgyal_local.integer_net import IntegerNet
+from badgyal_local.known_positions import NET, KnownPositions
+from badgyal_local.prefetch import Prefetcher
+from badgyal_local.snapshot import load_snapshot, save_snapshot
+import threading
 
 
 CACHE = 100000
+CACHE_BYTES = 128 * 1024 ** 2
 MAX_BATCH = 8
 MIN_POLICY = 0.2
 
 
 class AbstractNet:
 
-    def __init__(self, cuda=True, torchScript=False):
-        self.net = self.load_net()
+    def __init__(self, cuda=True, torchScript=False, snapshot=None):
+        # --- A `snapshot` file (see `save_snapshot`) replaces building the net from its weights file ---
+        self.net = load_snapshot(snapshot) if snapshot is not None else self.load_net()
         self.cuda = cuda
         if self.cuda:
             self.net = self.net.cuda()
@@ -26,8 +34,18 @@ class AbstractNet:
             #self.net = torch.jit.trace(self.net, self.trace_batch().cuda())
             self.net = torch.jit.script(self.net)
         self.net.eval()
-        self.cache = pylru.lrucache(CACHE)
+        self.cache = PositionCache(CACHE, CACHE_BYTES)
         self.prefetch = {}
+        # --- Background speculative evaluation (see `start_prefetcher`) ---
+        self.prefetcher = None
+        # --- Optional persistent store behind the in-memory LRU (see `open_disk_cache`) ---
+        self.disk_cache = None
+        # --- Optional opening book / tablebase answered before inference (see `open_known_positions`) ---
+        self.known_positions = None
+        # --- Guards the net, cache and input buffer against background workers ---
+        self.lock = threading.RLock()
+        # --- Reused input planes, grown on demand (pinned when feeding the GPU) ---
+        self.input_buffer = None
 
     @staticmethod
     def trace_batch():
@@ -46,8 +64,23 @@ class AbstractNet:
         assert self.torchScript
         self.net.save(path)
 
+    def save_snapshot(self, path):
+        """
+        Writes the current `model.Net` (including quantization, if applied) as a
+        snapshot, so workers can start with e.g. `GGNet(snapshot=path)`.
+        """
+        with self.lock:
+            save_snapshot(self.net, path)
+
+    def get_input_buffer(self, n):
+        if self.input_buffer is None or self.input_buffer.size(0) < n:
+            size = max(n, MAX_BATCH + 1)
+            self.input_buffer = torch.empty((size, 112, 8, 8), dtype=torch.float32, pin_memory=self.cuda)
+        return self.input_buffer
+
     def process_boards(self, boards, name=None):
-        input = bulk_board2planes(boards)
+        boards = list(boards)
+        input = bulk_board2planes(boards, out=self.get_input_buffer(len(boards)))
 
         # --- Ryan's stuff ---
         # print(f"In process boards. Received boards {boards} and processed into")
@@ -77,98 +110,270 @@ class AbstractNet:
         # --- End Ryan's stuff ---
 
         if self.cuda:
-            input = input.pin_memory().cuda(non_blocking = True)
+            input = input.cuda(non_blocking = True)
         with torch.jit.optimized_execution(True):
             with torch.no_grad():
                 policies, values = self.net(input)
                 return policies.cpu(), values.cpu()
 
+    def decode_boards(self, boards, policies, values, softmax_temp=1.61, keys=None):
+        """
+        Decodes a batch of net outputs into one `MovePolicy` and scalar value
+        per board, and stores them in the cache under `keys` (computed with
+        `position_key` if not given).
+        """
+        if keys is None:
+            keys = [position_key(b) for b in boards]
+        retval_p = bulk_policy2moves(boards, policies, softmax_temp=softmax_temp)
+        retval_v = []
+        for i, key in enumerate(keys):
+            value = self.value_to_scalar(values[i])
+            retval_v.append(value)
+            self.cache[key] = [retval_p[i], value]
+        if self.disk_cache is not None:
+            self.disk_cache.put_many((key, [retval_p[i], retval_v[i]]) for i, key in enumerate(keys))
+        return retval_p, retval_v
+
     def cache_boards(self, boards, softmax_temp=1.61):
         for b in boards:
-            epd = b.epd()
-            if not epd in self.cache:
-                self.prefetch[epd] = b
+            key = position_key(b)
+            if not key in self.cache and self.load_from_disk(key) is None:
+                self.prefetch[key] = b
 
         if len(self.prefetch) > MAX_BATCH:
-            policies, values = self.process_boards(self.prefetch.values())
-            with torch.jit.optimized_execution(True):
-                with torch.no_grad():
-                    for i, b in enumerate(self.prefetch.values()):
-                        inp = policies[i].unsqueeze(dim=0)
-                        policy = policy2moves(b, inp, softmax_temp=softmax_temp)
-                        value = values[i]
-                        value = self.value_to_scalar(value)
-                        self.cache[b.epd()] = [policy, value]
+            boards = list(self.prefetch.values())
+            policies, values = self.process_boards(boards)
+            self.decode_boards(boards, policies, values, softmax_temp=softmax_temp, keys=list(self.prefetch.keys()))
             self.prefetch = {}
 
+    def load_from_disk(self, key):
+        """
+        Promotes the disk cache entry for `key` into the in-memory cache and
+        returns it, or returns None.
+        """
+        if self.disk_cache is None:
+            return None
+        entry = self.disk_cache.get(key)
+        if entry is not None:
+            self.cache[key] = entry
+        return entry
+
+    def lookup(self, key):
+        """
+        Cached [policy, value] entry for `key`, from memory or disk, or None.
+        """
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = self.load_from_disk(key)
+        return entry
+
     def cache_eval(self, board):
-        epd = board.epd()
-        if epd in self.cache:
-            return self.cache[epd]
+        with self.lock:
+            entry = self.lookup(position_key(board))
+        if entry is not None:
+            policy, value = entry
+            return policy.to_dict(), value
         else:
             return None, None
 
+    def cache_stats(self):
+        stats = self.cache.stats()
+        if self.disk_cache is not None:
+            stats["disk"] = self.disk_cache.stats()
+        if self.known_positions is not None:
+            stats["known_positions"] = self.known_positions.stats()
+        return stats
+
+    def open_disk_cache(self, path):
+        """
+        Puts a persistent `DiskCache` at `path` behind the in-memory cache.
+        Entries are namespaced by the network weights and its quantization
+        settings, so one file can be shared by several nets and
+        processes.
+        """
+        with self.lock:
+            self.close_disk_cache()
+            namespace = f"{type(self).__name__}-{network_id(self.net)}-{quantization_id(self.net)}"
+            self.disk_cache = DiskCache(path, namespace)
+        return self.disk_cache
+
+    def close_disk_cache(self):
+        with self.lock:
+            if self.disk_cache is not None:
+                self.disk_cache.close()
+                self.disk_cache = None
+
+    def open_known_positions(self, book_path=None, tablebase_path=None):
+        """
+        Has `eval` answer positions found in a Polyglot opening book or Syzygy
+        tablebases from there, without inference (see `KnownPositions`).
+        Off by default, so moves come from the (circuit-proven) net.
+        """
+        with self.lock:
+            self.close_known_positions()
+            self.known_positions = KnownPositions(book_path, tablebase_path)
+        return self.known_positions
+
+    def resolve_known(self, board):
+        """
+        (MovePolicy, value, source) for `board` from the open `KnownPositions`,
+        or None if they are not open or do not know it.
+        """
+        known_positions = self.known_positions
+        return known_positions.resolve(board) if known_positions is not None else None
+
+    def close_known_positions(self):
+        with self.lock:
+            if self.known_positions is not None:
+                self.known_positions.close()
+                self.known_positions = None
+
+    def start_prefetcher(self, max_pending=256, softmax_temp=1.61):
+        """
+        Moves the speculative child evaluation done by `eval` onto a background
+        `Prefetcher`, so `eval` returns at single-eval latency.
+        """
+        if self.prefetcher is None:
+            self.prefetcher = Prefetcher(self, max_pending=max_pending, batch_size=MAX_BATCH + 1,
+                                         softmax_temp=softmax_temp)
+        return self.prefetcher
+
+    def stop_prefetcher(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def quantize_parameters(self):
+        """
+        Quantizes the `model.Net` in place (see `Net.quantize_parameters`).
+        Evaluations cached for the float net are dropped, and the disk cache
+        is reopened under the quantized net's namespace.
+        """
+        with self.lock:
+            self.net.quantize_parameters()
+            self.cache.clear()
+            if self.disk_cache is not None:
+                self.open_disk_cache(self.disk_cache.path)
+        return self.net
+
+    def use_fused_inference(self):
+        """
+        Swaps a float `model.Net` for its `FusedNet` build (batchnorm folded
+        into the convs), for analysis and play that does not need the circuit.
+        """
+        with self.lock:
+            self.net = FusedNet(self.net)
+            if self.cuda:
+                self.net = self.net.cuda()
+            self.net.eval()
+            self.cache.clear()
+            if self.disk_cache is not None:
+                self.open_disk_cache(self.disk_cache.path)
+        return self.net
+
+    def use_integer_inference(self):
+        """
+        Swaps the quantized `model.Net` for an `IntegerNet`, which runs the
+        same circuit arithmetic on int64 activations and stays exact past 2^53.
+        """
+        with self.lock:
+            self.net = IntegerNet(self.net)
+            if self.cuda:
+                self.net = self.net.cuda()
+            self.net.eval()
+            self.cache.clear()
+            # --- The disk cache namespace follows the net ---
+            if self.disk_cache is not None:
+                self.open_disk_cache(self.disk_cache.path)
+        return self.net
+
     def value_to_scalar(self, value: torch.Tensor):
         return value.item()
 
-    def eval(self, board: chess.Board, softmax_temp=1.61, name=None):
-        epd = board.epd()
-        if epd in self.cache:
-            policy, value = self.cache[epd]
-        else:
-            # put all the child positions on the board
-            boards = [board.copy()]
+    def eval(self, board: chess.Board, softmax_temp=1.61, name=None, with_source=False):
+        """
+        (policy dict, value) for `board`. With `with_source`, also returns who
+        answered: `NET`, or the `KnownPositions` source (see `open_known_positions`).
+        """
+        resolved = self.resolve_known(board)
+        if resolved is not None:
+            policy, value, source = resolved
+            return (policy.to_dict(), value, source) if with_source else (policy.to_dict(), value)
+
+        key = position_key(board)
+
+        # --- The game has moved on: drop speculation queued for the previous position ---
+        prefetcher = self.prefetcher
+        if prefetcher is not None:
+            prefetcher.cancel()
 
-            # --- Compute actual inference ---
-            policies, values = self.process_boards(boards, name=name)
+        with self.lock:
+            entry = self.lookup(key)
+            if entry is not None:
+                policy, value = entry
+            else:
+                # put all the child positions on the board
+                boards = [board.copy()]
 
-            with torch.jit.optimized_execution(True):
-                with torch.no_grad():
-                    for i, b in enumerate(boards):
-                        inp = policies[i].unsqueeze(dim=0)
-                        policy = policy2moves(b, inp, softmax_temp=softmax_temp)
-                        value = values[i]
-                        value = self.value_to_scalar(value)
-                        self.cache[b.epd()] = [policy, value]
+                # --- Compute actual inference ---
+                policies, values = self.process_boards(boards, name=name)
+                retval_p, retval_v = self.decode_boards(boards, policies, values, softmax_temp=softmax_temp, keys=[key])
 
-            policy, value = self.cache[epd]
+                policy, value = retval_p[0], retval_v[0]
+        if prefetcher is not None:
+            prefetcher.record_lookup(key, entry is not None)
 
         # --- All this self.cache stuff is just caching "good moves" for positions ---
         # --- Doesn't really matter for Leela v World ---
         # get the best move and prefetch it
         tocache = []
+        priorities = []
 
-        for m, val in policy.items():
+        for m, val in zip(policy.moves, policy.probs):
             if val >= MIN_POLICY:
                 bd = board.copy()
-                bd.push_uci(m)
+                bd.push(m)
                 tocache.append(bd)
-        if (len(tocache) < 1):
-            m = max(policy, key = lambda k: policy[k])
+                priorities.append(val)
+        if (len(tocache) < 1) and (len(policy) > 0):
+            best = int(policy.probs.argmax())
             bd = board.copy()
-            bd.push_uci(m)
+            bd.push(policy.moves[best])
             tocache.append(bd)
-        self.cache_boards(tocache, softmax_temp=softmax_temp)
+            priorities.append(policy.probs[best])
+        if prefetcher is not None:
+            prefetcher.schedule(zip(priorities, tocache))
+        else:
+            with self.lock:
+                self.cache_boards(tocache, softmax_temp=softmax_temp)
 
         # return the values
-        return policy, value
-
-    def bulk_eval(self, boards, softmax_temp=1.61):
-
-        retval_p = []
-        retval_v = []
+        return (policy.to_dict(), value, NET) if with_source else (policy.to_dict(), value)
 
-        policies, values = self.process_boards(boards)
+    def bulk_eval(self, boards, softmax_temp=1.61, as_dict=True, with_source=False):
+        """
+        Evaluates `boards` in one batch. With `as_dict` unset, policies are
+        returned as compact `MovePolicy` objects rather than {uci: value} dicts.
+        Known positions (see `open_known_positions`) are answered without
+        inference; `with_source` adds a list of who answered each board.
+        """
+        boards = list(boards)
+        resolved = [self.resolve_known(board) for board in boards]
+        retval_p = [entry[0] if entry is not None else None for entry in resolved]
+        retval_v = [entry[1] if entry is not None else None for entry in resolved]
+        sources = [entry[2] if entry is not None else NET for entry in resolved]
 
-        with torch.jit.optimized_execution(True):
-            with torch.no_grad():
-                for i, b in enumerate(boards):
-                    inp = policies[i].unsqueeze(dim=0)
-                    policy = policy2moves(b, inp, softmax_temp=softmax_temp)
-                    value = values[i]
-                    value = self.value_to_scalar(value)
-                    retval_p.append(policy)
-                    retval_v.append(value)
-                    self.cache[b.epd()] = [policy, value]
+        unknown = [i for i, entry in enumerate(resolved) if entry is None]
+        if len(unknown) > 0:
+            unknown_boards = [boards[i] for i in unknown]
+            with self.lock:
+                policies, values = self.process_boards(unknown_boards)
+                policies, values = self.decode_boards(unknown_boards, policies, values, softmax_temp=softmax_temp)
+            for i, policy, value in zip(unknown, policies, values):
+                retval_p[i], retval_v[i] = policy, value
 
+        if as_dict:
+            retval_p = [policy.to_dict() for policy in retval_p]
+        if with_source:
+            return retval_p, retval_v, sources
         return retval_p, retval_v
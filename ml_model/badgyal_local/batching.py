@@ -0,0 +1,175 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import chess
+from badgyal_local.known_positions import NET
+from badgyal_local.position_cache import position_key
+
+MAX_BATCH = 64
+MAX_LATENCY = 0.005
+
+
+def result_tuple(policy, value, source, with_source):
+    return (policy.to_dict(), value, source) if with_source else (policy.to_dict(), value)
+
+
+class BatchingEvaluator:
+    """
+    Micro-batching front end for an `AbstractNet`.
+
+    Concurrent callers `submit` boards and get futures back. A single worker
+    thread coalesces pending requests until `max_batch` boards are queued or
+    `max_latency` seconds have passed since the first one, answers what it can
+    from the net's known positions (see `AbstractNet.open_known_positions`)
+    and cache, runs one forward pass for the rest and fans the (policy, value)
+    results back out. Duplicate positions within a batch are
+    evaluated once.
+
+    Net and cache access happens under `net.lock`, so the evaluator can share
+    a net with direct `eval` callers and its `Prefetcher`.
+    """
+
+    def __init__(self, net, max_batch=MAX_BATCH, max_latency=MAX_LATENCY, softmax_temp=1.61):
+        self.net = net
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.softmax_temp = softmax_temp
+        self.requests = queue.Queue()
+        # --- Guards `closed`, so nothing is queued behind the worker's stop sentinel ---
+        self.close_lock = threading.Lock()
+        self.closed = False
+
+        # --- Counters ---
+        self.num_batches = 0
+        self.num_boards = 0
+        self.num_forwarded = 0
+        self.num_known = 0
+
+        self.worker = threading.Thread(target=self.run, name="badgyal-batcher", daemon=True)
+        self.worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, board: chess.Board, with_source=False):
+        """
+        Queues `board` for evaluation. Returns a `Future` resolving to the same
+        (policy dict, value) pair, or with `with_source` (policy dict, value,
+        source) triple, that `AbstractNet.eval` would return. Raises
+        RuntimeError once the evaluator is closed.
+        """
+        future = Future()
+        with self.close_lock:
+            if self.closed:
+                raise RuntimeError("cannot submit to a closed BatchingEvaluator")
+            self.requests.put((board.copy(stack=False), future, with_source))
+        return future
+
+    def eval(self, board: chess.Board, with_source=False):
+        return self.submit(board, with_source).result()
+
+    async def eval_async(self, board: chess.Board, with_source=False):
+        return await asyncio.wrap_future(self.submit(board, with_source))
+
+    def close(self):
+        """
+        Stops the worker once all requests queued so far have been answered.
+        Later `submit` calls raise RuntimeError.
+        """
+        with self.close_lock:
+            if not self.closed:
+                self.closed = True
+                self.requests.put(None)
+        self.worker.join()
+
+    def stats(self):
+        return {
+            "batches": self.num_batches,
+            "boards": self.num_boards,
+            "forwarded": self.num_forwarded,
+            "known": self.num_known,
+            "mean_batch_size": self.num_boards / self.num_batches if self.num_batches > 0 else 0.0,
+        }
+
+    def next_batch(self):
+        """
+        Blocks for the first request, then collects more until the batch is
+        full or the latency deadline passes. Returns (batch, stop).
+        """
+        request = self.requests.get()
+        if request is None:
+            return [], True
+        batch = [request]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch, stop = self.next_batch()
+            if len(batch) > 0:
+                self.process_batch(batch)
+
+    def process_batch(self, batch):
+        self.num_batches += 1
+        self.num_boards += len(batch)
+
+        # --- Answer known positions and cached ones where possible, dedupe the rest by position ---
+        pending = {}
+        for board, future, with_source in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            resolved = self.net.resolve_known(board)
+            if resolved is not None:
+                self.num_known += 1
+                future.set_result(result_tuple(*resolved, with_source))
+                continue
+            key = position_key(board)
+            with self.net.lock:
+                entry = self.net.lookup(key)
+            if entry is not None:
+                policy, value = entry
+                future.set_result(result_tuple(policy, value, NET, with_source))
+            elif key in pending:
+                pending[key][1].append((future, with_source))
+            else:
+                pending[key] = (board, [(future, with_source)])
+
+        if len(pending) == 0:
+            return
+
+        # --- One forward pass for everything that is left ---
+        keys = list(pending.keys())
+        boards = [pending[key][0] for key in keys]
+        try:
+            with self.net.lock:
+                policies, values = self.net.process_boards(boards)
+                retval_p, retval_v = self.net.decode_boards(boards, policies, values,
+                                                            softmax_temp=self.softmax_temp, keys=keys)
+        except Exception as e:
+            for _, futures in pending.values():
+                for future, _ in futures:
+                    future.set_exception(e)
+            return
+        self.num_forwarded += len(boards)
+
+        for i, key in enumerate(keys):
+            for future, with_source in pending[key][1]:
+                future.set_result(result_tuple(retval_p[i], retval_v[i], NET, with_source))
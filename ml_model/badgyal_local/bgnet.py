@@ -16,13 +16,13 @@ SE=4
 
 class BGNet(AbstractNet):
 
-    def __init__(self, cuda=True, torchScript=False):
-        super().__init__(cuda=cuda, torchScript=torchScript)
+    def __init__(self, cuda=True, torchScript=False, snapshot=None):
+        super().__init__(cuda=cuda, torchScript=torchScript, snapshot=snapshot)
 
     def load_net(self):
         my_path = os.path.abspath(os.path.dirname(__file__))
         file = os.path.join(my_path, "badgyal-9.pb.gz")
-        net = model.Net(CHANNELS, BLOCKS, CHANNELS, SE, classical=True)
+        net = model.Net(CHANNELS, BLOCKS, CHANNELS, SE, classical=True, init_weights=False)
         net.import_proto_classical(file)
         # fix the rule50 weights
         net.conv_block[0].weight.data[:, 109, :, :] /= 99  # scale rule50 weights due to legacy reasons
@@ -1,6 +1,5 @@
 import chess
 import numpy as np
-import torch
 from time import time
 from math import exp
 from badgyal_local.policy_index import policy_index
@@ -162,18 +161,80 @@ def board2planes(board_: chess.Board):
     # --- Note that we actually need a flattened version of this, in
     # the format (C, W, H) for Nick's ZK stuff. I can explain that more
     # in detail if it doesn't make sense
+    import torch  # --- Deferred, so encoding-only tools never load torch ---
     return(torch.from_numpy(np.expand_dims(retval, axis=0)).float())
 
-def bulk_board2planes(boards):
-    planes = []
-    for b in boards:
-        temp = board2planes(b)
-        planes.append(temp)
-    pl = tuple(planes)
-    retval = torch.cat(pl, dim=0).contiguous()
+# --- Piece order for the bitboard encoder (must match DISPATCH above) ---
+PIECE_TYPES = [chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN, chess.KING]
+
+# --- Castling squares in plane order (104-107), from the side to move's perspective ---
+CASTLING_SQUARES = [chess.BB_H1, chess.BB_A1, chess.BB_H8, chess.BB_A8]
+
+def board2planes_fast(board_: chess.Board, out=None):
+    """
+    Bitboard-based equivalent of `board2planes`. Bit-identical output.
+
+    Reads the 12 occupancy bitboards straight off `board_` and unpacks them
+    into a (112, 8, 8) float32 buffer. `out` may be a preallocated buffer of
+    that shape (e.g. one row of a batch) which is written in place.
+    """
+    if out is None:
+        out = np.empty((112, 8, 8), dtype=np.float32)
+
+    # --- Side to move is always encoded as "white" ---
+    us = board_.turn
+    masks = np.array(
+        [board_.pieces_mask(pt, us) for pt in PIECE_TYPES] +
+        [board_.pieces_mask(pt, not us) for pt in PIECE_TYPES],
+        dtype="<u8").view(np.uint8).reshape(12, 8)
+    castling_rights = board_.castling_rights
+
+    # --- Square i lives at bit i, so mirroring vertically is just a byte (rank) swap ---
+    if not us:
+        masks = masks[:, ::-1]
+        castling_rights = chess.flip_vertical(castling_rights)
+
+    # --- Planes 0-12, then duplicated 8 times --> 104 ---
+    history = out[:104].reshape(8, 13, 64)
+    history[0, :12] = np.unpackbits(masks, axis=1, bitorder="little")
+    history[0, 12] = 0
+    history[1:] = history[0]
+
+    # --- Castling privileges, whose turn it is, then 0, 0, 1 --> 112 ---
+    for i, bb in enumerate(CASTLING_SQUARES):
+        out[104 + i] = bool(castling_rights & bb)
+    out[108] = not us
+    out[109] = 0
+    out[110] = 0
+    out[111] = 1
+
+    return out
+
+def bulk_board2planes(boards, out=None, pin_memory=False):
+    """
+    Encodes `boards` into one contiguous (N, 112, 8, 8) float32 tensor.
+
+    `out` may be a preallocated CPU tensor with at least N rows, which is
+    written in place and can be reused across calls (the first N rows are
+    returned). Otherwise a fresh tensor is allocated, optionally in pinned
+    memory for faster host -> GPU transfers.
+    """
+    boards = list(boards)
+    n = len(boards)
+    if out is None:
+        import torch  # --- Deferred, so encoding-only tools never load torch ---
+        out = torch.empty((n, 112, 8, 8), dtype=torch.float32, pin_memory=pin_memory)
+    elif out.size(0) < n:
+        raise ValueError(f"Buffer has room for {out.size(0)} boards, got {n}")
+    retval = out[:n]
+
+    # --- Each board is written straight into its row of the batch ---
+    planes = retval.numpy()
+    for i, b in enumerate(boards):
+        board2planes_fast(b, out=planes[i])
     return retval
 
-def policy2moves(board_: chess.Board, policy_tensor: torch.Tensor, softmax_temp = 1.61):
+def policy2moves(board_: chess.Board, policy_tensor: "torch.Tensor", softmax_temp = 1.61):
     if not board_.turn:
         board = board_.mirror()
     else:
@@ -221,7 +282,141 @@ def policy2moves(board_: chess.Board, policy_tensor: torch.Tensor, softmax_temp
     #         retval[uci] = retval[uci]/total
     return retval
 
+def make_policy_index_table():
+    """
+    Flat (promotion, from, to) --> policy index lookup table, from the side to
+    move's perspective. Knight promotions share the index of the plain move.
+    Entries that are not in `policy_index` are -1.
+    """
+    table = np.full((7, 64, 64), -1, dtype=np.int64)
+    for uci, idx in MOVE_MAP.items():
+        move = chess.Move.from_uci(uci)
+        table[move.promotion or 0, move.from_square, move.to_square] = idx
+        if move.promotion is None:
+            table[chess.KNIGHT, move.from_square, move.to_square] = idx
+    return table.reshape(-1)
+
+POLICY_INDEX_TABLE = make_policy_index_table()
+
+# --- Flat table keys, see `legal_move_indices` ---
+MIRROR_KEY = (56 << 6) | 56
+CASTLING_KEYS = {
+    (chess.E1 << 6) | chess.G1: (chess.E1 << 6) | chess.H1,
+    (chess.E1 << 6) | chess.C1: (chess.E1 << 6) | chess.A1,
+}
+
+def decode_move_key(key):
+    """
+    Inverse of the packed (promotion << 12 | from << 6 | to) move key.
+    """
+    key = int(key)
+    return chess.Move((key >> 6) & 63, key & 63, (key >> 12) or None)
+
+def legal_move_indices(board_: chess.Board):
+    """
+    Returns `board_`'s legal moves, their packed move keys (int16 array) and
+    their policy indices (int64 array), applying the same mirroring and
+    castling fixups as `policy2moves`.
+    """
+    moves = list(board_.legal_moves)
+    keys = np.array([((m.promotion or 0) << 12) | (m.from_square << 6) | m.to_square for m in moves],
+                    dtype=np.int16)
+    table_keys = keys.astype(np.int64)
+    king = board_.king(board_.turn)
+
+    # --- Mirror both squares so that the side to move is always "white" ---
+    if not board_.turn:
+        table_keys ^= MIRROR_KEY
+        king = None if king is None else chess.square_mirror(king)
+
+    # --- Castling is encoded as the king capturing its own rook ---
+    if king == chess.E1:
+        for castling_key, rook_key in CASTLING_KEYS.items():
+            table_keys[table_keys == castling_key] = rook_key
+
+    return moves, keys, POLICY_INDEX_TABLE[table_keys]
+
+def policy2moves_fast(board_: chess.Board, policy_tensor: "torch.Tensor", softmax_temp = 1.61, softmax = False):
+    """
+    Table-driven equivalent of `policy2moves`: every legal move's logit is
+    gathered with one fancy-index. With `softmax` set, the logits are turned
+    into probabilities over the legal moves at temperature `softmax_temp`.
+    """
+    moves, _, indices = legal_move_indices(board_)
+    policy = policy_tensor.numpy().reshape(-1)[indices]
+    if softmax and len(policy) > 0:
+        policy = np.exp((policy - policy.max()) / softmax_temp)
+        policy /= policy.sum()
+    return dict(zip([m.uci() for m in moves], policy.tolist()))
+
+class MovePolicy:
+    """
+    Compact policy over one board's legal moves: `keys` are packed moves (see
+    `decode_move_key`), `indices` policy indices and `probs` the matching
+    logits (or probabilities, if softmaxed). Unpacks as an `(indices, probs)` pair.
+    """
+    __slots__ = ("keys", "indices", "probs")
+
+    def __init__(self, keys, indices, probs):
+        self.keys = keys
+        self.indices = indices.astype(np.int16)
+        self.probs = probs
+
+    def __iter__(self):
+        yield self.indices
+        yield self.probs
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def moves(self):
+        return [decode_move_key(k) for k in self.keys]
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.indices.nbytes + self.probs.nbytes
+
+    def to_dict(self):
+        """
+        Materializes the {uci: value} dict that `policy2moves` returns.
+        """
+        return dict(zip([m.uci() for m in self.moves], self.probs.tolist()))
+
+def bulk_policy2moves(boards, policy_tensor: "torch.Tensor", softmax_temp = 1.61, softmax = False):
+    """
+    Batched `policy2moves_fast` for N boards and an (N, 1858) policy tensor.
+
+    The legal-move indices of all boards are packed into one padded (N, L)
+    matrix so every logit is gathered in a single operation. Returns one
+    `MovePolicy` per board.
+    """
+    boards = list(boards)
+    if len(boards) == 0:
+        return []
+    legal = [legal_move_indices(b) for b in boards]
+    lengths = np.array([len(moves) for moves, _, _ in legal], dtype=np.int64)
+
+    # --- Padded legal-move index matrix (padding points at index 0 and is masked out) ---
+    width = max(int(lengths.max()), 1)
+    mask = np.arange(width) < lengths[:, None]
+    index_matrix = np.zeros((len(boards), width), dtype=np.int64)
+    index_matrix[mask] = np.concatenate([indices for _, _, indices in legal])
+
+    policy = policy_tensor.numpy().reshape(len(boards), -1)
+    logits = np.take_along_axis(policy, index_matrix, axis=1)
+    if softmax:
+        logits = np.where(mask, logits, -np.inf)
+        # --- Boards without legal moves produce NaN rows, which are sliced away below ---
+        with np.errstate(invalid="ignore", divide="ignore"):
+            logits = np.exp((logits - logits.max(axis=1, keepdims=True)) / softmax_temp)
+            logits /= logits.sum(axis=1, keepdims=True)
+
+    return [MovePolicy(keys, indices, logits[i, :len(keys)].copy())
+            for i, (_, keys, indices) in enumerate(legal)]
+
 if __name__ == "__main__":
+    import torch
     print(MOVE_MAP)
 
     board = chess.Board(fen="rnbqkb1r/ppp1pppp/5n2/3pP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3")
@@ -238,3 +433,26 @@ if __name__ == "__main__":
     print((end-start)/REPS)
     print(planes.shape)
     #dump(planes)
+
+    # --- Same thing, but with the bitboard encoder ---
+    start = time()
+    REPS = 1000
+    buf = np.empty((112, 8, 8), dtype=np.float32)
+
+    for i in range(0,REPS):
+        board2planes_fast(board, out=buf)
+
+    end = time()
+
+    print(end-start)
+    print((end-start)/REPS)
+    assert torch.equal(torch.from_numpy(buf).unsqueeze(0), planes)
+
+    # --- Policy decoding: reference vs. table-driven ---
+    policy = torch.rand(1, len(policy_index))
+    for decode in [policy2moves, policy2moves_fast]:
+        start = time()
+        for i in range(0,REPS):
+            moves = decode(board, policy)
+        end = time()
+        print(decode.__name__, (end-start)/REPS)
@@ -0,0 +1,139 @@
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+import torch
+
+import badgyal_local.model as model
+from badgyal_local.board2planes import MovePolicy
+
+# --- Seconds a writer waits for another process holding the database lock ---
+BUSY_TIMEOUT = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evals (
+    namespace TEXT NOT NULL,
+    key INTEGER NOT NULL,
+    keys BLOB NOT NULL,
+    indices BLOB NOT NULL,
+    probs BLOB NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID
+"""
+
+
+def network_id(net: torch.nn.Module):
+    """
+    Content hash of a network's parameters and buffers, so two nets only share
+    cached evaluations if they hold exactly the same weights.
+    """
+    digest = hashlib.sha1()
+    for name, tensor in sorted(net.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(str(tensor.dtype).encode())
+        digest.update(str(tuple(tensor.shape)).encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def quantization_id(net: torch.nn.Module):
+    """
+    The quantization settings of `net` (see `model.QuantizationConfig`), or
+    "none" for networks without one.
+    """
+    config = getattr(net, "config", None)
+    if not isinstance(config, model.QuantizationConfig):
+        return "none"
+    return config.key()
+
+
+def to_signed(key):
+    # --- Zobrist keys are unsigned 64-bit, SQLite integers are signed ---
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+class DiskCache:
+    """
+    Persistent [policy, value] store keyed by (`namespace`, `position_key`).
+
+    Backed by a SQLite database in WAL mode, so several processes can read it
+    at once while one writes. `namespace` identifies the network and its
+    quantization settings (see `network_id` and `quantization_id`); entries
+    written under a different namespace are never returned.
+    """
+
+    def __init__(self, path, namespace):
+        self.path = path
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+        # --- Counters ---
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, key):
+        """
+        Returns the [MovePolicy, value] entry stored for `key`, or None.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT keys, indices, probs, value FROM evals WHERE namespace = ? AND key = ?",
+                (self.namespace, to_signed(key))).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        keys, indices, probs, value = row
+        policy = MovePolicy(np.frombuffer(keys, dtype=np.int16),
+                            np.frombuffer(indices, dtype=np.int16),
+                            np.frombuffer(probs, dtype=np.float64))
+        return [policy, value]
+
+    def put_many(self, items):
+        """
+        Stores (key, [MovePolicy, value]) pairs in one transaction.
+        """
+        rows = [(self.namespace, to_signed(key),
+                 policy.keys.astype(np.int16).tobytes(),
+                 policy.indices.astype(np.int16).tobytes(),
+                 policy.probs.astype(np.float64).tobytes(),
+                 float(value))
+                for key, (policy, value) in items]
+        if len(rows) == 0:
+            return
+        with self.lock:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.writes += len(rows)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM evals WHERE namespace = ?",
+                                           (self.namespace,)).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
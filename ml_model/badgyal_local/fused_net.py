@@ -0,0 +1,114 @@
+import copy
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import badgyal_local.model as model
+
+
+def fold_batchnorm(conv: nn.Conv2d, bn: nn.BatchNorm2d):
+    """
+    A single biased conv computing bn(conv(x)) with the inference-mode batchnorm statistics.
+    """
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = bn.bias - bn.running_mean * scale
+    if conv.bias is not None:
+        bias = bias + conv.bias * scale
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, padding=conv.padding,
+                      bias=True, dtype=conv.weight.dtype, device=conv.weight.device)
+    with torch.no_grad():
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias.copy_(bias)
+    return fused.to(memory_format=torch.channels_last)
+
+
+class FusedConvBlock(nn.Module):
+    def __init__(self, block: model.ConvBlock):
+        super().__init__()
+        self.conv = fold_batchnorm(block.conv, block.bn)
+
+    def forward(self, x):
+        return F.relu(self.conv(x), inplace=True)
+
+
+class FusedResidualBlock(nn.Module):
+    def __init__(self, block: model.ResidualBlock):
+        super().__init__()
+        layers = block.layers
+        self.conv1 = fold_batchnorm(layers.conv1, layers.bn1)
+        self.conv2 = fold_batchnorm(layers.conv2, layers.bn2)
+
+        # --- SE weights, transposed once for addmm ---
+        se = layers.se
+        self.channels = se.lin2.out_features // 2
+        self.register_buffer("se_weight1", se.lin1.weight.detach().t().contiguous())
+        self.register_buffer("se_bias1", se.lin1.bias.detach().clone())
+        self.register_buffer("se_weight2", se.lin2.weight.detach().t().contiguous())
+        self.register_buffer("se_bias2", se.lin2.bias.detach().clone())
+
+    def forward(self, x):
+        x_in = x
+        x = F.relu(self.conv1(x), inplace=True)
+        x = self.conv2(x)
+
+        # --- SE, residual and final ReLU: relu(sigmoid(scale) * x + shift + x_in) ---
+        pooled = x.mean(dim=(2, 3))
+        hidden = torch.addmm(self.se_bias1, pooled, self.se_weight1).relu_()
+        gates = torch.addmm(self.se_bias2, hidden, self.se_weight2)
+        scale, shift = gates[:, :self.channels, None, None], gates[:, self.channels:, None, None]
+        return torch.addcmul(x_in + shift, x, scale.sigmoid()).relu_()
+
+
+class FusedNet(nn.Module):
+    """
+    Inference-only build of a float (non-quantized) `model.Net`.
+
+    Batchnorms are folded into the preceding convs at build time, SE weights
+    are pre-transposed into contiguous buffers, and activations run in
+    channels-last layout. Outputs match `Net.forward` with `config.quantize`
+    unset up to floating point rounding; nothing is traced.
+    """
+
+    def __init__(self, net: model.Net):
+        super().__init__()
+        if net.quantized:
+            raise ValueError("FusedNet is the float path; build it from a net without quantized parameters")
+        self.config = model.QuantizationConfig(quantize=False, quantize_factor=net.config.quantize_factor,
+                                               sigmoid_piecewise_bound=net.config.sigmoid_piecewise_bound,
+                                               save_gather_index=False)
+        self.dtype = net.conv_block.conv.weight.dtype
+        self.conv_block = FusedConvBlock(net.conv_block)
+        self.residual_stack = nn.Sequential(*[FusedResidualBlock(block) for block in net.residual_stack])
+
+        if isinstance(net.policy_head, model.PolicyHead):
+            self.policy_conv_block = FusedConvBlock(net.policy_head.conv_block)
+            self.policy_conv = copy.deepcopy(net.policy_head.conv).to(memory_format=torch.channels_last)
+            self.register_buffer("policy_map", net.policy_head.policy_map[0].clone())
+            self.policy_linear = None
+        else:
+            conv_block, _, linear = net.policy_head.layers
+            self.policy_conv_block = FusedConvBlock(conv_block)
+            self.policy_conv = None
+            self.policy_linear = linear
+
+        value_head = net.value_head
+        self.value_conv_block = FusedConvBlock(value_head.conv_block)
+        self.value_lin1 = value_head.lin1
+        self.value_lin2 = value_head.lin2
+
+    def forward(self, x: torch.Tensor):
+        x = x.to(self.dtype).contiguous(memory_format=torch.channels_last)
+        x = self.conv_block(x)
+        x = self.residual_stack(x)
+
+        policy = self.policy_conv_block(x)
+        if self.policy_linear is None:
+            # --- reshape flattens in logical (N, C, H, W) order, as the gather index expects ---
+            policy = self.policy_conv(policy).reshape(policy.size(0), -1).index_select(1, self.policy_map)
+        else:
+            policy = self.policy_linear(policy.reshape(policy.size(0), -1))
+
+        value = self.value_conv_block(x).reshape(x.size(0), -1)
+        value = self.value_lin2(F.relu(self.value_lin1(value), inplace=True))
+        return policy, value
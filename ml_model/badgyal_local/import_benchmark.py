@@ -0,0 +1,44 @@
+import os
+import statistics
+import subprocess
+import sys
+
+# --- Entry points in rough order of weight ---
+MODULES = [
+    "badgyal_local",
+    "badgyal_local.policy_index",
+    "badgyal_local.board2planes",
+    "badgyal_local.model",
+    "badgyal_local.mgnet",
+]
+
+# --- Run in a fresh interpreter per sample, so nothing is already in sys.modules ---
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, "torch" in sys.modules)
+"""
+
+
+def import_time(module, repeats=5):
+    """
+    Median cold import time of `module` in seconds, and whether it loaded torch.
+    """
+    env = dict(os.environ)
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_parent, env.get("PYTHONPATH")]))
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], env=env,
+                                check=True, capture_output=True, text=True).stdout.split()
+        times.append(float(output[-2]))
+        loads_torch = output[-1] == "True"
+    return statistics.median(times), loads_torch
+
+
+if __name__ == "__main__":
+    modules = sys.argv[1:] or MODULES
+    for module in modules:
+        seconds, loads_torch = import_time(module)
+        print(f"{module:32} {seconds * 1000:8.1f} ms{'  (loads torch)' if loads_torch else ''}")
@@ -0,0 +1,271 @@
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import badgyal_local.model as model
+from badgyal_local.model import save_tensor_for_halo2
+from badgyal_local.tracing import get_tracer
+
+# --- float64 represents every integer up to 2^53 exactly ---
+FLOAT64_EXACT = 2 ** 53
+
+
+def is_power_of_two(n: int):
+    return n > 0 and n & (n - 1) == 0
+
+
+def trunc_div(x: torch.Tensor, divisor: int):
+    """
+    Integer equivalent of `torch.trunc(x / divisor)`.
+    """
+    if is_power_of_two(divisor):
+        # --- Bias negative values by divisor - 1 so the arithmetic shift rounds toward zero ---
+        shift = divisor.bit_length() - 1
+        return (x + ((x >> 63) & (divisor - 1))) >> shift
+    return torch.div(x, divisor, rounding_mode="trunc")
+
+
+def floor_div(x: torch.Tensor, divisor: int):
+    if is_power_of_two(divisor):
+        return x >> (divisor.bit_length() - 1)
+    return torch.div(x, divisor, rounding_mode="floor")
+
+
+def round_div(x: torch.Tensor, divisor: int):
+    """
+    Integer equivalent of `torch.round(x / divisor)` (round half to even).
+    """
+    q = floor_div(x, divisor)
+    twice_r = 2 * (x - q * divisor)
+    round_up = (twice_r > divisor) | ((twice_r == divisor) & ((q & 1) == 1))
+    return q + round_up.to(q.dtype)
+
+
+class ExactLinearOp(nn.Module):
+    """
+    A bias-free conv or linear layer applied exactly to int64 activations.
+
+    The weights are kept as (integer valued) float64 so the layer runs on the
+    float64 GEMM kernels. `weight_bound` bounds |output| / max|input|, so for
+    inputs up to `FLOAT64_EXACT / weight_bound` every partial sum is an exact
+    float64 integer. Larger inputs are split into base 2^k limbs that each
+    satisfy that bound, so the result is always the exact integer one.
+    """
+
+    def __init__(self, weight: torch.Tensor, conv_padding=None):
+        super().__init__()
+        self.register_buffer("weight", weight.detach().to(torch.float64).clone())
+        self.conv_padding = conv_padding
+        reduce_dims = tuple(range(1, weight.dim()))
+        self.weight_bound = max(int(self.weight.abs().sum(dim=reduce_dims).max().item()), 1)
+        self.max_exact_input = FLOAT64_EXACT // self.weight_bound
+
+    def apply_float(self, x: torch.Tensor):
+        if self.conv_padding is not None:
+            return F.conv2d(x, self.weight, padding=self.conv_padding)
+        return F.linear(x, self.weight)
+
+    def forward(self, x: torch.Tensor):
+        max_abs = int(x.abs().max().item()) if x.numel() > 0 else 0
+        if max_abs <= self.max_exact_input:
+            return self.apply_float(x.to(torch.float64)).to(torch.int64)
+        if self.max_exact_input < 2:
+            # --- Weights too large for any float64 limb: plain (slow) int64 kernels ---
+            if self.conv_padding is not None:
+                return F.conv2d(x, self.weight.to(torch.int64), padding=self.conv_padding)
+            return F.linear(x, self.weight.to(torch.int64))
+        base = 1 << (self.max_exact_input.bit_length() - 1)
+        high = floor_div(x, base)
+        low = x - high * base
+        return self.forward(high) * base + self.apply_float(low.to(torch.float64)).to(torch.int64)
+
+
+def to_int(t: torch.Tensor):
+    return t.detach().round().to(torch.int64).clone()
+
+
+class IntegerBatchNorm(nn.Module):
+    """
+    `model.cursed_batchnorm` in int64: trunc(((x + e_x) * coeff + beta) / Q).
+    """
+
+    def __init__(self, bn: nn.BatchNorm2d, quantize_factor: int):
+        super().__init__()
+        self.quantize_factor = quantize_factor
+        coeff = torch.round((bn.weight.reshape(1, -1, 1, 1) * quantize_factor) /
+                            torch.sqrt(bn.running_var.reshape(1, -1, 1, 1) + bn.eps))
+        self.register_buffer("coeff", to_int(coeff))
+        self.register_buffer("e_x", to_int(bn.running_mean.reshape(1, -1, 1, 1)))
+        self.register_buffer("beta", to_int(bn.bias.reshape(1, -1, 1, 1)))
+
+    def forward(self, x):
+        return trunc_div((x + self.e_x) * self.coeff + self.beta, self.quantize_factor)
+
+
+class IntegerConvBlock(nn.Module):
+    def __init__(self, block: model.ConvBlock, quantize_factor: int):
+        super().__init__()
+        self.quantize_factor = quantize_factor
+        self.conv = ExactLinearOp(block.conv.weight, conv_padding=block.conv.padding)
+        self.bn = IntegerBatchNorm(block.bn, quantize_factor)
+
+    def forward(self, x):
+        x = trunc_div(self.conv(x), self.quantize_factor)
+        save_tensor_for_halo2("conv_block.conv", x)
+        x = self.bn(x)
+        save_tensor_for_halo2("conv_block.bn", x)
+        x = x.clamp_min(0)
+        save_tensor_for_halo2("conv_block.relu", x)
+        return x
+
+
+class IntegerSqueezeExcitation(nn.Module):
+    def __init__(self, se: model.SqueezeExcitation, quantize_factor: int, sigmoid_bound):
+        super().__init__()
+        self.quantize_factor = quantize_factor
+        self.sigmoid_bound = sigmoid_bound
+        self.block_number = se.block_number
+        self.lin1 = ExactLinearOp(se.lin1.weight)
+        self.register_buffer("bias1", to_int(se.lin1.bias))
+        self.lin2 = ExactLinearOp(se.lin2.weight)
+        self.register_buffer("bias2", to_int(se.lin2.bias))
+
+    def sigmoid(self, x):
+        """
+        `model.cursed_sigmoid` in int64, including its value at exactly +bound.
+        """
+        q = self.quantize_factor
+        bound = self.sigmoid_bound
+        upper = torch.where(x > bound, torch.full_like(x, q), torch.where(x < bound, torch.zeros_like(x), x))
+        middle = math.floor(q * 0.5) + trunc_div(x, 4)
+        middle = torch.where((x < -bound) | (x > bound), torch.zeros_like(x), middle)
+        return middle + upper
+
+    def forward(self, x):
+        n, c, h, w = x.size()
+        name = f"residual_block_{self.block_number}.se_layer"
+        x_in = x
+
+        x = trunc_div(x.sum(dim=(2, 3)), h * w)
+        save_tensor_for_halo2(f"{name}.pool", x, dim_check=False)
+
+        x = trunc_div(self.lin1(x) + self.bias1, self.quantize_factor)
+        save_tensor_for_halo2(f"{name}.lin1", x, dim_check=False)
+        x = x.clamp_min(0)
+        save_tensor_for_halo2(f"{name}.relu", x, dim_check=False)
+        x = trunc_div(self.lin2(x) + self.bias2, self.quantize_factor)
+        save_tensor_for_halo2(f"{name}.lin2", x, dim_check=False)
+
+        scale, shift = x.view(n, 2 * c, 1, 1).chunk(2, dim=1)
+        save_tensor_for_halo2(f"{name}.scale", scale)
+        save_tensor_for_halo2(f"{name}.shift", shift)
+
+        scale_sigmoid = self.sigmoid(scale)
+        save_tensor_for_halo2(f"{name}.scale_sigmoid", scale_sigmoid)
+        scaled_x_in = scale_sigmoid * x_in
+        save_tensor_for_halo2(f"{name}.scaled_x_in", scaled_x_in)
+        quantized = trunc_div(scaled_x_in, self.quantize_factor)
+        save_tensor_for_halo2(f"{name}.quantized", quantized)
+        x = quantized + shift
+        save_tensor_for_halo2(f"{name}.quantized_and_shifted", x)
+        return x
+
+
+class IntegerResidualBlock(nn.Module):
+    def __init__(self, block: model.ResidualBlock, quantize_factor: int, sigmoid_bound):
+        super().__init__()
+        self.quantize_factor = quantize_factor
+        self.block_number = block.block_number
+        layers = block.layers
+        self.conv1 = ExactLinearOp(layers.conv1.weight, conv_padding=layers.conv1.padding)
+        self.bn1 = IntegerBatchNorm(layers.bn1, quantize_factor)
+        self.conv2 = ExactLinearOp(layers.conv2.weight, conv_padding=layers.conv2.padding)
+        self.bn2 = IntegerBatchNorm(layers.bn2, quantize_factor)
+        self.se = IntegerSqueezeExcitation(layers.se, quantize_factor, sigmoid_bound)
+
+    def forward(self, x):
+        name = f"residual_block_{self.block_number}"
+        x_in = x
+        x = trunc_div(self.conv1(x), self.quantize_factor)
+        save_tensor_for_halo2(f"{name}.conv1", x)
+        x = self.bn1(x)
+        save_tensor_for_halo2(f"{name}.bn1", x)
+        x = x.clamp_min(0)
+        save_tensor_for_halo2(f"{name}.relu1", x)
+        x = trunc_div(self.conv2(x), self.quantize_factor)
+        save_tensor_for_halo2(f"{name}.conv2", x)
+        x = self.bn2(x)
+        save_tensor_for_halo2(f"{name}.bn2", x)
+        x = self.se(x)
+        x = x + x_in
+        save_tensor_for_halo2(f"{name}.residual", x)
+        x = x.clamp_min(0)
+        save_tensor_for_halo2(f"{name}.relu2", x)
+        return x
+
+
+class IntegerNet(nn.Module):
+    """
+    Runs a quantized `model.Net` (see `Net.quantize_parameters`) on int64
+    activations, with the circuit's rounding and truncation at every step.
+
+    Outputs and captured intermediates (see `tracing`) match the float64
+    emulation in `Net.forward` (with `config.quantize` set) wherever the
+    latter is exact, and stay exact beyond 2^53 where it is not. Only the
+    convolutional policy head and the classical value head (what the Halo2
+    circuit implements) are supported.
+    """
+
+    def __init__(self, net: model.Net):
+        super().__init__()
+        if not net.quantized:
+            raise ValueError("IntegerNet needs a net with quantized parameters (see Net.quantize_parameters)")
+        if not isinstance(net.policy_head, model.PolicyHead) or not isinstance(net.value_head, model.ValueHeadClassical):
+            raise NotImplementedError("IntegerNet supports the convolutional policy head and classical value head only")
+        self.config = net.config
+        self.quantize_factor = net.config.quantize_factor
+        sigmoid_bound = net.config.sigmoid_piecewise_bound * self.quantize_factor
+        self.model_name = net.model_name
+
+        self.conv_block = IntegerConvBlock(net.conv_block, self.quantize_factor)
+        self.residual_stack = nn.Sequential(*[IntegerResidualBlock(block, self.quantize_factor, sigmoid_bound)
+                                              for block in net.residual_stack])
+
+        policy_head = net.policy_head
+        self.policy_conv_block = IntegerConvBlock(policy_head.conv_block, self.quantize_factor)
+        self.policy_conv = ExactLinearOp(policy_head.conv.weight, conv_padding=policy_head.conv.padding)
+        self.register_buffer("policy_bias", to_int(policy_head.conv.bias.reshape(1, -1, 1, 1)))
+        self.register_buffer("policy_map", policy_head.policy_map.clone())
+
+        value_head = net.value_head
+        self.value_conv_block = IntegerConvBlock(value_head.conv_block, self.quantize_factor)
+        self.value_lin1 = ExactLinearOp(value_head.lin1.weight)
+        self.register_buffer("value_bias1", to_int(value_head.lin1.bias))
+        self.value_lin2 = ExactLinearOp(value_head.lin2.weight)
+        self.register_buffer("value_bias2", to_int(value_head.lin2.bias))
+
+    def forward(self, x: torch.Tensor):
+        q = self.quantize_factor
+        x = torch.round(x.to(torch.float64) * q).to(torch.int64)
+        save_tensor_for_halo2("input", x)
+
+        x = self.conv_block(x)
+        x = self.residual_stack(x)
+
+        # --- Policy head ---
+        policy = self.policy_conv_block(x)
+        policy = round_div(self.policy_conv(policy) + self.policy_bias, q)
+        save_tensor_for_halo2("policy_head.conv", policy)
+        policy = policy.reshape(policy.size(0), -1).index_select(1, self.policy_map[0])
+        save_tensor_for_halo2("policy_head.gather", policy, dim_check=False)
+        save_tensor_for_halo2("output", policy, dim_check=False)
+
+        # --- Value head ---
+        value = self.value_conv_block(x).flatten(1)
+        value = trunc_div(self.value_lin1(value) + self.value_bias1, q).clamp_min(0)
+        value = trunc_div(self.value_lin2(value) + self.value_bias2, q)
+
+        get_tracer().end_forward(self.model_name)
+        return policy.to(torch.float64) / q, value.to(torch.float64) / q
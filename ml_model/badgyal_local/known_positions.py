@@ -0,0 +1,122 @@
+import threading
+
+import chess
+import chess.polyglot
+import chess.syzygy
+import numpy as np
+
+from badgyal_local.board2planes import MovePolicy, legal_move_indices
+
+BOOK = "book"
+TABLEBASE = "tablebase"
+# --- Source of positions neither knows ---
+NET = "net"
+
+# --- Syzygy WDL (side to move) -> value; cursed wins and blessed losses are draws under the 50-move rule ---
+WDL_VALUES = {2: 1.0, 1: 0.0, 0: 0.0, -1: 0.0, -2: -1.0}
+
+
+class KnownPositions:
+    """
+    Answers positions with a known result before they reach the net: opening
+    positions from a Polyglot book at `book_path`, and endgames from the
+    Syzygy tables in `tablebase_path` (a directory, or several separated by
+    `os.pathsep`). Either may be None.
+
+    `resolve` returns a `MovePolicy` and value, as `AbstractNet.bulk_eval`
+    would, plus the source (`BOOK` or `TABLEBASE`) that answered, or None
+    when neither knows the position. Policies hold log-probabilities (-inf
+    for moves never played), so they rank and softmax like the net's logits.
+    Book positions carry no evaluation and get a value of 0.0.
+    """
+
+    def __init__(self, book_path=None, tablebase_path=None):
+        self.book_path = book_path
+        self.tablebase_path = tablebase_path
+        # --- Both readers seek a shared file handle ---
+        self.lock = threading.Lock()
+        self.book = chess.polyglot.open_reader(book_path) if book_path is not None else None
+        self.tablebase = chess.syzygy.open_tablebase(tablebase_path) if tablebase_path is not None else None
+
+        # --- Counters ---
+        self.hits = {BOOK: 0, TABLEBASE: 0}
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def resolve(self, board: chess.Board):
+        with self.lock:
+            for source, probe in ((BOOK, self.probe_book), (TABLEBASE, self.probe_tablebase)):
+                resolved = probe(board)
+                if resolved is not None:
+                    self.hits[source] += 1
+                    probs, value = resolved
+                    return self.move_policy(board, probs), value, source
+            self.misses += 1
+        return None
+
+    @staticmethod
+    def move_policy(board: chess.Board, probs: dict):
+        moves, keys, indices = legal_move_indices(board)
+        with np.errstate(divide="ignore"):
+            log_probs = np.log(np.array([probs.get(move, 0.0) for move in moves], dtype=np.float64))
+        return MovePolicy(keys, indices, log_probs)
+
+    def probe_book(self, board: chess.Board):
+        if self.book is None:
+            return None
+        weights = dict()
+        for entry in self.book.find_all(board):
+            weights[entry.move] = weights.get(entry.move, 0) + entry.weight
+        if len(weights) == 0:
+            return None
+        total = sum(weights.values())
+        return {move: weight / total for move, weight in weights.items()}, 0.0
+
+    def probe_tablebase(self, board: chess.Board):
+        if self.tablebase is None or board.is_game_over():
+            return None
+        try:
+            value = WDL_VALUES[self.tablebase.probe_wdl(board)]
+            best = max(board.legal_moves, key=lambda move: self.tablebase_move_score(board, move))
+        except KeyError:
+            # --- Missing tables, too many pieces or castling rights ---
+            return None
+        return {best: 1.0}, value
+
+    def tablebase_move_score(self, board: chess.Board, move: chess.Move):
+        """
+        Sort key for `move`, best highest: mate, then the best WDL, then the
+        fastest win (zeroing moves first) or the slowest loss.
+        """
+        zeroing = board.is_zeroing(move)
+        board.push(move)
+        try:
+            if board.is_checkmate():
+                return (1, 0, 0, 0)
+            wdl = -self.tablebase.probe_wdl(board)
+            dtz = -self.tablebase.probe_dtz(board) if wdl != 0 else 0
+        finally:
+            board.pop()
+        prefer_zeroing = zeroing if wdl > 0 else not zeroing if wdl < 0 else False
+        return (0, wdl, prefer_zeroing, -dtz)
+
+    def close(self):
+        with self.lock:
+            if self.book is not None:
+                self.book.close()
+            if self.tablebase is not None:
+                self.tablebase.close()
+
+    def stats(self):
+        lookups = sum(self.hits.values()) + self.misses
+        return {
+            "book_hits": self.hits[BOOK],
+            "tablebase_hits": self.hits[TABLEBASE],
+            "misses": self.misses,
+            "hit_rate": sum(self.hits.values()) / lookups if lookups > 0 else 0.0,
+        }
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import functools
 import sys
 import numpy as np
 from badgyal_local.policy_index import policy_index
@@ -9,6 +10,7 @@ promotions = 'rbq' # N is encoded as normal move
 
 col_index = {columns[i] : i for i in range(len(columns))}
 row_index = {rows[i] : i for i in range(len(rows))}
+move_index = {m : i for i, m in enumerate(policy_index)}
 
 def index_to_position(x):
     return columns[x[0]] + rows[x[1]]
@@ -84,8 +86,9 @@ def make_map(kind='matrix'):
                     else:
                         moves.append(start+end+promotion)
 
+    move_set = set(moves)
     for m in policy_index:
-        if m not in moves:
+        if m not in move_set:
             raise ValueError('Missing move: {}'.format(m))
 
     az_to_lc0 = np.zeros((80*8*8, len(policy_index)), dtype=np.float32)
@@ -97,22 +100,32 @@ def make_map(kind='matrix'):
             continue
         legal_moves += 1
         # Check for missing moves
-        if m not in policy_index:
+        if m not in move_index:
             raise ValueError('Missing move: {}'.format(m))
-        i = policy_index.index(m)
+        i = move_index[m]
         indices.append(i)
         az_to_lc0[e][i] = 1
 
     assert legal_moves == len(policy_index)
     assert np.sum(az_to_lc0) == legal_moves
-    for e in range(80*8*8):
-        for i in range(len(policy_index)):
-            pass
     if kind == 'matrix':
         return az_to_lc0
     elif kind == 'index':
         return indices
 
+@functools.lru_cache(maxsize=None)
+def gather_index():
+    """
+    For each lc0 policy index, the position of its move in the flattened
+    (80, 8, 8) AZ conv policy. Built once per process; the array is read-only.
+    """
+    az_to_lc0 = np.array(make_map('index'), dtype=np.int64)
+    legal = np.flatnonzero(az_to_lc0 != -1)
+    index = np.empty(len(policy_index), dtype=np.int64)
+    index[az_to_lc0[legal]] = legal
+    index.flags.writeable = False
+    return index
+
 if __name__ == "__main__":
     # Generate policy map include file for lc0
     if len(sys.argv) != 2:
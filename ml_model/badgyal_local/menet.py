@@ -16,12 +16,12 @@ SE=6
 
 class MENet(WDLNet):
 
-    def __init__(self, cuda=True, torchScript=False):
-        super().__init__(cuda=cuda, torchScript=torchScript)
+    def __init__(self, cuda=True, torchScript=False, snapshot=None):
+        super().__init__(cuda=cuda, torchScript=torchScript, snapshot=snapshot)
 
     def load_net(self):
         my_path = os.path.abspath(os.path.dirname(__file__))
         file = os.path.join(my_path, "ME.pb.gz")
-        net = model.Net(CHANNELS, BLOCKS, CHANNELS, SE)
+        net = model.Net(CHANNELS, BLOCKS, CHANNELS, SE, init_weights=False)
         net.import_proto_classical(file)
         return net
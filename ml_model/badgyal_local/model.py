@@ -4,11 +4,16 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.nn.init as init
+import hashlib
 import math
+import numpy as np
+import os
 
 import badgyal_local.lc0_az_policy_map as lc0_az_policy_map
 import badgyal_local.net as proto_net
 import badgyal_local.proto.net_pb2 as pb
+from badgyal_local.tensor_file import dump_json, flatten_names, write_tensor_file
+from badgyal_local.tracing import get_tracer
 
 import json
 
@@ -21,29 +26,38 @@ QUANTIZE_FACTOR = 1024 ** 2
 SIGMOID_PIECEWISE_BOUND = 2
 
 SAVE_GATHER_INDEX_AS_JSON = True
+GATHER_INDEX_PATH = "gather_index.json"
 
-# --- Hacky af, but it works ---
-max_abs_intermediate_value = -1
 
-# --- Also hacky af, but it works ---
-all_intermediate_values = OrderedDict()
-SAVE_INTERMEDIATE_VALUES = True
-SAVE_INTERMEDIATE_VALUES_VERBOSE = True
+class QuantizationConfig:
+    """
+    Quantization settings of one `Net`, shared with all of its submodules.
+    The module-level constants above are only the defaults for new configs,
+    so a float net and a circuit-exact quantized net can be used side by side.
+    """
+
+    def __init__(self, quantize=None, quantize_factor=None, sigmoid_piecewise_bound=None, save_gather_index=None):
+        self.quantize = QUANTIZE_NETWORKS if quantize is None else quantize
+        self.quantize_factor = QUANTIZE_FACTOR if quantize_factor is None else quantize_factor
+        self.sigmoid_piecewise_bound = SIGMOID_PIECEWISE_BOUND if sigmoid_piecewise_bound is None else sigmoid_piecewise_bound
+        self.save_gather_index = SAVE_GATHER_INDEX_AS_JSON if save_gather_index is None else save_gather_index
+
+    def key(self):
+        """
+        The settings that change network outputs, as a short string.
+        """
+        return f"q{int(self.quantize)}-f{self.quantize_factor}-s{self.sigmoid_piecewise_bound}"
+
+    def __repr__(self):
+        return (f"QuantizationConfig(quantize={self.quantize}, quantize_factor={self.quantize_factor}, "
+                f"sigmoid_piecewise_bound={self.sigmoid_piecewise_bound}, save_gather_index={self.save_gather_index})")
 
-def print_max_abs_value(context: str, named_tensors: dict[str, torch.Tensor], do_print=True):
+
+def print_max_abs_value(context: str, named_tensors: dict[str, torch.Tensor]):
     """
-    For sanitychecking.
+    For sanitychecking. Recorded by the active tracer (see `tracing.trace`), a no-op otherwise.
     """
-    # return
-    global max_abs_intermediate_value
-    if do_print:
-        print(f"\n--- Printing max values for {context} ---")
-    for name, tensor in named_tensors.items():
-        tensor_max_abs_value = torch.max(torch.abs(tensor)).item()
-        if do_print:
-            print("Max abs value entry of tensor " + name + ": " + str(tensor_max_abs_value))
-        # --- For logging overall max ---
-        max_abs_intermediate_value = max(max_abs_intermediate_value, tensor_max_abs_value)
+    get_tracer().check_range(context, named_tensors)
 
 
 def near_zero_sigmoid_approx(x: torch.Tensor, quantize_factor=QUANTIZE_FACTOR):
@@ -57,11 +71,11 @@ def near_zero_sigmoid_approx(x: torch.Tensor, quantize_factor=QUANTIZE_FACTOR):
     )
 
 
-def cursed_sigmoid(x: torch.Tensor, quantize_factor=QUANTIZE_FACTOR):
+def cursed_sigmoid(x: torch.Tensor, quantize_factor=QUANTIZE_FACTOR, sigmoid_piecewise_bound=SIGMOID_PIECEWISE_BOUND):
     """
     Applies a piecewise polynomial approximation to sigmoid.
     """
-    piecewise_bound = SIGMOID_PIECEWISE_BOUND * quantize_factor
+    piecewise_bound = sigmoid_piecewise_bound * quantize_factor
     middle = x.detach().clone()
     upper = x.detach().clone()
 
@@ -70,7 +84,7 @@ def cursed_sigmoid(x: torch.Tensor, quantize_factor=QUANTIZE_FACTOR):
     upper[x > piecewise_bound] = quantize_factor
 
     # --- Otherwise, use approximation x / 4 + 0.5 ---
-    middle = near_zero_sigmoid_approx(middle)
+    middle = near_zero_sigmoid_approx(middle, quantize_factor)
 
     # --- Set anything not in range of `-piecewise_bound, piecewise_bound` to 0
     middle[x < -1 * piecewise_bound] = 0
@@ -122,83 +136,91 @@ def export_parameter_to_flattened_list(module_parameter: nn.Parameter):
     return list(math.floor(x.item()) for x in module_parameter.flatten())
 
 
-def save_tensor_helper(storage_subdict: dict, name: str, flattened_list: list):
+def export_parameter_to_array(module_parameter: nn.Parameter):
     """
-    Recursive helper fn for saving.
+    Vectorized `export_parameter_to_flattened_list`: the floored values as one flat int64 array.
     """
-    if "." not in name:
-        storage_subdict[name] = flattened_list
-    else:
-        key, subname = name.split(".", maxsplit=1)
-        if key not in storage_subdict:
-            storage_subdict[key] = dict()
-        save_tensor_helper(storage_subdict[key], subname, flattened_list)
+    return np.floor(module_parameter.detach().cpu().numpy()).astype(np.int64).ravel()
 
 
-def save_tensor_for_halo2(name: str, tensor: torch.Tensor, dim_check=True, conv_weight=False):
-    """
-    Writes flattened version of tensor if `dim_check` is set to True to global storage var.
+def gather_index_hash(policy_map: torch.Tensor):
+    return hashlib.sha256(export_parameter_to_array(policy_map).astype("<i8").tobytes()).hexdigest()
+
 
-    NOTE: Conv (weight) is (C_out, C_in, H, W) --> (C_in, H, W, C_out)
-        .permute(3, 0, 1, 2)
-    NOTE: Conv data is (1, C, H, W) --> (1, C, W, H)
-        .permute(0, 1, 3, 2)
+def write_gather_index(policy_map: torch.Tensor, path=GATHER_INDEX_PATH):
     """
-    global all_intermediate_values
-    if SAVE_INTERMEDIATE_VALUES:
-        if SAVE_INTERMEDIATE_VALUES_VERBOSE:
-            print(f"Saving tensor {name}...")
-        if dim_check:
-            # --- Append batch dim ---
-            if len(tensor.shape) == 3:
-                tensor = tensor.unsqueeze(0)
-            if len(tensor.shape) != 4:
-                raise RuntimeError(f"You goofed! Tensor is not 4-dimensional. Name: {name} | Tensor shape: {tensor.shape}")
-            if conv_weight:
-                tensor_list_repr = export_parameter_to_flattened_list(tensor.permute(3, 0, 1, 2))
-            else:
-                tensor_list_repr = export_parameter_to_flattened_list(tensor.permute(0, 1, 3, 2))
-            save_tensor_helper(all_intermediate_values, name, tensor_list_repr)
-        else:
-            tensor_list_repr = export_parameter_to_flattened_list(tensor)
-            save_tensor_helper(all_intermediate_values, name, tensor_list_repr)
+    Writes the lc0 policy gather index as {"gather_index": [int, ...]} to `path`,
+    with its sha256 in `path + ".sha256"`. Skips the write (and returns False)
+    when the file on disk already has that hash.
+    """
+    digest = gather_index_hash(policy_map)
+    hash_path = path + ".sha256"
+    if os.path.exists(path) and os.path.exists(hash_path):
+        with open(hash_path) as f:
+            if f.read().strip() == digest:
+                return False
+    print(f"Saving gather index as a list to {path}...")
+    with open(path, "w") as f:
+        json.dump({"gather_index": export_parameter_to_flattened_list(policy_map)}, f)
+    with open(hash_path, "w") as f:
+        f.write(digest + "\n")
+    return True
+
+
+def arrays_to_lists(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, tuple):
+        return tuple(arrays_to_lists(x) for x in obj)
+    if isinstance(obj, dict):
+        return type(obj)((k, arrays_to_lists(v)) for k, v in obj.items())
+    return obj
 
 
-def save_all_intermediate_tensors(filename: str):
+def save_tensor_for_halo2(name: str, tensor: torch.Tensor, dim_check=True, conv_weight=False):
     """
-    Writes all intermediate tensors to file
+    Hands the tensor to the active tracer (see `tracing.CaptureTracer.save`), a no-op otherwise.
     """
-    global all_intermediate_values
-    with open(filename, "w") as f:
-        json.dump(all_intermediate_values, f)
+    get_tracer().save(name, tensor, dim_check=dim_check, conv_weight=conv_weight)
 
 
 class Net(nn.Module):
-    def __init__(self, residual_channels, residual_blocks, policy_channels, se_ratio, classical=False, classicalPolicy=False):
+    def __init__(self, residual_channels, residual_blocks, policy_channels, se_ratio, classical=False, classicalPolicy=False,
+                 config=None, init_weights=True):
         super().__init__()
+        self.config = config if config is not None else QuantizationConfig()
+        config = self.config
         channels = residual_channels
         self.residual_blocks = residual_blocks
+        self.model_name = None
+        self.quantized = False
+        # --- Constructor arguments, so `snapshot` can rebuild the module tree ---
+        self.architecture = dict(residual_channels=residual_channels, residual_blocks=residual_blocks,
+                                 policy_channels=policy_channels, se_ratio=se_ratio, classical=classical,
+                                 classicalPolicy=classicalPolicy)
 
-        self.conv_block = ConvBlock(112, channels, 3, padding=1)
+        self.conv_block = ConvBlock(112, channels, 3, padding=1, config=config)
 
-        blocks = [(f'block{i+1}', ResidualBlock(channels, se_ratio, i)) for i in range(residual_blocks)]
+        blocks = [(f'block{i+1}', ResidualBlock(channels, se_ratio, i, config=config)) for i in range(residual_blocks)]
         self.residual_stack = nn.Sequential(OrderedDict(blocks))
         print(blocks)
 
         if classicalPolicy:
             # print(f"Using classical policy head")
-            self.policy_head = PolicyHeadClassical(channels, policy_channels)
+            self.policy_head = PolicyHeadClassical(channels, policy_channels, config=config)
         else:
             # print(f"Using non-classical policy head")
-            self.policy_head = PolicyHead(channels, policy_channels)
+            self.policy_head = PolicyHead(channels, policy_channels, config=config)
         if classical:
             # print(f"Using classical value head")
-            self.value_head = ValueHeadClassical(channels, 32, 128)
+            self.value_head = ValueHeadClassical(channels, 32, 128, config=config)
         else:
             # print(f"Using non-classical value head")
-            self.value_head = ValueHead(channels, 32, 128)
+            self.value_head = ValueHead(channels, 32, 128, config=config)
 
-        self.reset_parameters()
+        # --- Skipped by the proto loaders, which overwrite every weight anyway ---
+        if init_weights:
+            self.reset_parameters()
 
     def reset_parameters(self):
         for module in self.modules():
@@ -211,39 +233,33 @@ class Net(nn.Module):
                 init.zeros_(module.bias)
 
     def quantize_parameters(self):
-        print(f"Quantizing model weights! Quantize factor: {QUANTIZE_FACTOR}")
+        print(f"Quantizing model weights! Quantize factor: {self.config.quantize_factor}")
+        self.quantized = True
         for name, module in self.named_modules():
             if isinstance(module, nn.Conv2d) or isinstance(module, nn.Linear):
-                module.weight = nn.Parameter(torch.round(module.weight * QUANTIZE_FACTOR).double())
+                module.weight = nn.Parameter(torch.round(module.weight * self.config.quantize_factor).double())
                 if module.bias is not None:
-                    module.bias = nn.Parameter(torch.round(module.bias * QUANTIZE_FACTOR ** 2).double())
+                    module.bias = nn.Parameter(torch.round(module.bias * self.config.quantize_factor ** 2).double())
                 # print(f"Just quantized layer: {name}!")
             if isinstance(module, nn.BatchNorm2d):
-                module.weight = nn.Parameter(torch.round(module.weight * QUANTIZE_FACTOR).double())
-                module.bias = nn.Parameter(torch.round(module.bias * QUANTIZE_FACTOR ** 2).double())
+                module.weight = nn.Parameter(torch.round(module.weight * self.config.quantize_factor).double())
+                module.bias = nn.Parameter(torch.round(module.bias * self.config.quantize_factor ** 2).double())
                 # module.eps = nn.Parameter(round(module.eps * QUANTIZE_FACTOR))
-                module.running_mean = nn.Parameter(torch.round(-1 * module.running_mean * QUANTIZE_FACTOR).double())
-                module.running_var = nn.Parameter(torch.round(module.running_var * QUANTIZE_FACTOR ** 2).double())
+                module.running_mean = nn.Parameter(torch.round(-1 * module.running_mean * self.config.quantize_factor).double())
+                module.running_var = nn.Parameter(torch.round(module.running_var * self.config.quantize_factor ** 2).double())
                 # print(f"Just quantized layer: {name}!")
 
     def set_model_name(self, model_name: str):
         """
-        Should call this before saving!!
+        Names the intermediates files written by a `CaptureTracer` with a `path_template`.
         """
         self.model_name = model_name
 
     def forward(self, x: torch.Tensor):
 
-        # --- To ensure correct saving ---
-        assert self.model_name is not None
-
-        # --- For range checking intermediate values ---
-        global max_abs_intermediate_value
-
         # --- Quantize model inputs ---
-        if QUANTIZE_NETWORKS:
-            max_abs_intermediate_value = -1
-            x = torch.round(x * QUANTIZE_FACTOR).double()
+        if self.config.quantize:
+            x = torch.round(x * self.config.quantize_factor).double()
 
         # --- Save input if needed ---
         save_tensor_for_halo2("input", x)
@@ -262,18 +278,14 @@ class Net(nn.Module):
         # --- Save policy head as output ---
         save_tensor_for_halo2("output", policy, dim_check=False)
 
-        if QUANTIZE_NETWORKS:
-            policy = policy / QUANTIZE_FACTOR
+        if self.config.quantize:
+            policy = policy / self.config.quantize_factor
 
         value = self.value_head(x)
-        if QUANTIZE_NETWORKS:
-            value = value / QUANTIZE_FACTOR
-
-        if QUANTIZE_NETWORKS:
-            print(f"\n----- Max over everything!!! {max_abs_intermediate_value} -----\n")
+        if self.config.quantize:
+            value = value / self.config.quantize_factor
 
-        if SAVE_INTERMEDIATE_VALUES:
-            save_all_intermediate_tensors(f"{self.model_name}_intermediates_new.json")
+        get_tracer().end_forward(self.model_name)
 
         return policy, value
 
@@ -358,6 +370,12 @@ class Net(nn.Module):
             }
         }
         """
+        return arrays_to_lists(self.export_arrays_for_halo2())
+
+    def export_arrays_for_halo2(self):
+        """
+        `export_to_json_for_halo2` with flat int64 arrays instead of int lists as leaves.
+        """
         json_dict = self.setup_json_dict_for_halo2()
         print(json_dict.keys())
         for name, module in self.named_modules():
@@ -368,30 +386,45 @@ class Net(nn.Module):
                 json_subdict = self.compute_correct_subdict(json_dict, name)
                 
                 # C_o, C_i, H, W --> C_i, W, H, C_o
-                json_subdict["weight"] = export_parameter_to_flattened_list(module.weight.permute(1, 3, 2, 0))
+                json_subdict["weight"] = export_parameter_to_array(module.weight.permute(1, 3, 2, 0))
                 json_subdict["weight_shape"] = list(module.weight.permute(1, 3, 2, 0).shape)
                 if module.bias is not None:
-                    json_subdict["bias"] = export_parameter_to_flattened_list(module.bias)
+                    json_subdict["bias"] = export_parameter_to_array(module.bias)
             elif isinstance(module, nn.Linear):
                 # --- Get effective save path ---
                 json_subdict = self.compute_correct_subdict(json_dict, name)
-                json_subdict["weight"] = export_parameter_to_flattened_list(module.weight)
+                json_subdict["weight"] = export_parameter_to_array(module.weight)
                 json_subdict["weight_shape"] = list(module.weight.shape)
                 if module.bias is not None:
-                    json_subdict["bias"] = export_parameter_to_flattened_list(module.bias)
+                    json_subdict["bias"] = export_parameter_to_array(module.bias)
             elif isinstance(module, nn.BatchNorm2d):
                 # --- Get effective save path ---
                 json_subdict = self.compute_correct_subdict(json_dict, name)
                 beta, gamma = module.bias, module.weight
                 var_x, e_x = module.running_var, module.running_mean
-                coeff = torch.round((gamma * QUANTIZE_FACTOR) / (torch.sqrt(var_x + module.eps)))
-                json_subdict["coeff"] = export_parameter_to_flattened_list(coeff),
-                json_subdict["e_x"] = export_parameter_to_flattened_list(e_x),
-                json_subdict["beta"] = export_parameter_to_flattened_list(beta)
+                coeff = torch.round((gamma * self.config.quantize_factor) / (torch.sqrt(var_x + module.eps)))
+                json_subdict["coeff"] = export_parameter_to_array(coeff),
+                json_subdict["e_x"] = export_parameter_to_array(e_x),
+                json_subdict["beta"] = export_parameter_to_array(beta)
             else:
                 print(f"Skipping module with name: {name}")
         return json_dict
 
+    def write_json_for_halo2(self, path: str):
+        """
+        Writes the Halo2 weights file (e.g. `bgnet.json` for `read_input` in
+        zk_prover/src/input_parsing.rs), byte for byte what
+        `json.dump(self.export_to_json_for_halo2(), f, indent=4)` writes, but
+        streamed from the weight arrays. Paths not ending in `.json` get a
+        `tensor_file` with dotted names (e.g. "conv_block.conv.weight") instead.
+        """
+        arrays = self.export_arrays_for_halo2()
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                dump_json(arrays, f, indent=4)
+        else:
+            write_tensor_file(path, flatten_names(arrays))
+
     def conv_and_linear_weights(self):
         return [m.weight for m in self.modules() if isinstance(m, nn.Conv2d) or isinstance(m, nn.Linear)]
 
@@ -464,20 +497,19 @@ class Net(nn.Module):
 
 
 class PolicyHead(nn.Module):
-    def __init__(self, in_channels, policy_channels):
+    def __init__(self, in_channels, policy_channels, config=None):
         super().__init__()
-        self.conv_block = ConvBlock(in_channels, policy_channels, 3, padding=1)
+        self.config = config if config is not None else QuantizationConfig()
+        self.conv_block = ConvBlock(in_channels, policy_channels, 3, padding=1, config=self.config)
         self.conv = nn.Conv2d(policy_channels, 80, 3, padding=1)
         # fixed mapping from az conv output to lc0 policy
         # self.register_buffer('policy_map', self.create_gather_tensor())
         self.load_gather_tensor()
+        self.gather_index_saved = False
 
     def create_gather_tensor(self):
         print("Creating (and saving) gather tensor...")
-        lc0_to_az_indices = dict(enumerate(lc0_az_policy_map.make_map('index')))
-        az_to_lc0_indices = {az: lc0 for lc0, az in lc0_to_az_indices.items()}
-        gather_indices = [lc0 for az, lc0 in sorted(az_to_lc0_indices.items()) if az != -1]
-        final_gather_tensor = torch.LongTensor(gather_indices).unsqueeze(0)
+        final_gather_tensor = torch.tensor(lc0_az_policy_map.gather_index()).unsqueeze(0)
 
         # --- Save gather tensor ---
         torch.save(final_gather_tensor, "policy_map_gather_tensor.pt")
@@ -485,8 +517,8 @@ class PolicyHead(nn.Module):
         return final_gather_tensor
 
     def load_gather_tensor(self):
-        print(f"Loading gather tensor...")
-        final_gather_tensor = torch.load("policy_map_gather_tensor.pt")
+        # --- Copied from the per-process map, so no file I/O and no dependence on the working directory ---
+        final_gather_tensor = torch.tensor(lc0_az_policy_map.gather_index()).unsqueeze(0)
         self.register_buffer("policy_map", final_gather_tensor)
 
     def forward(self, x: torch.Tensor):
@@ -496,34 +528,23 @@ class PolicyHead(nn.Module):
 
         # --- Conv needs quantization ---
         x = self.conv(x)
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("policy head conv", {
                 "x": x,
             })
-            x = torch.round(x / QUANTIZE_FACTOR)
+            x = torch.round(x / self.config.quantize_factor)
         save_tensor_for_halo2(f"policy_head.conv", x)
 
-        x = x.contiguous()
-        x = x.view(x.size(0), -1)
-        # print(f"After reshape! x.shape: {x.shape}")
-        gather_index = self.policy_map.expand(x.size(0), self.policy_map.size(1))
-        # print(f"Gather index shape: {gather_index.shape}")
-        # print(gather_index[:, :5])
-        # print(x[0][896], x[0][960], x[0][1024], x[0][1088], x[0][1152])
-        x = x.gather(dim=1, index=gather_index)
-        print(x.shape)
-        # print(x[:, :5])
-        # print(x[0])
-
-        if SAVE_GATHER_INDEX_AS_JSON:
-            json_obj = {
-                "gather_index": export_parameter_to_flattened_list(gather_index),
-            }
-            print(f"Saving gather index as a list to gather_index.json...")
-            with open("gather_index.json", "w") as f:
-                json.dump(json_obj, f)
+        # --- Flatten (N, 80, 8, 8) to (N, 5120) and pick the 1858 lc0 policy entries ---
+        x = x.reshape(x.size(0), -1)
+        x = x.index_select(1, self.policy_map[0])
+
+        # --- One-time artifact for the circuit; rewritten only if the index ever changes ---
+        if self.config.save_gather_index and not self.gather_index_saved:
+            write_gather_index(self.policy_map)
+            self.gather_index_saved = True
 
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("policy head gather", {
                 "x": x,
             })
@@ -533,11 +554,11 @@ class PolicyHead(nn.Module):
         return x
 
 class PolicyHeadClassical(nn.Module):
-    def __init__(self, in_channels, policy_channels):
+    def __init__(self, in_channels, policy_channels, config=None):
         super().__init__()
 
         self.layers = nn.Sequential(
-            ConvBlock(in_channels, policy_channels, 1),
+            ConvBlock(in_channels, policy_channels, 1, config=config),
             Flatten(),
             nn.Linear(8 * 8 * policy_channels, 1858),
         )
@@ -547,9 +568,9 @@ class PolicyHeadClassical(nn.Module):
         return x
 
 class ValueHead(nn.Sequential):
-    def __init__(self, in_channels, value_channels, lin_channels):
+    def __init__(self, in_channels, value_channels, lin_channels, config=None):
         super().__init__(OrderedDict([
-            ('conv_block', ConvBlock(in_channels, value_channels, 1)),
+            ('conv_block', ConvBlock(in_channels, value_channels, 1, config=config)),
             ('flatten', Flatten()),
             ('lin1', nn.Linear(value_channels * 8 * 8, lin_channels)),
             ('relu1', nn.ReLU(inplace=True)),
@@ -557,16 +578,17 @@ class ValueHead(nn.Sequential):
         ]))
 
 class ValueHeadClassical(nn.Sequential):
-    def __init__(self, in_channels, value_channels, lin_channels):
+    def __init__(self, in_channels, value_channels, lin_channels, config=None):
         super().__init__(OrderedDict([
-            ('conv_block', ConvBlock(in_channels, value_channels, 1)),
+            ('conv_block', ConvBlock(in_channels, value_channels, 1, config=config)),
             ('flatten', Flatten()),
             ('lin1', nn.Linear(value_channels * 8 * 8, lin_channels)),
             ('relu1', nn.ReLU(inplace=True)),
             ('lin2', nn.Linear(lin_channels, 1)),
             ('tanh', nn.Tanh()),
         ]))
-        self.conv_block = ConvBlock(in_channels, value_channels, 1)
+        self.config = config if config is not None else QuantizationConfig()
+        self.conv_block = ConvBlock(in_channels, value_channels, 1, config=self.config)
         self.flatten = Flatten()
         self.lin1 = nn.Linear(value_channels * 8 * 8, lin_channels)
         self.relu1 = nn.ReLU(inplace=True)
@@ -577,18 +599,18 @@ class ValueHeadClassical(nn.Sequential):
         x = self.conv_block(x)
         x = self.flatten(x)
         x = self.lin1(x)
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("value head lin 1", {
                 "x": x,
             })
-            x = torch.trunc(x / QUANTIZE_FACTOR)
+            x = torch.trunc(x / self.config.quantize_factor)
         x = self.relu1(x)
         x = self.lin2(x)
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("value head lin 2", {
                 "x": x,
             })
-            x = torch.trunc(x / QUANTIZE_FACTOR)
+            x = torch.trunc(x / self.config.quantize_factor)
 
         # if not QUANTIZE_NETWORKS:
         #     x = self.tanh(x)
@@ -599,8 +621,9 @@ class ValueHeadClassical(nn.Sequential):
 
 
 class ResidualBlock(nn.Module):
-    def __init__(self, channels, se_ratio, block_number):
+    def __init__(self, channels, se_ratio, block_number, config=None):
         super().__init__()
+        self.config = config if config is not None else QuantizationConfig()
         # ResidualBlock can't be an nn.Sequential, because it would try to apply self.relu2
         # in the residual block even when not passed into the constructor
         self.layers = nn.Sequential(OrderedDict([
@@ -611,7 +634,7 @@ class ResidualBlock(nn.Module):
             ('conv2', nn.Conv2d(channels, channels, 3, padding=1, bias=False)),
             ('bn2', nn.BatchNorm2d(channels)),
 
-            ('se', SqueezeExcitation(channels, se_ratio, block_number)),
+            ('se', SqueezeExcitation(channels, se_ratio, block_number, config=self.config)),
         ]))
 
         self.relu2 = nn.ReLU(inplace=True)
@@ -626,16 +649,16 @@ class ResidualBlock(nn.Module):
         # x = self.layers(x)
         # --- Conv, then quantize ---
         x = self.layers.get_submodule("conv1")(x)
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("residual block conv 1", {
                 "x": x,
             })
-            x = torch.trunc(x / QUANTIZE_FACTOR)
+            x = torch.trunc(x / self.config.quantize_factor)
         save_tensor_for_halo2(f"residual_block_{self.block_number}.conv1", x)
 
         # --- Batchnorm, then round ---
-        if QUANTIZE_NETWORKS:
-            x = cursed_batchnorm(x, self.layers.get_submodule("bn1"))
+        if self.config.quantize:
+            x = cursed_batchnorm(x, self.layers.get_submodule("bn1"), self.config.quantize_factor)
         else:
             x = self.layers.get_submodule("bn1")(x)
         save_tensor_for_halo2(f"residual_block_{self.block_number}.bn1", x)
@@ -646,16 +669,16 @@ class ResidualBlock(nn.Module):
 
         # --- Conv #2 ---
         x = self.layers.get_submodule("conv2")(x)
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("residual block conv 2", {
                 "x": x,
             })
-            x = torch.trunc(x / QUANTIZE_FACTOR)
+            x = torch.trunc(x / self.config.quantize_factor)
         save_tensor_for_halo2(f"residual_block_{self.block_number}.conv2", x)
 
         # --- Batchnorm #2 ---
-        if QUANTIZE_NETWORKS:
-            x = cursed_batchnorm(x, self.layers.get_submodule("bn2"))
+        if self.config.quantize:
+            x = cursed_batchnorm(x, self.layers.get_submodule("bn2"), self.config.quantize_factor)
         else:
             x = self.layers.get_submodule("bn2")(x)
         save_tensor_for_halo2(f"residual_block_{self.block_number}.bn2", x)
@@ -665,7 +688,7 @@ class ResidualBlock(nn.Module):
 
         # --- Residual + final ReLU ---
         x = x + x_in
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("residual block after SE and residual", {
                 "x": x,
             })
@@ -678,8 +701,9 @@ class ResidualBlock(nn.Module):
 
 
 class ConvBlock(nn.Sequential):
-    def __init__(self, in_channels, out_channels, kernel_size, padding=0):
+    def __init__(self, in_channels, out_channels, kernel_size, padding=0, config=None):
         super().__init__()
+        self.config = config if config is not None else QuantizationConfig()
         # super().__init__(OrderedDict([
         #     ('conv', nn.Conv2d(in_channels, out_channels, kernel_size, padding=padding, bias=False)),
         #     ('bn', nn.BatchNorm2d(out_channels)),
@@ -716,16 +740,16 @@ class ConvBlock(nn.Sequential):
         # print(x[0, 0, 0, 0].item())
 
         # print(x.shape)
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("conv block post conv", {
                 "x": x,
             })
-            x = torch.trunc(x / QUANTIZE_FACTOR)
+            x = torch.trunc(x / self.config.quantize_factor)
         save_tensor_for_halo2("conv_block.conv", x)
 
         # --- Batchnorm, then normalize ---
-        if QUANTIZE_NETWORKS:
-            x = cursed_batchnorm(x, self.bn)
+        if self.config.quantize:
+            x = cursed_batchnorm(x, self.bn, self.config.quantize_factor)
         else:
             x = self.bn(x)
         save_tensor_for_halo2("conv_block.bn", x)
@@ -738,8 +762,9 @@ class ConvBlock(nn.Sequential):
 
 
 class SqueezeExcitation(nn.Module):
-    def __init__(self, channels, ratio, block_number):
+    def __init__(self, channels, ratio, block_number, config=None):
         super().__init__()
+        self.config = config if config is not None else QuantizationConfig()
 
         self.pool = nn.AdaptiveAvgPool2d(1)
         self.lin1 = nn.Linear(channels, channels // ratio)
@@ -755,7 +780,7 @@ class SqueezeExcitation(nn.Module):
         x_in = x
 
         x = self.pool(x).view(n, c)
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             x = torch.trunc(x)
             print_max_abs_value("SE block post pooling", {
                 "x": x,
@@ -763,22 +788,22 @@ class SqueezeExcitation(nn.Module):
         save_tensor_for_halo2(f"residual_block_{self.block_number}.se_layer.pool", x, dim_check=False)
 
         x = self.lin1(x)
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("SE block lin 1", {
                 "x": x,
             })
-            x = torch.trunc(x / QUANTIZE_FACTOR)
+            x = torch.trunc(x / self.config.quantize_factor)
         save_tensor_for_halo2(f"residual_block_{self.block_number}.se_layer.lin1", x, dim_check=False)
 
         x = self.relu(x)
         save_tensor_for_halo2(f"residual_block_{self.block_number}.se_layer.relu", x, dim_check=False)
 
         x = self.lin2(x)
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
             print_max_abs_value("SE block lin 2", {
                 "x": x,
             })
-            x = torch.trunc(x / QUANTIZE_FACTOR)
+            x = torch.trunc(x / self.config.quantize_factor)
         save_tensor_for_halo2(f"residual_block_{self.block_number}.se_layer.lin2", x, dim_check=False)
 
         x = x.view(n, 2 * c, 1, 1)
@@ -787,16 +812,14 @@ class SqueezeExcitation(nn.Module):
         save_tensor_for_halo2(f"residual_block_{self.block_number}.se_layer.shift", shift)
 
         # TODO(ryancao): Is this actually circuit-friendly?
-        if QUANTIZE_NETWORKS:
+        if self.config.quantize:
 
             # --- Reference ---
             # x = torch.trunc((scale / QUANTIZE_FACTOR).sigmoid() * x_in + shift)
             # --- End reference ---
 
             # --- Compute scaled sigmoid ---
-            print(f"Scale.shape: {scale.shape}")
-            scale_sigmoid = cursed_sigmoid(scale)
-            print(f"scale_sigmoid.shape: {scale_sigmoid.shape}")
+            scale_sigmoid = cursed_sigmoid(scale, self.config.quantize_factor, self.config.sigmoid_piecewise_bound)
             save_tensor_for_halo2(f"residual_block_{self.block_number}.se_layer.scale_sigmoid", scale_sigmoid)
 
             # --- Multiply by input ---
@@ -805,14 +828,13 @@ class SqueezeExcitation(nn.Module):
             save_tensor_for_halo2(f"residual_block_{self.block_number}.se_layer.scaled_x_in", scaled_x_in)
 
             # --- Re-normalize ---
-            quantized = torch.trunc(scaled_x_in / QUANTIZE_FACTOR)
+            quantized = torch.trunc(scaled_x_in / self.config.quantize_factor)
             save_tensor_for_halo2(f"residual_block_{self.block_number}.se_layer.quantized", quantized)
 
             # --- Add shift term ---
             # print(f"shift.shape: {shift.shape}")
             quantized_and_shifted = quantized + shift
             # print(f"quantized_and_shifted.shape: {quantized_and_shifted.shape}")
-            print("========================")
             save_tensor_for_halo2(f"residual_block_{self.block_number}.se_layer.quantized_and_shifted", quantized_and_shifted)
 
             print_max_abs_value("SE sigmoid with scale and shift", {
@@ -821,7 +843,7 @@ class SqueezeExcitation(nn.Module):
                 "quantized": quantized,
                 "quantized_and_shifted": quantized_and_shifted,
             })
-            x = torch.trunc((cursed_sigmoid(scale) * x_in) / QUANTIZE_FACTOR) + shift
+            x = quantized_and_shifted
         else:
             x = scale.sigmoid() * x_in + shift
         # print(f"After SE block! x.shape: {x.shape}")
@@ -11,6 +11,9 @@ LC0_MINOR = 21
 LC0_PATCH = 0
 WEIGHTS_MAGIC = 0x1c0
 
+# --- Values denormalized per pass in denorm_layers, small enough to stay in cache ---
+DENORM_CHUNK = 1 << 16
+
 
 class Net:
     def __init__(self,
@@ -104,43 +107,68 @@ class Net:
         self.fill_layer(se_unit.b1, weights)
         self.fill_layer(se_unit.w1, weights)
 
-    def denorm_layer(self, layer, weights):
-        """Denormalize a layer from protobuf"""
-        params = np.frombuffer(layer.params, np.uint16).astype(np.float32)
-        params /= 0xffff
-        weights.insert(0, params * (layer.max_val - layer.min_val) + layer.min_val)
-
-    def denorm_conv_block(self, convblock, weights):
-        """Denormalize a convblock from protobuf"""
+    def denorm_layers(self, layers):
+        """Denormalize 16bit protobuf layers into views of one float32 buffer"""
+        sizes = [len(layer.params) // 2 for layer in layers]
+        buffer = np.empty(sum(sizes), dtype=np.float32)
+        weights = []
+        offset = 0
+        for layer, size in zip(layers, sizes):
+            params = buffer[offset:offset + size]
+            levels = np.frombuffer(layer.params, np.uint16)
+            for start in range(0, size, DENORM_CHUNK):
+                chunk = params[start:start + DENORM_CHUNK]
+                chunk[...] = levels[start:start + DENORM_CHUNK]
+                chunk /= 0xffff
+                chunk *= layer.max_val - layer.min_val
+                chunk += layer.min_val
+            weights.append(params)
+            offset += size
+        return weights
+
+    def conv_block_layers(self, convblock):
+        """Protobuf layers of a convblock, in load order"""
         se = self.pb.format.network_format.network == pb.NetworkFormat.NETWORK_SE_WITH_HEADFORMAT
 
         if se:
-            self.denorm_layer(convblock.bn_stddivs, weights)
-            self.denorm_layer(convblock.bn_means, weights)
-            self.denorm_layer(convblock.bn_betas, weights)
-            self.denorm_layer(convblock.bn_gammas, weights)
-            self.denorm_layer(convblock.weights, weights)
+            return [convblock.weights, convblock.bn_gammas, convblock.bn_betas, convblock.bn_means, convblock.bn_stddivs]
         else:
-            self.denorm_layer(convblock.bn_stddivs, weights)
-            self.denorm_layer(convblock.bn_means, weights)
-            self.denorm_layer(convblock.biases, weights)
-            self.denorm_layer(convblock.weights, weights)
-
-    def denorm_plain_conv(self, convblock, weights):
-        """Denormalize a plain convolution from protobuf"""
-        self.denorm_layer(convblock.biases, weights)
-        self.denorm_layer(convblock.weights, weights)
-
-    def denorm_se_unit(self, convblock, weights):
-        """Denormalize SE-unit from protobuf"""
+            return [convblock.weights, convblock.biases, convblock.bn_means, convblock.bn_stddivs]
+
+    def plain_conv_layers(self, convblock):
+        """Protobuf layers of a plain convolution, in load order"""
+        return [convblock.weights, convblock.biases]
+
+    def se_unit_layers(self, se_unit):
+        """Protobuf layers of an SE-unit, in load order"""
         se = self.pb.format.network_format.network == pb.NetworkFormat.NETWORK_SE_WITH_HEADFORMAT
 
         assert se
 
-        self.denorm_layer(convblock.b2, weights)
-        self.denorm_layer(convblock.w2, weights)
-        self.denorm_layer(convblock.b1, weights)
-        self.denorm_layer(convblock.w1, weights)
+        return [se_unit.w1, se_unit.b1, se_unit.w2, se_unit.b2]
+
+    def weight_layers(self):
+        """All protobuf layers in load order (input block first, value head last)"""
+        se = self.pb.format.network_format.network == pb.NetworkFormat.NETWORK_SE_WITH_HEADFORMAT
+        layers = self.conv_block_layers(self.pb.weights.input)
+
+        for res in self.pb.weights.residual:
+            layers += self.conv_block_layers(res.conv1)
+            layers += self.conv_block_layers(res.conv2)
+            if se:
+                layers += self.se_unit_layers(res.se)
+
+        if self.pb.format.network_format.policy == pb.NetworkFormat.POLICY_CONVOLUTION:
+            layers += self.conv_block_layers(self.pb.weights.policy1)
+            layers += self.plain_conv_layers(self.pb.weights.policy)
+        else:
+            layers += self.conv_block_layers(self.pb.weights.policy)
+            layers += [self.pb.weights.ip_pol_w, self.pb.weights.ip_pol_b]
+
+        layers += self.conv_block_layers(self.pb.weights.value)
+        layers += [self.pb.weights.ip1_val_w, self.pb.weights.ip1_val_b,
+                   self.pb.weights.ip2_val_w, self.pb.weights.ip2_val_b]
+        return layers
 
     def save_txt(self, filename):
         """Save weights as txt file"""
@@ -180,29 +208,8 @@ class Net:
 
     def get_weights(self):
         """Returns the weights as floats per layer"""
-        se = self.pb.format.network_format.network == pb.NetworkFormat.NETWORK_SE_WITH_HEADFORMAT
         if self.weights == []:
-            self.denorm_layer(self.pb.weights.ip2_val_b, self.weights)
-            self.denorm_layer(self.pb.weights.ip2_val_w, self.weights)
-            self.denorm_layer(self.pb.weights.ip1_val_b, self.weights)
-            self.denorm_layer(self.pb.weights.ip1_val_w, self.weights)
-            self.denorm_conv_block(self.pb.weights.value, self.weights)
-
-            if self.pb.format.network_format.policy == pb.NetworkFormat.POLICY_CONVOLUTION:
-                self.denorm_plain_conv(self.pb.weights.policy, self.weights)
-                self.denorm_conv_block(self.pb.weights.policy1, self.weights)
-            else:
-                self.denorm_layer(self.pb.weights.ip_pol_b, self.weights)
-                self.denorm_layer(self.pb.weights.ip_pol_w, self.weights)
-                self.denorm_conv_block(self.pb.weights.policy, self.weights)
-
-            for res in reversed(self.pb.weights.residual):
-                if se:
-                    self.denorm_se_unit(res.se, self.weights)
-                self.denorm_conv_block(res.conv2, self.weights)
-                self.denorm_conv_block(res.conv1, self.weights)
-
-            self.denorm_conv_block(self.pb.weights.input, self.weights)
+            self.weights = self.denorm_layers(self.weight_layers())
 
         return self.weights
 
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+import chess
+import chess.polyglot
+
+# --- Rough per-entry Python overhead on top of the policy arrays: the dict slot,
+# the int key, the [policy, value] list, the MovePolicy object, its three ndarray
+# headers and the float value ---
+ENTRY_OVERHEAD_BYTES = 640
+
+
+def position_key(board: chess.Board):
+    """
+    64-bit Zobrist (Polyglot) hash of `board`, used as the cache key.
+    """
+    return chess.polyglot.zobrist_hash(board)
+
+
+def entry_nbytes(entry):
+    policy, _ = entry
+    return ENTRY_OVERHEAD_BYTES + policy.nbytes
+
+
+class PositionCache:
+    """
+    LRU cache of [policy, value] evaluations keyed by `position_key`.
+
+    Bounded both by number of entries and by an estimate of the bytes held,
+    and keeps hit/miss/eviction counters (see `stats`).
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """
+        Returns the entry for `key` (marking it as recently used), or None.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __setitem__(self, key, entry):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= entry_nbytes(old)
+        self.entries[key] = entry
+        self.nbytes += entry_nbytes(entry)
+
+        # --- Evict least recently used entries until both limits hold ---
+        while len(self.entries) > self.max_entries or (self.nbytes > self.max_bytes and len(self.entries) > 1):
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= entry_nbytes(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "nbytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
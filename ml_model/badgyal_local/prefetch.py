@@ -0,0 +1,150 @@
+import heapq
+import itertools
+import threading
+
+from badgyal_local.position_cache import position_key
+
+MAX_PENDING = 256
+MAX_BATCH = 8
+
+
+class Prefetcher:
+    """
+    Background worker that speculatively evaluates positions for an `AbstractNet`.
+
+    Boards are queued with a priority (their policy mass) and evaluated in
+    batches of up to `batch_size`, highest priority first, into the net's
+    cache. At most `max_pending` boards are queued; the lowest priority ones
+    are dropped beyond that. `cancel` discards everything still queued, e.g.
+    once the real game move is known.
+
+    All net access happens under `net.lock`, so a caller's own eval waits for
+    at most one in-flight prefetch batch.
+    """
+
+    def __init__(self, net, max_pending=MAX_PENDING, batch_size=MAX_BATCH, softmax_temp=1.61):
+        self.net = net
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.softmax_temp = softmax_temp
+
+        # --- Min-heap of (-priority, seq, key, board) ---
+        self.heap = []
+        self.queued = set()
+        self.seq = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        # --- Keys evaluated speculatively and not yet asked for ---
+        self.prefetched = {}
+
+        # --- Counters ---
+        self.num_scheduled = 0
+        self.num_dropped = 0
+        self.num_cancelled = 0
+        self.num_evaluated = 0
+        self.num_hits = 0
+        self.num_lookups = 0
+        self.last_error = None
+
+        self.worker = threading.Thread(target=self.run, name="badgyal-prefetch", daemon=True)
+        self.worker.start()
+
+    def schedule(self, items):
+        """
+        Queues (priority, board) pairs for speculative evaluation.
+        """
+        with self.condition:
+            for priority, board in items:
+                key = position_key(board)
+                if key in self.queued or key in self.prefetched:
+                    continue
+                heapq.heappush(self.heap, (-priority, next(self.seq), key, board))
+                self.queued.add(key)
+                self.num_scheduled += 1
+
+            # --- Drop the lowest priority boards beyond the bound ---
+            if len(self.heap) > self.max_pending:
+                kept = heapq.nsmallest(self.max_pending, self.heap)
+                dropped = len(self.heap) - len(kept)
+                self.queued = set(key for _, _, key, _ in kept)
+                self.heap = kept
+                self.num_dropped += dropped
+            self.condition.notify()
+
+    def cancel(self):
+        """
+        Discards all queued (not yet running) speculative evaluations.
+        """
+        with self.condition:
+            self.num_cancelled += len(self.heap)
+            self.heap = []
+            self.queued = set()
+
+    def record_lookup(self, key, hit):
+        """
+        Called by the net for every eval, to track how often prefetching paid off.
+        """
+        with self.condition:
+            self.num_lookups += 1
+            if hit and self.prefetched.pop(key, None) is not None:
+                self.num_hits += 1
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.worker.join()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "pending": len(self.heap),
+                "scheduled": self.num_scheduled,
+                "dropped": self.num_dropped,
+                "cancelled": self.num_cancelled,
+                "evaluated": self.num_evaluated,
+                "hits": self.num_hits,
+                "hit_rate": self.num_hits / self.num_lookups if self.num_lookups > 0 else 0.0,
+                "useful_rate": self.num_hits / self.num_evaluated if self.num_evaluated > 0 else 0.0,
+            }
+
+    def next_batch(self):
+        with self.condition:
+            while len(self.heap) == 0 and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            batch = []
+            while len(self.heap) > 0 and len(batch) < self.batch_size:
+                _, _, key, board = heapq.heappop(self.heap)
+                self.queued.discard(key)
+                batch.append((key, board))
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            with self.net.lock:
+                batch = [(key, board) for key, board in batch
+                         if key not in self.net.cache and self.net.load_from_disk(key) is None]
+                if len(batch) == 0:
+                    continue
+                keys = [key for key, _ in batch]
+                boards = [board for _, board in batch]
+                # --- Speculation must never take the worker down ---
+                try:
+                    policies, values = self.net.process_boards(boards)
+                    self.net.decode_boards(boards, policies, values, softmax_temp=self.softmax_temp, keys=keys)
+                except Exception as e:
+                    self.last_error = e
+                    continue
+            with self.condition:
+                self.num_evaluated += len(keys)
+                for key in keys:
+                    self.prefetched[key] = True
+                # --- Keep the bookkeeping bounded by the cache size ---
+                while len(self.prefetched) > self.net.cache.max_entries:
+                    del self.prefetched[next(iter(self.prefetched))]
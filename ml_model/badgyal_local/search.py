@@ -0,0 +1,325 @@
+import collections
+import math
+import time
+
+import chess
+import numpy as np
+
+from badgyal_local.board2planes import decode_move_key
+from badgyal_local.known_positions import NET
+from badgyal_local.position_cache import position_key
+
+NODES = 800
+BATCH_SIZE = 16
+CPUCT = 1.5
+# --- Unvisited children start at the parent's value minus this (first play urgency) ---
+FPU_REDUCTION = 0.2
+# --- Table size, in searches' worth of playouts: the current search plus the subtrees it may reuse ---
+TABLE_SEARCHES = 4
+
+# --- One record per legal move: packed move key (see `decode_move_key`), prior and edge statistics ---
+EDGE_DTYPE = np.dtype([
+    ("key", np.int16),
+    ("prior", np.float16),
+    ("visits", np.int32),
+    ("value", np.float32),
+    ("in_flight", np.int16),
+])
+
+
+def terminal_value(board: chess.Board):
+    """
+    Game result from the side to move's perspective (-1 mated, 0 drawn), or
+    None if the game goes on. Only results that follow from the position
+    itself, so they can be stored on a node shared by transpositions.
+    """
+    if board.is_checkmate():
+        return -1.0
+    if board.is_stalemate() or board.is_insufficient_material():
+        return 0.0
+    return None
+
+
+def is_path_draw(board: chess.Board):
+    """
+    Claimable draws, which depend on how `board` was reached rather than on
+    the position (see `terminal_value`).
+    """
+    # --- A threefold repetition needs at least 8 reversible plies ---
+    return board.halfmove_clock >= 100 or (board.halfmove_clock >= 8 and board.is_repetition(3))
+
+
+class Node:
+    """
+    One searched position. `edges` holds an `EDGE_DTYPE` record per legal
+    move, where backups accumulate: `visits`, the summed results `value` from
+    this node's side to move, and `in_flight`, the descents still waiting for
+    their leaf evaluation (virtual loss). The node's own `value` is its
+    evaluation when expanded, the base for unvisited children's first play
+    urgency. Children are not linked: they are found in the
+    `TranspositionTable` by position, so every move order reaching a position
+    shares its node.
+    """
+    __slots__ = ("edges", "value", "terminal", "generation")
+
+    def __init__(self, generation):
+        self.edges = None
+        self.value = 0.0
+        self.terminal = None
+        self.generation = generation
+
+    @property
+    def expanded(self):
+        return self.edges is not None
+
+    def expand(self, keys, logits, value, softmax_temp):
+        self.edges = np.zeros(len(keys), dtype=EDGE_DTYPE)
+        self.edges["key"] = keys
+        if len(keys) > 0:
+            priors = np.exp((logits - logits.max()) / softmax_temp)
+            self.edges["prior"] = priors / priors.sum()
+        self.value = value
+
+    def select(self, cpuct):
+        """
+        Index of the edge maximizing Q + U, counting in-flight descents as losses.
+        """
+        edges = self.edges
+        in_flight = edges["in_flight"]
+        n = edges["visits"] + in_flight
+        q = np.where(n > 0, (edges["value"] - in_flight) / np.maximum(n, 1), self.value - FPU_REDUCTION)
+        u = cpuct * edges["prior"].astype(np.float32) * math.sqrt(max(int(n.sum()), 1)) / (1 + n)
+        return int(np.argmax(q + u))
+
+
+class TranspositionTable:
+    """
+    Search nodes keyed by `position_key`, shared by every move order (and
+    every search) reaching a position.
+
+    Each search starts a new generation and nodes are stamped with the
+    generation that last looked them up. Once the table holds more than
+    `max_nodes`, `evict` drops whole generations, oldest first; the current
+    one is always kept, so a single search may grow past the limit.
+    """
+
+    def __init__(self, max_nodes=TABLE_SEARCHES * NODES):
+        self.max_nodes = max_nodes
+        self.nodes = dict()
+        self.generation = 0
+
+        # --- Counters ---
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get(self, key):
+        """
+        The node for `key`, created if missing, stamped with the current generation.
+        """
+        node = self.nodes.get(key)
+        if node is None:
+            self.misses += 1
+            node = self.nodes[key] = Node(self.generation)
+        else:
+            self.hits += 1
+            node.generation = self.generation
+        return node
+
+    def new_generation(self):
+        self.generation += 1
+
+    def evict(self):
+        if len(self.nodes) <= self.max_nodes:
+            return
+        counts = collections.Counter(node.generation for node in self.nodes.values())
+        remaining, cutoff = len(self.nodes), None
+        for generation in sorted(counts):
+            if remaining <= self.max_nodes or generation == self.generation:
+                break
+            remaining -= counts[generation]
+            cutoff = generation
+        if cutoff is not None:
+            self.nodes = {key: node for key, node in self.nodes.items() if node.generation > cutoff}
+            self.evictions += sum(count for generation, count in counts.items() if generation <= cutoff)
+
+    def clear(self):
+        self.nodes.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "nodes": len(self.nodes),
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+
+class PUCTSearch:
+    """
+    PUCT tree search over an `AbstractNet`.
+
+    Each step descends `batch_size` times from the root, applying a virtual
+    loss along every path so the descents spread over different leaves, then
+    evaluates all the new leaves with one `bulk_eval` and backs the results
+    up. Nodes live in a `TranspositionTable` (by default holding
+    `TABLE_SEARCHES` searches of `nodes` playouts; pass `table` to share one
+    between searches), so positions reached by different move orders share
+    statistics and the subtree under the played moves is kept between moves.
+    `search` stops after `nodes` new playouts or `seconds`, whichever comes
+    first, but always runs at least one batch.
+
+    The nets' value heads drop the final tanh (see `model.ValueHead`), so leaf
+    values from the net are squashed into [-1, 1] here (book and tablebase
+    values are final scores and kept as they are); `softmax_temp` turns the
+    policy logits into priors. Positions the net's known positions answer (see
+    `AbstractNet.open_known_positions`) are played, not searched;
+    `last_source` says who picked the last move.
+    """
+
+    def __init__(self, net, nodes=NODES, seconds=None, batch_size=BATCH_SIZE, cpuct=CPUCT, softmax_temp=1.61,
+                 table=None):
+        self.net = net
+        self.nodes = nodes
+        self.seconds = seconds
+        self.batch_size = batch_size
+        self.cpuct = cpuct
+        self.softmax_temp = softmax_temp
+        self.table = table if table is not None else TranspositionTable(max_nodes=TABLE_SEARCHES * nodes)
+        self.root = None
+        self.root_board = None
+        self.last_source = None
+
+        # --- Counters ---
+        self.num_batches = 0
+        self.num_evals = 0
+        self.num_playouts = 0
+        self.num_reused = 0
+
+    def set_root(self, board: chess.Board):
+        """
+        Moves the root to `board`, starting a new table generation. Whatever
+        the table already knows below `board` is kept.
+        """
+        self.table.new_generation()
+        self.root = self.table.get(position_key(board))
+        self.root_board = board.copy()
+        if self.root.expanded:
+            self.num_reused += int(self.root.edges["visits"].sum())
+
+    def select_leaf(self):
+        """
+        Descends to a leaf, applying virtual loss. Returns the leaf node (None
+        for a draw by repetition or the 50-move rule along this path), its
+        board and the (node, edge index) path.
+        """
+        node, board, path = self.root, self.root_board.copy(), []
+        while node.expanded and node.terminal is None:
+            i = node.select(self.cpuct)
+            node.edges["in_flight"][i] += 1
+            path.append((node, i))
+            board.push(decode_move_key(node.edges["key"][i]))
+            if is_path_draw(board):
+                return None, board, path
+            node = self.table.get(position_key(board))
+        return node, board, path
+
+    def backup(self, path, value):
+        """
+        Adds `value` (from the leaf's side to move) along `path`, flipping
+        perspective at every ply, and releases the path's virtual loss.
+        """
+        for node, i in reversed(path):
+            value = -value
+            edges = node.edges
+            edges["visits"][i] += 1
+            edges["value"][i] += value
+            edges["in_flight"][i] -= 1
+        self.num_playouts += 1
+
+    def run_batch(self):
+        pending = []
+        leaves = set()
+        for _ in range(self.batch_size):
+            node, board, path = self.select_leaf()
+            if node is None:
+                self.backup(path, 0.0)
+                continue
+            if node.terminal is None and not node.expanded:
+                node.terminal = terminal_value(board)
+            if node.terminal is not None:
+                self.backup(path, node.terminal)
+                continue
+            if id(node) in leaves:
+                # --- Collision with a leaf already queued: undo the virtual loss and evaluate what we have ---
+                for parent, i in path:
+                    parent.edges["in_flight"][i] -= 1
+                break
+            leaves.add(id(node))
+            pending.append((node, board, path))
+
+        if len(pending) == 0:
+            return
+        policies, values, sources = self.net.bulk_eval([board for _, board, _ in pending], as_dict=False,
+                                                       with_source=True)
+        for (node, _, path), policy, value, source in zip(pending, policies, values, sources):
+            # --- Book and tablebase values are already final scores ---
+            if source == NET:
+                value = math.tanh(value)
+            node.expand(policy.keys, policy.probs, value, self.softmax_temp)
+            self.backup(path, value)
+        self.num_batches += 1
+        self.num_evals += len(pending)
+
+    def search(self, board: chess.Board, nodes=None, seconds=None):
+        """
+        Searches `board` and returns the most visited move.
+        """
+        if board.is_game_over():
+            raise ValueError("no move to search in a finished game")
+        resolved = self.net.resolve_known(board)
+        if resolved is not None:
+            policy, _, self.last_source = resolved
+            return decode_move_key(policy.keys[int(np.argmax(policy.probs))])
+        self.last_source = NET
+        nodes = nodes if nodes is not None else self.nodes
+        seconds = seconds if seconds is not None else self.seconds
+        deadline = time.monotonic() + seconds if seconds is not None else None
+        self.set_root(board)
+        start = self.num_playouts
+        # --- At least one batch, so the root is expanded even if `seconds` has already run out ---
+        self.run_batch()
+        while self.num_playouts - start < nodes and (deadline is None or time.monotonic() < deadline):
+            self.run_batch()
+        self.table.evict()
+        return self.best_move()
+
+    def best_move(self):
+        # --- Most visits, ties broken by prior ---
+        edges = self.root.edges
+        i = int(np.lexsort((edges["prior"], edges["visits"]))[-1])
+        return decode_move_key(edges["key"][i])
+
+    def visit_counts(self):
+        """
+        {uci: visits} over the root's moves.
+        """
+        if not self.root.expanded:
+            return {}
+        return {decode_move_key(k).uci(): int(n) for k, n in zip(self.root.edges["key"], self.root.edges["visits"])}
+
+    def stats(self):
+        return {
+            "batches": self.num_batches,
+            "evals": self.num_evals,
+            "playouts": self.num_playouts,
+            "reused": self.num_reused,
+            "mean_batch_size": self.num_evals / self.num_batches if self.num_batches > 0 else 0.0,
+            "table": self.table.stats(),
+        }
@@ -0,0 +1,86 @@
+from collections import OrderedDict
+import mmap
+
+import numpy as np
+import torch
+
+import badgyal_local.model as model
+from badgyal_local.tensor_file import read_tensor_header, write_arrays
+
+SNAPSHOT_FORMAT = "badgyal-net-snapshot"
+
+TORCH_DTYPES = {
+    np.dtype("<f4"): torch.float32,
+    np.dtype("<f8"): torch.float64,
+    np.dtype("<i8"): torch.int64,
+    np.dtype("<i4"): torch.int32,
+    np.dtype("bool"): torch.bool,
+}
+
+
+def save_snapshot(net: model.Net, path):
+    """
+    Writes the ready-to-run parameters and buffers of `net` (quantized or not),
+    with its architecture and quantization config, as a `tensor_file`.
+    """
+    if not isinstance(net, model.Net):
+        raise TypeError(f"Only model.Net can be snapshotted, not {type(net).__name__}")
+    arrays = OrderedDict((name, tensor.detach().cpu().contiguous().numpy())
+                         for name, tensor in net.state_dict().items())
+    metadata = {
+        "format": SNAPSHOT_FORMAT,
+        "architecture": net.architecture,
+        "config": vars(net.config),
+        "quantized": net.quantized,
+        "model_name": net.model_name,
+    }
+    write_arrays(path, arrays, metadata=metadata)
+
+
+def assign_tensors(net: torch.nn.Module, state_dict):
+    """
+    Points every parameter and buffer of `net` at the tensor of the same name
+    in `state_dict`, without copying (what `load_state_dict(..., assign=True)`
+    does on torch >= 2.1).
+    """
+    names = set(net.state_dict())
+    if names != set(state_dict):
+        raise ValueError(f"Snapshot does not match the net: missing {sorted(names - set(state_dict))}, "
+                         f"unexpected {sorted(set(state_dict) - names)}")
+    for name, tensor in state_dict.items():
+        module_name, _, attr = name.rpartition(".")
+        module = net.get_submodule(module_name)
+        if attr in module._parameters:
+            module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=module._parameters[attr].requires_grad)
+        else:
+            module._buffers[attr] = tensor
+
+
+def load_snapshot(path):
+    """
+    Rebuilds the `model.Net` saved by `save_snapshot`. Every parameter and buffer
+    is a `torch.frombuffer` view into one copy-on-write memory map of the file,
+    so processes loading the same snapshot share its pages until they write.
+    """
+    header, data_start = read_tensor_header(path)
+    metadata = header.get("metadata") or {}
+    if metadata.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} is not a net snapshot")
+
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    state_dict = OrderedDict()
+    for entry in header["tensors"]:
+        dtype = TORCH_DTYPES[np.dtype(entry["dtype"])]
+        if entry["count"] == 0:
+            state_dict[entry["name"]] = torch.empty(entry["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=entry["count"], offset=data_start + entry["offset"])
+        state_dict[entry["name"]] = tensor.view(entry["shape"])
+
+    net = model.Net(**metadata["architecture"], config=model.QuantizationConfig(**metadata["config"]),
+                    init_weights=False)
+    assign_tensors(net, state_dict)
+    net.quantized = metadata["quantized"]
+    net.model_name = metadata["model_name"]
+    return net
@@ -0,0 +1,204 @@
+from collections import OrderedDict
+import json
+import struct
+import sys
+
+import numpy as np
+
+# --- File layout (all integers little-endian):
+#   8 bytes   MAGIC
+#   8 bytes   u64 header length in bytes (including padding)
+#   header    UTF-8 JSON, space padded to a multiple of 8 bytes:
+#             {"version": 1, "tensors": [{"name", "dtype", "shape", "permutation", "offset", "count"}, ...]}
+#             plus an optional "metadata" object (e.g. for `snapshot` files)
+#   data      every tensor back to back in C order; `offset` is in bytes from the start
+#             of the data section and a multiple of 8. `write_tensor_file` stores each as
+#             the narrowest of int8/16/32/64 that holds its values (`dtype` "<i1".."<i8")
+# so the Rust side can mmap the file and view each tensor in place ---
+MAGIC = b"BGTENSOR"
+VERSION = 1
+ALIGNMENT = 8
+INT_DTYPES = [np.dtype("<i1"), np.dtype("<i2"), np.dtype("<i4"), np.dtype("<i8")]
+JSON_CHUNK = 1 << 20
+
+
+def to_int64(array):
+    """
+    Floors to int64, matching `export_parameter_to_flattened_list`.
+    """
+    array = np.asarray(array)
+    if np.issubdtype(array.dtype, np.floating):
+        array = np.floor(array)
+    return np.ascontiguousarray(array, dtype="<i8")
+
+
+def narrowest(array):
+    """
+    `array` cast to the smallest little-endian int dtype that holds all its values.
+    """
+    if array.size == 0:
+        return array
+    low, high = array.min(), array.max()
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return array.astype(dtype)
+    return array
+
+
+def write_tensor_file(path, tensors, permutations=None):
+    """
+    Writes `tensors` ({name: array}, in order) to `path` as integers. `permutations`
+    optionally maps a name to the axis permutation already applied to it, e.g.
+    (0, 1, 3, 2) for (N, C, H, W) activations stored as (N, C, W, H).
+    """
+    arrays = OrderedDict((name, narrowest(to_int64(array))) for name, array in tensors.items())
+    write_arrays(path, arrays, permutations)
+
+
+def write_arrays(path, arrays, permutations=None, metadata=None):
+    """
+    Writes `arrays` ({name: array}, in order) to `path` in their own dtypes (stored
+    little-endian), with the JSON-serializable `metadata` in the header.
+    """
+    permutations = permutations or {}
+    arrays = [(name, np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder("<")))
+              for name, array in arrays.items()]
+
+    entries = []
+    offset = 0
+    for name, array in arrays:
+        permutation = permutations.get(name)
+        entries.append({
+            "name": name,
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "permutation": list(permutation) if permutation is not None else None,
+            "offset": offset,
+            "count": int(array.size),
+        })
+        offset += array.nbytes + (-array.nbytes % ALIGNMENT)
+
+    header = {"version": VERSION, "tensors": entries}
+    if metadata is not None:
+        header["metadata"] = metadata
+    header = json.dumps(header).encode()
+    header += b" " * (-len(header) % ALIGNMENT)
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for _, array in arrays:
+            f.write(memoryview(array).cast("B"))
+            f.write(b"\0" * (-array.nbytes % ALIGNMENT))
+
+
+def read_tensor_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a tensor file")
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length))
+    if header["version"] != VERSION:
+        raise ValueError(f"Unsupported tensor file version {header['version']}")
+    return header, len(MAGIC) + 8 + header_length
+
+
+def read_tensor_file(path):
+    """
+    Returns {name: int array} for a file written by `write_tensor_file`. The
+    arrays are read-only views into one memory map of the file.
+    """
+    header, data_start = read_tensor_header(path)
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=data_start)
+    tensors = OrderedDict()
+    for entry in header["tensors"]:
+        array = np.frombuffer(data, dtype=entry["dtype"], count=entry["count"], offset=entry["offset"])
+        tensors[entry["name"]] = array.reshape(entry["shape"])
+    return tensors
+
+
+def nest(flat):
+    """
+    {"a.b": value} -> {"a": {"b": value}}, keeping insertion order.
+    """
+    result = OrderedDict()
+    for name, value in flat.items():
+        subdict = result
+        *path, leaf = name.split(".")
+        for key in path:
+            subdict = subdict.setdefault(key, dict())
+        subdict[leaf] = value
+    return result
+
+
+def flatten_names(nested, prefix=""):
+    """
+    {"a": {"b": array}} -> {"a.b": array}, the inverse of `nest`. One-element
+    tuples (how batchnorm parameters are wrapped in the Halo2 JSON) are unwrapped.
+    """
+    flat = OrderedDict()
+    for key, value in nested.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_names(value, prefix=f"{name}."))
+        else:
+            if isinstance(value, tuple) and len(value) == 1:
+                value = value[0]
+            flat[name] = value
+    return flat
+
+
+def dump_json(obj, f, indent=4, depth=0):
+    """
+    Streams `obj` to `f` exactly as `json.dump(obj, f, indent=indent)` would,
+    but writes int ndarrays (in chunks of `JSON_CHUNK` values) without building
+    Python lists or the whole document in memory.
+    """
+    inner = "\n" + " " * (indent * (depth + 1))
+    if isinstance(obj, dict):
+        if len(obj) == 0:
+            f.write("{}")
+            return
+        f.write("{")
+        for i, (key, value) in enumerate(obj.items()):
+            f.write(("," if i > 0 else "") + inner + json.dumps(key) + ": ")
+            dump_json(value, f, indent=indent, depth=depth + 1)
+        f.write("\n" + " " * (indent * depth) + "}")
+    elif isinstance(obj, np.ndarray):
+        if obj.size == 0:
+            f.write("[]")
+            return
+        f.write("[")
+        values = obj.ravel()
+        for start in range(0, values.size, JSON_CHUNK):
+            chunk = values[start:start + JSON_CHUNK].tolist()
+            f.write(("," if start > 0 else "") + inner + ("," + inner).join(map(str, chunk)))
+        f.write("\n" + " " * (indent * depth) + "]")
+    elif isinstance(obj, (list, tuple)):
+        if len(obj) == 0:
+            f.write("[]")
+            return
+        f.write("[")
+        for i, value in enumerate(obj):
+            f.write(("," if i > 0 else "") + inner)
+            dump_json(value, f, indent=indent, depth=depth + 1)
+        f.write("\n" + " " * (indent * depth) + "]")
+    else:
+        f.write(json.dumps(obj))
+
+
+def tensor_file_to_json(src, dst):
+    """
+    Converts a tensor file to the legacy nested JSON of flattened int lists.
+    """
+    tensors = read_tensor_file(src)
+    with open(dst, "w") as f:
+        json.dump(nest({name: array.ravel().tolist() for name, array in tensors.items()}), f)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(f"Usage: python -m badgyal_local.tensor_file <in.bin> <out.json>")
+        sys.exit(1)
+    tensor_file_to_json(sys.argv[1], sys.argv[2])
@@ -1,7 +1,43 @@
+import asyncio
 import badgyal
 import chess
+import chess.engine
+import chess.pgn
+import chess.polyglot
+import collections
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from badgyal_local.abstractnet import AbstractNet
+from badgyal_local.batching import BatchingEvaluator
+from badgyal_local.disk_cache import DiskCache, quantization_id
+from badgyal_local.fused_net import FusedNet
+from badgyal_local.import_benchmark import import_time
+from badgyal_local.integer_net import ExactLinearOp, IntegerNet, round_div, trunc_div
+from badgyal_local.known_positions import BOOK, NET as NET_SOURCE, TABLEBASE, KnownPositions
+from badgyal_local.board2planes import board2planes, board2planes_fast, bulk_board2planes, policy2moves, \
+    policy2moves_fast, bulk_policy2moves, decode_move_key
+from badgyal_local.position_cache import PositionCache, position_key
+from badgyal_local.search import PUCTSearch, TranspositionTable
+from badgyal_local.snapshot import load_snapshot, save_snapshot
+from badgyal_local.tensor_file import dump_json, read_tensor_file, tensor_file_to_json
+import io
+import leela_v_stockfish
+import numpy as np
+from badgyal_local.wdlnet import WDLNet
+from badgyal_local.tracing import get_tracer, trace
+import json
+import badgyal_local.lc0_az_policy_map as lc0_az_policy_map
+import badgyal_local.model as model
+import badgyal_local.net as proto_net
+import badgyal_local.proto.net_pb2 as pb
+import os
 import re
+import struct
+import tempfile
+import threading
+import time
 import unittest
+from uci_pool import UCIOpponentPool
 
 TESTS = {
     "rnbqkb1r/1p3ppp/p2p1n2/4p3/4P3/1NN1B3/PPP2PPP/R2QKB1R b KQkq - 1 7" : """
@@ -192,5 +228,704 @@ class NetTestCase(unittest.TestCase):
             self.assertAlmostEqual(value, value2, 2, "Values don't match {}".format(fen))
             self.assertDictAlmostEqual(policy, policy2, places=2)
 
+class Board2PlanesTestCase(unittest.TestCase):
+    def test_fast_matches_reference(self):
+        for fen in list(TESTS) + list(ENDGAME_TESTS) + [chess.STARTING_FEN]:
+            board = chess.Board(fen=fen)
+            expected = board2planes(board)
+            actual = torch.from_numpy(board2planes_fast(board)).unsqueeze(0)
+            self.assertTrue(torch.equal(expected, actual), fen)
+
+    def test_bulk_reuses_out_buffer(self):
+        boards = [chess.Board(fen=fen) for fen in list(TESTS) + list(ENDGAME_TESTS) + [chess.STARTING_FEN]]
+        out = torch.full((len(boards), 112, 8, 8), float("nan"), dtype=torch.float32)
+        with self.assertRaises(ValueError):
+            bulk_board2planes(boards + boards[:1], out=out)
+        # --- Refilled with fewer boards (in another order): only the first rows are written and returned ---
+        for batch in (boards, boards[::-1][:3]):
+            planes = bulk_board2planes(batch, out=out)
+            self.assertEqual(planes.data_ptr(), out.data_ptr())
+            self.assertTrue(torch.equal(planes, torch.cat([board2planes(board) for board in batch])))
+
+class Policy2MovesTestCase(unittest.TestCase):
+    def test_fast_matches_reference(self):
+        for fen in list(TESTS) + list(ENDGAME_TESTS) + [chess.STARTING_FEN]:
+            board = chess.Board(fen=fen)
+            policy = torch.randn(1, 1858)
+            self.assertEqual(policy2moves(board, policy), policy2moves_fast(board, policy), fen)
+
+    def test_bulk_matches_reference(self):
+        fens = list(TESTS) + list(ENDGAME_TESTS) + [
+            chess.STARTING_FEN,
+            # --- Castling both ways, either side to move ---
+            "r3k2r/pppq1ppp/2n2n2/3pp3/3PP3/2N2N2/PPPQ1PPP/R3K2R w KQkq - 0 8",
+            "r3k2r/pppq1ppp/2n2n2/3pp3/3PP3/2N2N2/PPPQ1PPP/R3K2R b KQkq - 0 8",
+            # --- Promotions to every piece, pushing and capturing, either side to move ---
+            "1r5k/P7/8/8/8/8/8/K7 w - - 0 1",
+            "k7/8/8/8/8/8/p7/1R5K b - - 0 1",
+            # --- Checkmated: no legal moves, a fully padded row ---
+            "rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3",
+        ]
+        boards = [chess.Board(fen=fen) for fen in fens]
+        policy = torch.randn(len(boards), 1858)
+        # --- Padding gathers index 0: any leak past the mask would dominate the softmax ---
+        policy[:, 0] = 1e6
+        for board, move_policy, row in zip(boards, bulk_policy2moves(boards, policy), policy):
+            self.assertEqual(move_policy.to_dict(), policy2moves(board, row.unsqueeze(0)), board.fen())
+        for board, move_policy, row in zip(boards, bulk_policy2moves(boards, policy, softmax=True), policy):
+            expected = policy2moves_fast(board, row, softmax=True)
+            self.assertEqual(list(move_policy.to_dict()), list(expected))
+            self.assertTrue(np.allclose(move_policy.probs, list(expected.values())), board.fen())
+            if len(move_policy) > 0:
+                self.assertAlmostEqual(float(move_policy.probs.sum()), 1.0)
+        self.assertEqual(len(bulk_policy2moves(boards[-1:], policy[-1:], softmax=True)[0]), 0)
+
+class PositionCacheTestCase(unittest.TestCase):
+    def test_eviction_and_counters(self):
+        boards = [chess.Board(fen=fen) for fen in list(TESTS) + list(ENDGAME_TESTS)]
+        policies = bulk_policy2moves(boards, torch.randn(len(boards), 1858))
+        cache = PositionCache(max_entries=3, max_bytes=1024 ** 2)
+        for b, policy in zip(boards, policies):
+            cache[position_key(b)] = [policy, 0.0]
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.evictions, len(boards) - 3)
+        self.assertIsNone(cache.get(position_key(boards[0])))
+        self.assertIsNotNone(cache.get(position_key(boards[-1])))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+class PlanesNet(torch.nn.Module):
+    """
+    Deterministic stand-in network: policy and value are read straight off the input planes.
+    """
+    def forward(self, x):
+        x = x.flatten(1)
+        return x[:, :1858] + x[:, -1858:].flip(1), x.sum(dim=1, keepdim=True)
+
+class PlanesAbstractNet(AbstractNet):
+    def __init__(self):
+        super().__init__(cuda=False)
+
+    def load_net(self):
+        return PlanesNet()
+
+class BatchingEvaluatorTestCase(unittest.TestCase):
+    def test_matches_single_eval(self):
+        boards = [chess.Board(fen=fen) for fen in list(TESTS) + list(ENDGAME_TESTS)] * 4
+        expected = [PlanesAbstractNet().eval(b) for b in boards]
+        with BatchingEvaluator(PlanesAbstractNet(), max_batch=8, max_latency=0.05) as evaluator:
+            with ThreadPoolExecutor(max_workers=len(boards)) as pool:
+                actual = list(pool.map(evaluator.eval, boards))
+            self.assertLess(evaluator.stats()["batches"], len(boards))
+        self.assertEqual(expected, actual)
+
+    def test_submit_after_close_raises(self):
+        board = chess.Board()
+        evaluator = BatchingEvaluator(PlanesAbstractNet(), max_latency=0.05)
+        future = evaluator.submit(board)
+        evaluator.close()
+        # --- Queued before close: still answered ---
+        self.assertEqual(future.result(timeout=0), PlanesAbstractNet().eval(board))
+        with self.assertRaises(RuntimeError):
+            evaluator.submit(board)
+        evaluator.close()
+
+class PrefetcherTestCase(unittest.TestCase):
+    def test_children_warm_in_background(self):
+        net = PlanesAbstractNet()
+        prefetcher = net.start_prefetcher()
+        board = chess.Board()
+        policy, _ = net.eval(board)
+        deadline = time.time() + 10
+        while prefetcher.stats()["evaluated"] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        board.push_uci(max(policy, key=policy.get))
+        self.assertEqual(net.eval(board), PlanesAbstractNet().eval(board))
+        net.stop_prefetcher()
+        self.assertEqual(prefetcher.stats()["hits"], 1)
+
+class SmallQuantizableNet(AbstractNet):
+    def load_net(self):
+        torch.manual_seed(0)
+        return model.Net(8, 1, 8, 4, classical=True,
+                         config=model.QuantizationConfig(quantize=True, save_gather_index=False))
+
+class DiskCacheTestCase(unittest.TestCase):
+    def test_survives_restart(self):
+        boards = [chess.Board(fen=fen) for fen in list(TESTS) + list(ENDGAME_TESTS)]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "evals.sqlite")
+            net = PlanesAbstractNet()
+            net.open_disk_cache(path)
+            expected = [net.eval(b) for b in boards]
+            net.close_disk_cache()
+
+            net = PlanesAbstractNet()
+            disk_cache = net.open_disk_cache(path)
+            net.net = None  # any forward pass would now fail
+            self.assertEqual(expected, [net.eval(b) for b in boards])
+            self.assertEqual(disk_cache.stats()["misses"], 0)
+
+            # --- Different weights must not see these entries ---
+            other = DiskCache(path, namespace="other")
+            self.assertIsNone(other.get(position_key(boards[0])))
+            other.close()
+            net.close_disk_cache()
+
+    def test_quantizing_moves_to_its_own_namespace(self):
+        board = chess.Board(fen=list(TESTS)[0])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "evals.sqlite")
+            net = SmallQuantizableNet(cuda=False)
+            float_namespace = net.open_disk_cache(path).namespace
+            float_eval = net.eval(board)
+            net.quantize_parameters()
+            self.assertNotEqual(net.disk_cache.namespace, float_namespace)
+            quantized_eval = net.eval(board)
+            self.assertNotEqual(quantized_eval, float_eval)
+            net.close_disk_cache()
+
+            # --- Each namespace holds its own net's evaluation ---
+            for quantize, expected in ((False, float_eval), (True, quantized_eval)):
+                net = SmallQuantizableNet(cuda=False)
+                if quantize:
+                    net.quantize_parameters()
+                disk_cache = net.open_disk_cache(path)
+                net.net = None  # any forward pass would now fail
+                self.assertEqual(net.eval(board), expected)
+                self.assertEqual(disk_cache.stats()["hits"], 1)
+                net.close_disk_cache()
+
+def write_polyglot_book(path, entries):
+    # --- (board, move, weight) -> big-endian key, move, weight, learn records sorted by key ---
+    records = sorted((chess.polyglot.zobrist_hash(board),
+                      move.to_square | (move.from_square << 6) | ((move.promotion or 1) - 1) << 12, weight)
+                     for board, move, weight in entries)
+    with open(path, "wb") as f:
+        for key, raw_move, weight in records:
+            f.write(struct.pack(">QHHI", key, raw_move, weight, 0))
+
+class StubTablebase:
+    """
+    Stands in for `chess.syzygy.Tablebase`: (wdl, dtz) by EPD, `default` for
+    any other position, KeyError (a missing table) if that is None.
+    """
+    def __init__(self, positions, default=None):
+        self.positions = {chess.Board(fen).epd(): result for fen, result in positions.items()}
+        self.default = default
+
+    def probe(self, board):
+        result = self.positions.get(board.epd(), self.default)
+        if result is None:
+            raise KeyError(board.epd())
+        return result
+
+    def probe_wdl(self, board):
+        return self.probe(board)[0]
+
+    def probe_dtz(self, board):
+        return self.probe(board)[1]
+
+    def close(self):
+        pass
+
+def after(fen, uci):
+    board = chess.Board(fen)
+    board.push_uci(uci)
+    return board.fen()
+
+class KnownPositionsTestCase(unittest.TestCase):
+    def test_book_answers_without_inference(self):
+        board = chess.Board()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "book.bin")
+            write_polyglot_book(path, [(board, chess.Move.from_uci("e2e4"), 3),
+                                       (board, chess.Move.from_uci("d2d4"), 1)])
+            net = PlanesAbstractNet()
+            other = chess.Board(fen=list(TESTS)[0])
+            expected = net.eval(other)
+            known_positions = net.open_known_positions(book_path=path)
+            self.assertEqual(known_positions.resolve(board)[2], BOOK)
+
+            # --- Positions outside the book still go to the net, on every path ---
+            self.assertEqual(expected + (NET_SOURCE,), net.eval(other, with_source=True))
+            policies, values, sources = net.bulk_eval([board, other], with_source=True)
+            self.assertEqual(sources, [BOOK, NET_SOURCE])
+            self.assertEqual((policies[1], values[1]), expected)
+            with BatchingEvaluator(net) as evaluator:
+                self.assertEqual(evaluator.eval(board, with_source=True)[2], BOOK)
+                self.assertEqual(evaluator.eval(other, with_source=True), expected + (NET_SOURCE,))
+                self.assertEqual(evaluator.stats()["known"], 1)
+
+            net.net = None  # any forward pass would now fail
+            policy, value, source = net.eval(board, with_source=True)
+            probs = {uci: np.exp(logit) for uci, logit in policy.items()}
+            self.assertEqual(set(policy), {move.uci() for move in board.legal_moves})
+            self.assertAlmostEqual(probs["e2e4"], 0.75)
+            self.assertAlmostEqual(probs["d2d4"], 0.25)
+            self.assertAlmostEqual(sum(probs.values()), 1.0)
+            self.assertEqual((value, source), (0.0, BOOK))
+            self.assertEqual(net.cache_stats()["known_positions"]["book_hits"], 4)
+            net.close_known_positions()
+
+    def test_tablebase_picks_move_and_value(self):
+        white, black = "4k3/8/8/8/8/8/8/4K2Q w - - 0 1", "4k3/8/8/8/8/8/8/4K2Q b - - 0 1"
+        cases = [
+            # --- Win: the fastest win, even over a faster draw ---
+            (white, {white: (2, 3), after(white, "h1h7"): (-2, -2), after(white, "h1a8"): (0, 0)}, (-2, -8),
+             "h1h7", 1.0),
+            # --- Loss: the slowest loss ---
+            (black, {black: (-2, -9), after(black, "e8d7"): (2, 9)}, (2, 3), "e8d7", -1.0),
+            # --- Cursed win: won only past the 50-move rule, so worth a draw, still played for the win ---
+            (white, {white: (1, 105), after(white, "h1h5"): (-1, -104), after(white, "h1h3"): (0, 0)}, (-1, -130),
+             "h1h5", 0.0),
+        ]
+        known_positions = KnownPositions()
+        for fen, positions, default, uci, value in cases:
+            known_positions.tablebase = StubTablebase(positions, default)
+            board = chess.Board(fen)
+            self.assertEqual(known_positions.probe_tablebase(board), ({chess.Move.from_uci(uci): 1.0}, value))
+            policy, resolved_value, source = known_positions.resolve(board)
+            self.assertEqual(decode_move_key(policy.keys[int(np.argmax(policy.probs))]).uci(), uci)
+            self.assertEqual((resolved_value, source), (value, TABLEBASE))
+
+        # --- Positions without tables fall through to the net ---
+        known_positions.tablebase = StubTablebase({white: (2, 3)})
+        self.assertIsNone(known_positions.resolve(chess.Board(white)))
+        self.assertEqual(known_positions.stats()["misses"], 1)
+
+class PUCTSearchTestCase(unittest.TestCase):
+    def test_finds_mate(self):
+        search = PUCTSearch(PlanesAbstractNet(), nodes=200, batch_size=8)
+        board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1")
+        self.assertEqual(search.search(board), chess.Move.from_uci("d1d8"))
+        self.assertGreater(search.stats()["mean_batch_size"], 1)
+
+    def test_transpositions_share_nodes(self):
+        search = PUCTSearch(PlanesAbstractNet(), nodes=64, batch_size=8)
+        board = chess.Board()
+        for uci in ["g1f3", "g8f6", "b1c3"]:
+            board.push_uci(uci)
+        search.search(board)
+        searched = int(search.root.edges["visits"].sum())
+
+        # --- Same position by another move order: its subtree is picked up from the table ---
+        board = chess.Board()
+        for uci in ["b1c3", "g8f6", "g1f3"]:
+            board.push_uci(uci)
+        search.search(board, nodes=8)
+        self.assertEqual(search.stats()["reused"], searched)
+
+    def test_evicts_old_generations(self):
+        table = TranspositionTable(max_nodes=32)
+        search = PUCTSearch(PlanesAbstractNet(), nodes=64, batch_size=8, table=table)
+        search.search(chess.Board())
+        # --- The current generation is never evicted ---
+        self.assertGreater(len(table), 32)
+        self.assertEqual(table.evictions, 0)
+
+        board = chess.Board()
+        board.push_uci("e2e4")
+        search.search(board)
+        self.assertGreater(table.evictions, 0)
+        self.assertTrue(all(node.generation == table.generation for node in table.nodes.values()))
+
+    def test_known_values_are_not_squashed(self):
+        class WinsAfterOneMove:
+            """
+            Tablebase-style answer for every position past the root: a win for the side to move.
+            """
+            def resolve(self, board):
+                if board.ply() == 0:
+                    return None
+                return KnownPositions.move_policy(board, {next(iter(board.legal_moves)): 1.0}), 1.0, TABLEBASE
+
+        net = PlanesAbstractNet()
+        net.known_positions = WinsAfterOneMove()
+        search = PUCTSearch(net, nodes=9, batch_size=8)
+        search.search(chess.Board())
+        edges = search.root.edges
+        visited = edges["visits"] > 0
+        self.assertGreater(visited.sum(), 1)
+        # --- Each visit backs up a full loss for the root, not tanh(1.0) ---
+        self.assertTrue(np.array_equal(edges["value"][visited], -edges["visits"][visited].astype(np.float32)))
+
+    def test_expands_root_when_out_of_time(self):
+        search = PUCTSearch(PlanesAbstractNet(), nodes=64, batch_size=8)
+        board = chess.Board()
+        self.assertIn(search.search(board, seconds=0), board.legal_moves)
+        self.assertTrue(search.root.expanded)
+
+class TracingTestCase(unittest.TestCase):
+    def test_capture_is_scoped_and_snapshots(self):
+        x = torch.tensor([[[[1.5, -2.0], [3.0, 4.0]]]])
+        model.save_tensor_for_halo2("untraced", x)
+        with trace() as tracer:
+            model.save_tensor_for_halo2("block_1.conv", x)
+            model.print_max_abs_value("check", {"x": x})
+            x.relu_()
+        self.assertIsNot(get_tracer(), tracer)
+        self.assertEqual(tracer.to_dict(), {"block_1": {"conv": [1, 3, -2, 4]}})
+        self.assertEqual(tracer.max_abs_value(), 4.0)
+
+    def test_binary_export_converts_to_legacy_json(self):
+        with trace() as tracer:
+            model.save_tensor_for_halo2("input", torch.arange(-256.0, 256.0).reshape(2, 4, 8, 8))
+            model.save_tensor_for_halo2("output", torch.tensor([[2.0 ** 40, -3.5]]), dim_check=False)
+        with tempfile.TemporaryDirectory() as tmp:
+            tracer.write(os.path.join(tmp, "intermediates.bin"))
+            tensors = read_tensor_file(os.path.join(tmp, "intermediates.bin"))
+            self.assertEqual(tensors["input"].shape, (2, 4, 8, 8))
+            self.assertEqual(tensors["output"].dtype.itemsize, 8)
+            tensor_file_to_json(os.path.join(tmp, "intermediates.bin"), os.path.join(tmp, "intermediates.json"))
+            with open(os.path.join(tmp, "intermediates.json")) as f:
+                self.assertEqual(json.load(f), json.loads(json.dumps(tracer.to_dict())))
+
+    def test_capture_is_per_thread(self):
+        x = torch.ones(1, 1, 2, 2)
+        with trace() as tracer:
+            worker = threading.Thread(target=model.save_tensor_for_halo2, args=("other_thread", x))
+            worker.start()
+            worker.join()
+            model.save_tensor_for_halo2("this_thread", x)
+        self.assertEqual(list(tracer.tensors), ["this_thread"])
+
+class QuantizationConfigTestCase(unittest.TestCase):
+    def test_float_and_quantized_nets_side_by_side(self):
+        x = torch.rand(2, 112, 8, 8)
+        float_net = model.Net(16, 1, 16, 4, classical=True, classicalPolicy=True,
+                              config=model.QuantizationConfig(quantize=False)).double().eval()
+        quantized_net = model.Net(16, 1, 16, 4, classical=True, classicalPolicy=True,
+                                  config=model.QuantizationConfig(quantize=True, save_gather_index=False)).double().eval()
+        quantized_net.load_state_dict(float_net.state_dict())
+        with torch.no_grad():
+            expected = float_net(x)
+            quantized_net(x)
+            self.assertTrue(all(torch.equal(e, a) for e, a in zip(expected, float_net(x))))
+        self.assertNotEqual(quantization_id(float_net), quantization_id(quantized_net))
+
+class GatherIndexTestCase(unittest.TestCase):
+    def test_written_once_with_hash(self):
+        policy_map = torch.randperm(5120)[:1858].unsqueeze(0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "gather_index.json")
+            self.assertTrue(model.write_gather_index(policy_map, path))
+            self.assertFalse(model.write_gather_index(policy_map, path))
+            with open(path) as f:
+                self.assertEqual(json.load(f), {"gather_index": policy_map[0].tolist()})
+            with open(path + ".sha256") as f:
+                self.assertEqual(f.read().strip(), model.gather_index_hash(policy_map))
+            self.assertTrue(model.write_gather_index(policy_map.flip(1), path))
+
+    def test_policy_map_matches_saved_tensor(self):
+        saved = torch.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "policy_map_gather_tensor.pt"))
+        self.assertIs(lc0_az_policy_map.gather_index(), lc0_az_policy_map.gather_index())
+        self.assertTrue(torch.equal(model.PolicyHead(8, 8).policy_map, saved))
+
+class DumpJsonTestCase(unittest.TestCase):
+    def test_matches_json_module(self):
+        weights = np.arange(-5, 5, dtype=np.int64)
+        obj = {"conv": {"weight": weights, "weight_shape": [2, 5], "empty": {}},
+               "bn": {"coeff": (weights[:3],), "beta": np.array([], dtype=np.int64)}}
+        f = io.StringIO()
+        dump_json(obj, f, indent=4)
+        legacy = {"conv": {"weight": weights.tolist(), "weight_shape": [2, 5], "empty": {}},
+                  "bn": {"coeff": (weights[:3].tolist(),), "beta": []}}
+        self.assertEqual(f.getvalue(), json.dumps(legacy, indent=4))
+
+class IntegerNetTestCase(unittest.TestCase):
+    def test_division_matches_float(self):
+        x = torch.randint(-2 ** 40, 2 ** 40, (10000,))
+        x[:6] = torch.tensor([-2 ** 21, -2 ** 20 - 1, -1, 2 ** 19, -2 ** 19, 3 * 2 ** 19])
+        for divisor in (4, 64, 2 ** 20, 6):
+            self.assertTrue(torch.equal(trunc_div(x, divisor), torch.trunc(x.double() / divisor).long()))
+            self.assertTrue(torch.equal(round_div(x, divisor), torch.round(x.double() / divisor).long()))
+
+    def test_linear_stays_exact_past_float64(self):
+        weight = torch.randint(-2 ** 20, 2 ** 20, (8, 16))
+        x = torch.randint(-2 ** 38, 2 ** 38, (4, 16))
+        expected = [[sum(int(a) * int(b) for a, b in zip(row, w)) for w in weight] for row in x]
+        self.assertEqual(ExactLinearOp(weight)(x).tolist(), expected)
+
+    def test_matches_quantized_forward(self):
+        torch.manual_seed(0)
+        net = model.Net(8, 2, 8, 4, classical=True,
+                        config=model.QuantizationConfig(quantize=True, save_gather_index=False))
+        # --- Non-trivial BN coefficients and offsets, so the folded integer batchnorm is exercised ---
+        for m in net.modules():
+            if isinstance(m, torch.nn.BatchNorm2d):
+                m.weight.data.uniform_(0.5, 1.5)
+                m.bias.data.uniform_(-0.2, 0.2)
+                m.running_mean.uniform_(-0.5, 0.5)
+                m.running_var.uniform_(0.5, 2.0)
+        net.quantize_parameters()
+        net.eval()
+        x = (torch.rand(4, 112, 8, 8) > 0.8).double()
+        with torch.no_grad():
+            with trace() as expected_trace:
+                expected = net(x)
+            with trace() as actual_trace:
+                actual = IntegerNet(net)(x)
+        for e, a in zip(expected, actual):
+            self.assertTrue(torch.equal(e, a))
+        self.assertEqual(list(expected_trace.tensors), list(actual_trace.tensors))
+        for name, e in expected_trace.tensors.items():
+            self.assertTrue(torch.equal(e, actual_trace.tensors[name].to(e.dtype)), name)
+
+class ProtoWeightsTestCase(unittest.TestCase):
+    def test_get_weights_round_trips_fill_net(self):
+        net = model.Net(8, 2, 8, 4, classical=True, config=model.QuantizationConfig(save_gather_index=False))
+        weights = [w.detach().float().numpy() for w in model.extract_weights(net)]
+        proto = proto_net.Net(net=pb.NetworkFormat.NETWORK_SE_WITH_HEADFORMAT,
+                              policy=pb.NetworkFormat.POLICY_CONVOLUTION)
+        proto.fill_net(list(weights))
+        loaded = proto.get_weights()
+        self.assertEqual(len(loaded), len(weights))
+        for expected, actual in zip(weights, loaded):
+            spread = max(float(expected.max() - expected.min()), 1.0)
+            self.assertTrue(np.allclose(expected.ravel(), actual, atol=spread / 0xffff))
+        self.assertTrue(all(w.base is loaded[0].base for w in loaded))
+
+class SnapshotTestCase(unittest.TestCase):
+    def test_quantized_round_trip(self):
+        net = model.Net(8, 1, 8, 4, classical=True, config=model.QuantizationConfig(quantize=True, save_gather_index=False))
+        net.quantize_parameters()
+        net.eval()
+        x = (torch.rand(2, 112, 8, 8) > 0.8).double()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "net.snap")
+            save_snapshot(net, path)
+            loaded = load_snapshot(path).eval()
+            self.assertTrue(loaded.quantized)
+            self.assertEqual(loaded.config.key(), net.config.key())
+            with torch.no_grad():
+                for e, a in zip(net(x), loaded(x)):
+                    self.assertTrue(torch.equal(e, a))
+            del loaded
+
+class SmallWDLNet(WDLNet):
+    def load_net(self):
+        torch.manual_seed(0)
+        return model.Net(8, 1, 8, 4, config=model.QuantizationConfig(quantize=False, save_gather_index=False)).float()
+
+class WDLNetTestCase(unittest.TestCase):
+    def test_builds_with_and_without_snapshot(self):
+        board = chess.Board(fen=list(TESTS)[0])
+        net = SmallWDLNet(cuda=False)
+        expected = net.eval(board)
+        self.assertLessEqual(abs(expected[1]), 1.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "wdl.snap")
+            net.save_snapshot(path)
+            loaded = SmallWDLNet(cuda=False, snapshot=path)
+            self.assertEqual(loaded.eval(board), expected)
+            del loaded
+
+class ImportTimeTestCase(unittest.TestCase):
+    def test_encoding_modules_skip_torch(self):
+        for module in ("badgyal_local", "badgyal_local.policy_index", "badgyal_local.board2planes"):
+            _, loads_torch = import_time(module, repeats=1)
+            self.assertFalse(loads_torch, module)
+
+class FusedNetTestCase(unittest.TestCase):
+    def test_matches_float_forward(self):
+        torch.manual_seed(0)
+        x = (torch.rand(8, 112, 8, 8) > 0.8).float()
+        for classical, classical_policy in ((True, True), (False, True), (True, False)):
+            net = model.Net(32, 2, 32, 4, classical=classical, classicalPolicy=classical_policy,
+                            config=model.QuantizationConfig(quantize=False, save_gather_index=False)).float().eval()
+            for m in net.modules():
+                if isinstance(m, torch.nn.BatchNorm2d):
+                    m.weight.data.uniform_(0.5, 1.5)
+                    m.bias.data.uniform_(-0.2, 0.2)
+                    m.running_mean.uniform_(-0.5, 0.5)
+                    m.running_var.uniform_(0.5, 2.0)
+            with torch.no_grad():
+                expected = net(x)
+                actual = FusedNet(net).eval()(x)
+            for e, a in zip(expected, actual):
+                self.assertTrue(torch.allclose(e, a, rtol=1e-4, atol=1e-4))
+
+def finished_game(*ucis):
+    board = chess.Board()
+    for uci in ucis:
+        board.push_uci(uci)
+    return board
+
+class MatchProgressTestCase(unittest.TestCase):
+    def test_refuses_progress_of_another_run(self):
+        board = finished_game("f2f3", "e7e5", "g2g4", "d8h4")
+        with tempfile.TemporaryDirectory() as tmp:
+            progress_path, pgn_path = os.path.join(tmp, "progress.jsonl"), os.path.join(tmp, "games.pgn")
+            leela_v_stockfish.start_match(4, "mgnet", 1850, progress_path, pgn_path)
+            with open(progress_path, "a") as f:
+                for game_number in (1, 7):
+                    f.write(json.dumps(leela_v_stockfish.game_record(board, game_number, True, "mgnet", 1850)) + "\n")
+            for num_games, model_name, elo in ((6, "mgnet", 1850), (4, "bgnet", 1850), (4, "mgnet", 2000)):
+                with self.assertRaises(ValueError):
+                    leela_v_stockfish.start_match(num_games, model_name, elo, progress_path, pgn_path)
+            # --- Games outside range(num_games) are dropped ---
+            records, tasks = leela_v_stockfish.start_match(4, "mgnet", 1850, progress_path, pgn_path)
+            self.assertEqual(list(records), [1])
+            self.assertEqual(tasks, [(0, True), (2, False), (3, False)])
+
+            # --- Games without a run header could be from any run ---
+            with open(progress_path, "w") as f:
+                f.write(json.dumps(records[1]) + "\n")
+            with self.assertRaises(ValueError):
+                leela_v_stockfish.start_match(4, "mgnet", 1850, progress_path, pgn_path)
+
+    def test_recovers_truncated_line(self):
+        run = leela_v_stockfish.match_run(4, "mgnet", 1850)
+        boards = [finished_game("f2f3", "e7e5", "g2g4", "d8h4"), finished_game("e2e4", "f7f6", "d2d4", "g7g5", "d1h5")]
+        records = [leela_v_stockfish.game_record(board, game_number, False, "mgnet", 1850)
+                   for game_number, board in zip((2, 0), boards)]
+        lines = [json.dumps({"run": run})] + [json.dumps(record) for record in records]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "progress.jsonl")
+            # --- Interrupted mid-write: the last record is cut off, without its newline ---
+            with open(path, "w") as f:
+                f.write("\n".join(lines) + "\n" + lines[1][:40])
+            self.assertEqual(leela_v_stockfish.load_match_progress(path, run), {0: records[1], 2: records[0]})
+            with open(path) as f:
+                self.assertEqual(f.read(), "\n".join([lines[0], lines[2], lines[1]]) + "\n")
+            # --- Appends after recovery start on a clean line ---
+            record = leela_v_stockfish.game_record(boards[0], 3, False, "mgnet", 1850)
+            with open(path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            self.assertEqual(sorted(leela_v_stockfish.load_match_progress(path, run)), [0, 2, 3])
+
+    def test_rebuilds_pgn_from_records(self):
+        boards = {1: finished_game("f2f3", "e7e5", "g2g4", "d8h4"),
+                  3: finished_game("e2e4", "f7f6", "d2d4", "g7g5", "d1h5")}
+        with tempfile.TemporaryDirectory() as tmp:
+            progress_path, pgn_path = os.path.join(tmp, "progress.jsonl"), os.path.join(tmp, "games.pgn")
+            leela_v_stockfish.start_match(4, "mgnet", 1850, progress_path, pgn_path)
+            records = {game_number: leela_v_stockfish.game_record(board, game_number, game_number < 2, "mgnet", 1850,
+                                                                  [(1, BOOK), (3, NET_SOURCE)])
+                       for game_number, board in boards.items()}
+            with open(progress_path, "a") as f:
+                for game_number in (3, 1):
+                    f.write(json.dumps(records[game_number]) + "\n")
+            # --- A duplicate and a half-written game left behind by the interrupted run ---
+            with open(pgn_path, "w") as f:
+                f.write(records[3]["pgn"] + "\n\n" + records[3]["pgn"] + "\n\n" + records[1]["pgn"][:50])
+
+            _, tasks = leela_v_stockfish.start_match(4, "mgnet", 1850, progress_path, pgn_path)
+            self.assertEqual(tasks, [(0, True), (2, False)])
+            with open(pgn_path) as f:
+                self.assertEqual(f.read(), records[1]["pgn"] + "\n\n" + records[3]["pgn"] + "\n\n")
+            with open(pgn_path) as f:
+                games = [chess.pgn.read_game(f) for _ in boards]
+            self.assertEqual([game.headers["Round"] for game in games], ["2", "4"])
+            self.assertEqual([game.end().board().fen() for game in games], [board.fen() for board in boards.values()])
+            self.assertEqual(games[0].next().next().comment, BOOK)
+
+def kill_next_idle(pool):
+    """
+    Kills the engine `pool.play` hands out next, keeping the idle order.
+    """
+    idle = [pool.idle.get_nowait() for _ in range(pool.idle.qsize())]
+    idle[0].transport.kill()
+    for engine in idle:
+        pool.idle.put_nowait(engine)
+    return idle[0]
+
+class UCIOpponentPoolTestCase(unittest.TestCase):
+    def test_replaces_crashed_engines(self):
+        async def run():
+            async with UCIOpponentPool(leela_v_stockfish.STANDIN_ENGINE_COMMAND, 2, {"Depth": 1}) as pool:
+                # --- The next idle engine dies: the search fails, and a fresh process takes its place ---
+                crashed = kill_next_idle(pool)
+                with self.assertRaises(chess.engine.EngineTerminatedError):
+                    await pool.play(chess.Board())
+                self.assertNotIn(crashed, pool.engines)
+                self.assertEqual((len(pool.engines), pool.num_restarts), (2, 1))
+
+                tasks = [(0, True), (1, False), (2, True)]
+                games = [game async for game in leela_v_stockfish.play_games_concurrently(
+                    PlanesAbstractNet(), pool, tasks, 2)]
+                self.assertEqual(sorted((game_number, leela_move_first) for game_number, leela_move_first, _, _ in games),
+                                 tasks)
+                for _, leela_move_first, board, _ in games:
+                    self.assertTrue(board.is_game_over())
+                searches = sum((board.ply() + (not leela_move_first)) // 2 for _, leela_move_first, board, _ in games)
+                self.assertEqual(pool.num_searches, searches)
+
+                # --- No replacement starts: the engine is dropped ---
+                pool.engine_command = [os.path.join(tempfile.gettempdir(), "no-such-engine")]
+                kill_next_idle(pool)
+                with self.assertRaises(chess.engine.EngineTerminatedError):
+                    await pool.play(chess.Board())
+                self.assertEqual(len(pool.engines), 1)
+                self.assertIn(await pool.play(chess.Board()), chess.Board().legal_moves)
+
+                # --- The last engine goes: a caller already waiting for it is woken up, not left hanging ---
+                kill_next_idle(pool)
+                results = await asyncio.wait_for(asyncio.gather(pool.play(chess.Board()), pool.play(chess.Board()),
+                                                                return_exceptions=True), 10)
+                self.assertEqual([type(result) for result in results],
+                                 [chess.engine.EngineTerminatedError, RuntimeError])
+                self.assertEqual(pool.engines, [])
+                with self.assertRaises(RuntimeError):
+                    await asyncio.wait_for(pool.play(chess.Board()), 10)
+        asyncio.run(run())
+
+class RecordingPlanesAbstractNet(PlanesAbstractNet):
+    """
+    Logs the (board, ply) pairs of every `bulk_eval` call.
+    """
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def bulk_eval(self, boards, *args, **kwargs):
+        self.calls.append([(board, board.ply()) for board in boards])
+        return super().bulk_eval(boards, *args, **kwargs)
+
+def lockstep_schedule(tasks, final_plies, concurrent_games):
+    """
+    The {(game_number, ply)} boards each step of `play_games_lockstep` should
+    evaluate, given how many plies each game lasted.
+    """
+    queued, active, batches = collections.deque(tasks), [], []
+    while len(queued) > 0 or len(active) > 0:
+        while len(queued) > 0 and len(active) < concurrent_games:
+            active.append(list(queued.popleft()) + [0])
+        batch = {(game_number, ply) for game_number, leela_move_first, ply in active if (ply % 2 == 0) == leela_move_first}
+        if len(batch) > 0:
+            batches.append(batch)
+        for game in active:
+            game[2] += 1
+        active = [game for game in active if game[2] < final_plies[game[0]]]
+    return batches
+
+class LockstepTestCase(unittest.TestCase):
+    def test_one_bulk_eval_per_step(self):
+        net = RecordingPlanesAbstractNet()
+        tasks = [(game_number, game_number < 3) for game_number in range(6)]
+        stats = dict()
+
+        async def run():
+            async with UCIOpponentPool(leela_v_stockfish.STANDIN_ENGINE_COMMAND, 2, {"Depth": 1}) as pool:
+                return [game async for game in leela_v_stockfish.play_games_lockstep(net, pool, tasks, 4, stats)]
+        games = asyncio.run(run())
+
+        # --- Every task finishes exactly once ---
+        self.assertEqual(sorted((game_number, leela_move_first) for game_number, leela_move_first, _, _ in games), tasks)
+        for _, leela_move_first, board, sources in games:
+            self.assertTrue(board.is_game_over())
+            self.assertEqual([ply for ply, _ in sources], list(range(0 if leela_move_first else 1, board.ply(), 2)))
+
+        # --- One bulk_eval per step, over every active game on Leela's move, with finished games refilled ---
+        game_numbers = {id(board): game_number for game_number, _, board, _ in games}
+        final_plies = {game_number: board.ply() for game_number, _, board, _ in games}
+        self.assertEqual([{(game_numbers[id(board)], ply) for board, ply in call} for call in net.calls],
+                         lockstep_schedule(tasks, final_plies, 4))
+        self.assertTrue(all(len(call) <= 4 for call in net.calls))
+
+        # --- The batch stats are handed back rather than printed ---
+        self.assertEqual(stats["batches"], len(net.calls))
+        self.assertEqual(stats["boards"], sum(len(call) for call in net.calls))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import threading
+
+import torch
+
+from badgyal_local.tensor_file import nest, write_tensor_file
+
+
+class NullTracer:
+    """
+    Production tracer: every hook is a no-op, so a forward pass does only the arithmetic.
+    """
+    enabled = False
+
+    def check_range(self, context: str, named_tensors: dict):
+        pass
+
+    def save(self, name: str, tensor: torch.Tensor, dim_check=True, conv_weight=False):
+        pass
+
+    def end_forward(self, model_name):
+        pass
+
+
+class CaptureTracer:
+    """
+    Records intermediate tensors for the Halo2 witness and tracks the largest
+    absolute intermediate value (to catch float64 precision loss above 2^53).
+
+    Tensors are kept as detached copies in Halo2 layout and only converted on
+    `write`: to an int64 tensor file (see `tensor_file`), or to the legacy JSON
+    of Python int lists for `.json` paths. Range checks keep one 0-dim
+    tensor per check, so nothing is synchronized or printed during forward
+    unless `verbose` is set.
+    """
+    enabled = True
+
+    def __init__(self, verbose=False, path_template=None):
+        self.verbose = verbose
+        # --- e.g. "{model_name}_intermediates_new.bin", written after each forward ---
+        self.path_template = path_template
+        self.tensors = OrderedDict()
+        self.permutations = dict()
+        self.ranges = OrderedDict()
+
+    def check_range(self, context: str, named_tensors: dict):
+        for name, tensor in named_tensors.items():
+            max_abs = tensor.detach().abs().max()
+            key = f"{context}.{name}"
+            if key in self.ranges:
+                self.ranges[key] = torch.maximum(self.ranges[key], max_abs)
+            else:
+                self.ranges[key] = max_abs
+            if self.verbose:
+                print(f"Max abs value entry of tensor {name} ({context}): {max_abs.item()}")
+
+    def save(self, name: str, tensor: torch.Tensor, dim_check=True, conv_weight=False):
+        """
+        NOTE: Conv (weight) is (C_out, C_in, H, W) --> (C_in, H, W, C_out)
+            .permute(3, 0, 1, 2)
+        NOTE: Conv data is (1, C, H, W) --> (1, C, W, H)
+            .permute(0, 1, 3, 2)
+        """
+        if self.verbose:
+            print(f"Saving tensor {name}...")
+        if dim_check:
+            # --- Append batch dim ---
+            if len(tensor.shape) == 3:
+                tensor = tensor.unsqueeze(0)
+            if len(tensor.shape) != 4:
+                raise RuntimeError(f"You goofed! Tensor is not 4-dimensional. Name: {name} | Tensor shape: {tensor.shape}")
+            permutation = (3, 0, 1, 2) if conv_weight else (0, 1, 3, 2)
+            tensor = tensor.permute(*permutation)
+            self.permutations[name] = permutation
+        # --- Copy, since later in-place ops (e.g. ReLU) would otherwise rewrite it ---
+        self.tensors[name] = tensor.detach().clone()
+
+    def max_abs_value(self):
+        if len(self.ranges) == 0:
+            return -1
+        return torch.stack([r.to(torch.float64) for r in self.ranges.values()]).max().item()
+
+    def end_forward(self, model_name):
+        if self.verbose:
+            print(f"\n----- Max over everything!!! {self.max_abs_value()} -----\n")
+        if self.path_template is not None:
+            self.write(self.path_template.format(model_name=model_name))
+
+    def to_dict(self):
+        """
+        Nested {"block": {"op": [int, ...]}} dict in the legacy intermediates JSON layout.
+        """
+        return nest({name: tensor.flatten().floor().to(torch.int64).tolist() for name, tensor in self.tensors.items()})
+
+    def write(self, filename: str):
+        """
+        Writes the captured tensors, as legacy JSON for `.json` paths and as a tensor file otherwise.
+        """
+        if filename.endswith(".json"):
+            self.save_json(filename)
+        else:
+            self.save_binary(filename)
+
+    def save_json(self, filename: str):
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    def save_binary(self, filename: str):
+        tensors = OrderedDict((name, tensor.cpu().numpy()) for name, tensor in self.tensors.items())
+        write_tensor_file(filename, tensors, self.permutations)
+
+
+NULL_TRACER = NullTracer()
+
+# --- Per thread, so a capture never records forwards run concurrently by other threads ---
+local_state = threading.local()
+
+
+def get_tracer():
+    return getattr(local_state, "tracer", NULL_TRACER)
+
+
+@contextmanager
+def trace(tracer=None):
+    """
+    Makes `tracer` (a fresh `CaptureTracer` by default) the active tracer for
+    the `model` forward passes run inside the block on the calling thread.
+    """
+    if tracer is None:
+        tracer = CaptureTracer()
+    previous = get_tracer()
+    local_state.tracer = tracer
+    try:
+        yield tracer
+    finally:
+        local_state.tracer = previous
@@ -2,8 +2,8 @@ from badgyal_local.abstractnet import AbstractNet
 import math
 
 class WDLNet(AbstractNet):
-    def __init__(self, cuda=True, torchScript=False):
-        super().__init__(cuda=cuda, torchScript=torchScript)
+    def __init__(self, cuda=True, torchScript=False, snapshot=None):
+        super().__init__(cuda=cuda, torchScript=torchScript, snapshot=snapshot)
 
     def value_to_scalar(self, value):
         wdl0 = value[0].item()
@@ -1,5 +1,5 @@
 # import badgyal
-from badgyal_local import *
+import badgyal_local
 import chess
 import chess.engine
 import sunfish
@@ -96,20 +96,21 @@ def main():
   # --- Leela shenanigans ---
   leela_model_name = "bgnet"
   leela_model = badgyal_local.bgnet.BGNet(cuda=False)
-  leela_model.net.quantize_parameters()
+  leela_model.quantize_parameters()
   leela_model.net.set_model_name("bgnet")
 
   # --- Dump model repr to JSON ---
   # model_repr_save_dir = "model_json_reprs"
   # os.path.isdir(model_repr_save_dir) or os.makedirs(model_repr_save_dir)
   # json_repr_save_path = os.path.join(model_repr_save_dir, f"{leela_model_name}.json")
-  # json_repr = leela_model.net.export_to_json_for_halo2()
-  # with open(json_repr_save_path, "w") as f:
-  #   json.dump(json_repr, f, indent=4)
+  # leela_model.net.write_json_for_halo2(json_repr_save_path)
   # print(f"Dumped JSON representation to {json_repr_save_path}!")
 
+  # --- Capture intermediates for the Halo2 witness ---
+  tracer = badgyal_local.tracing.CaptureTracer(verbose=True, path_template="{model_name}_intermediates_new.json")
   board = chess.Board()
-  eval(leela_model, board, leela_model_name)
+  with badgyal_local.tracing.trace(tracer):
+    eval(leela_model, board, leela_model_name)
 
 if __name__ == "__main__":
   main()
@@ -1,8 +1,23 @@
+import argparse
+import asyncio
 import badgyal_local
 import chess
 import chess.engine
+import chess.pgn
+import collections
+import json
+import multiprocessing
+import numpy as np
 import os
+import sys
+import tempfile
+import torch
+from badgyal_local.batching import BatchingEvaluator
+from badgyal_local.board2planes import decode_move_key
+from badgyal_local.known_positions import NET
+from badgyal_local.search import PUCTSearch
 from tqdm import tqdm
+from uci_pool import DEFAULT_MOVE_TIME, UCIOpponentPool
 
 # from torchinfo import summary
 
@@ -13,6 +28,11 @@ NUM_GAMES_PLAYED = 100
 STOCKFISH_BINARY_PATH = os.path.join("./stockfish")
 STOCKFISH_TARGET_ELO = 1850
 
+# --------- Match runner stuff ---------
+STANDIN_ENGINE_COMMAND = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "standin_uci_engine.py")]
+MATCH_PROGRESS_PATH = "leela_v_stockfish_progress.jsonl"
+MATCH_PGN_PATH = "leela_v_stockfish_games.pgn"
+
 # --------- Leela stuff ---------
 PIECE_REPLACEMENTS = {
     'R': '♜',
@@ -38,14 +58,14 @@ def print_leela_chessboard(board: chess.Board):
   print(board_repr)
 
 
-def eval(net: badgyal_local.badgyal_local.abstractnet.AbstractNet, board: chess.Board, model_name: str):
+def eval(net: badgyal_local.abstractnet.AbstractNet, board: chess.Board, model_name: str):
   # policy, value = net.eval(board, softmax_temp=1.61)
-  policy, _ = net.eval(board, softmax_temp=1, name=model_name)
+  policy, _, source = net.eval(board, softmax_temp=1, name=model_name, with_source=True)
   # print(value)
   # for (move, value) in policy.items():
   #   print(f"{move}: {value}")
   leela_move, leela_est_value = max(policy.items(), key=lambda x: x[1])
-  return leela_move, leela_est_value
+  return leela_move, leela_est_value, source
 
 
 # --------- Human stuff ---------
@@ -71,19 +91,27 @@ def get_legal_move(legal_moves: list[chess.Move]):
 
 
 def get_leela_move(board: chess.Board,
-                   leela_model: badgyal_local.badgyal_local.abstractnet.AbstractNet,
+                   leela_model: badgyal_local.abstractnet.AbstractNet,
                    leela_model_name: str,
-                   verbose: bool = False):
+                   verbose: bool = False,
+                   leela_search: PUCTSearch = None):
   """
   Literally just an abstraction to avoid some duplicate code.
+  With `leela_search`, the move comes from a PUCT search instead of the raw policy.
+  Returns the move and who picked it (`NET`, or a book / tablebase source).
   """
   if verbose:
     print_leela_chessboard(board)
-  leela_move, _ = eval(leela_model, board, leela_model_name)
+  if leela_search is not None:
+    leela_uci_move = leela_search.search(board)
+    if verbose:
+      print(f"Leela moves: {leela_uci_move}\n")
+    return leela_uci_move, leela_search.last_source
+  leela_move, _, source = eval(leela_model, board, leela_model_name)
   if verbose:
     print(f"Leela moves: {leela_move}\n")
   leela_uci_move = chess.Move.from_uci(leela_move)
-  return leela_uci_move
+  return leela_uci_move, source
 
 
 def get_stockfish_move(board: chess.Board,
@@ -99,12 +127,13 @@ def get_stockfish_move(board: chess.Board,
   return result.move
 
 
-def play_game(leela_model: badgyal_local.badgyal_local.abstractnet.AbstractNet,
+def play_game(leela_model: badgyal_local.abstractnet.AbstractNet,
               leela_model_name: str,
               stockfish_engine: chess.engine.SimpleEngine,
               stockfish_target_elo: int = STOCKFISH_TARGET_ELO,
               leela_move_first: bool = False,
-              verbose: bool = False):
+              verbose: bool = False,
+              leela_search: PUCTSearch = None):
   """
   Plays a single game between Leela model and provided
   Stockfish engine and reports the winner.
@@ -116,6 +145,8 @@ def play_game(leela_model: badgyal_local.badgyal_local.abstractnet.AbstractNet,
   move_history = list()
   white_move_history = list()
   black_move_history = list()
+  # --- (ply, source) for every Leela move ---
+  leela_sources = list()
 
   while not board.is_game_over():
 
@@ -128,8 +159,9 @@ def play_game(leela_model: badgyal_local.badgyal_local.abstractnet.AbstractNet,
     # --- White moves ---
     white_move = None
     if leela_move_first:
-      white_move = get_leela_move(board, leela_model, leela_model_name,
-                                  verbose)
+      white_move, source = get_leela_move(board, leela_model, leela_model_name,
+                                          verbose, leela_search)
+      leela_sources.append((board.ply(), source))
     else:
       white_move = get_stockfish_move(board, stockfish_engine,
                                       stockfish_target_elo, verbose)
@@ -148,8 +180,9 @@ def play_game(leela_model: badgyal_local.badgyal_local.abstractnet.AbstractNet,
       black_move = get_stockfish_move(board, stockfish_engine,
                                       stockfish_target_elo, verbose)
     else:
-      black_move = get_leela_move(board, leela_model, leela_model_name,
-                                  verbose)
+      black_move, source = get_leela_move(board, leela_model, leela_model_name,
+                                          verbose, leela_search)
+      leela_sources.append((board.ply(), source))
 
     # --- Store the move ---
     board.push(black_move)
@@ -163,7 +196,7 @@ def play_game(leela_model: badgyal_local.badgyal_local.abstractnet.AbstractNet,
     print(f"Winner: " + board.outcome().result())
     print_leela_chessboard(board)
 
-  return board, move_history, white_move_history, black_move_history
+  return board, move_history, white_move_history, black_move_history, leela_sources
 
 
 def report_results(all_outcomes: list[chess.Outcome], leela_model_name: str,
@@ -188,22 +221,381 @@ def report_results(all_outcomes: list[chess.Outcome], leela_model_name: str,
   print(f"{white_player} (as white) won: {num_white_wins} games | Drew {num_draws} games | Lost {num_black_wins} games\n")
 
 
-def main():
+# --------- Match runner ---------
+# --- Per worker process: its own engine and net, set up once by `init_match_worker` ---
+worker_state = dict()
 
-  # -------- Stockfish stuff --------
-  stockfish_engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_BINARY_PATH)
-  stockfish_target_elo = STOCKFISH_TARGET_ELO
-  stockfish_options = {
+
+def engine_options(stockfish_target_elo: int):
+  return {
       "UCI_LimitStrength": True,
       "UCI_Elo": stockfish_target_elo,
       "Use NNUE": False,
   }
-  stockfish_engine.configure(stockfish_options)
+
+
+def open_engine(engine_command, stockfish_target_elo: int):
+  engine = chess.engine.SimpleEngine.popen_uci(engine_command)
+  # --- Only what the engine declares, so a stand-in engine works too ---
+  engine.configure({k: v for (k, v) in engine_options(stockfish_target_elo).items() if k in engine.options})
+  return engine
+
+
+def init_match_worker(engine_command, stockfish_target_elo: int, leela_model_class: str, leela_model_name: str,
+                      snapshot_path: str, cuda: bool, book_path: str, tablebase_path: str, search_nodes: int):
+  # --- One thread per worker; the pool provides the parallelism ---
+  torch.set_num_threads(1)
+  worker_state["engine"] = open_engine(engine_command, stockfish_target_elo)
+  worker_state["model"] = getattr(badgyal_local, leela_model_class)(cuda=cuda, snapshot=snapshot_path)
+  if book_path is not None or tablebase_path is not None:
+    worker_state["model"].open_known_positions(book_path, tablebase_path)
+  # --- One search (and transposition table) per worker, cleared by `play_match_game` before each game ---
+  worker_state["search"] = PUCTSearch(worker_state["model"], nodes=search_nodes) if search_nodes else None
+  worker_state["model_name"] = leela_model_name
+  worker_state["target_elo"] = stockfish_target_elo
+
+
+def play_match_game(task):
+  """
+  Plays game `game_number` in a worker and returns its progress record.
+  """
+  game_number, leela_move_first = task
+  if worker_state["search"] is not None:
+    worker_state["search"].table.clear()
+  final_board, _, _, _, leela_sources = play_game(worker_state["model"], worker_state["model_name"],
+                                                  worker_state["engine"], worker_state["target_elo"], leela_move_first,
+                                                  leela_search=worker_state["search"])
+  return game_record(final_board, game_number, leela_move_first, worker_state["model_name"],
+                     worker_state["target_elo"], leela_sources)
+
+
+def game_record(final_board: chess.Board, game_number: int, leela_move_first: bool, leela_model_name: str,
+                stockfish_target_elo: int, leela_sources: list = ()):
+  """
+  The progress record (result, termination and PGN) of a finished game.
+  `leela_sources` are the (ply, source) pairs of Leela's moves: the record
+  counts them per source, and moves not from the net are commented in the PGN.
+  """
+  leela_player = f"Leela ({leela_model_name})"
+  stockfish_player = f"Stockfish ({stockfish_target_elo})"
+  game = chess.pgn.Game.from_board(final_board)
+  known_plies = {ply: source for (ply, source) in leela_sources if source != NET}
+  for ply, node in enumerate(game.mainline()):
+    if ply in known_plies:
+      node.comment = known_plies[ply]
+  game.headers["Event"] = "Leela v Stockfish"
+  game.headers["Round"] = str(game_number + 1)
+  game.headers["White"] = leela_player if leela_move_first else stockfish_player
+  game.headers["Black"] = stockfish_player if leela_move_first else leela_player
+  return {
+      "game_number": game_number,
+      "leela_move_first": leela_move_first,
+      "result": final_board.result(),
+      "termination": final_board.outcome().termination.name,
+      "leela_sources": dict(collections.Counter(source for (_, source) in leela_sources)),
+      "pgn": str(game),
+  }
+
+
+def record_to_outcome(record: dict):
+  winner = {"1-0": True, "0-1": False}.get(record["result"])
+  return chess.Outcome(chess.Termination[record["termination"]], winner)
+
+
+def match_run(num_games: int, leela_model_name: str, stockfish_target_elo: int):
+  """
+  The parameters a progress file is tied to: resuming with other ones would
+  mix games from different matches (or give Leela other colours).
+  """
+  return {"games": num_games, "model": leela_model_name, "elo": stockfish_target_elo}
+
+
+def load_match_progress(progress_path: str, run: dict):
+  """
+  {game_number: record} for every game of `run` (see `match_run`) already
+  finished in `progress_path`. Raises ValueError if the file belongs to
+  another run. The file is rewritten with its `run` header and just those
+  records, so appends start on a clean line.
+  """
+  records = dict()
+  if os.path.exists(progress_path):
+    file_run, has_games = None, False
+    with open(progress_path) as f:
+      for line in f:
+        # --- A line cut off by an interrupted run is dropped, and its game replayed ---
+        try:
+          record = json.loads(line)
+        except json.JSONDecodeError:
+          continue
+        if "run" in record:
+          file_run = record["run"]
+          continue
+        has_games = True
+        if record["game_number"] in range(run["games"]):
+          records[record["game_number"]] = record
+    if file_run != run and (file_run is not None or has_games):
+      raise ValueError(f"{progress_path} holds games of another run ({file_run}, not {run}); "
+                       f"use another progress file or remove it")
+  with open(progress_path, "w") as f:
+    f.write(json.dumps({"run": run}) + "\n")
+    for game_number in sorted(records):
+      f.write(json.dumps(records[game_number]) + "\n")
+  return records
+
+
+def start_match(num_games: int, leela_model_name: str, stockfish_target_elo: int, progress_path: str, pgn_path: str):
+  """
+  Finished records from `progress_path` and the (game_number, leela_move_first)
+  tasks still to play, Leela as white for the first half. `pgn_path` is
+  rebuilt from the records, so it never has duplicates or gaps.
+  """
+  records = load_match_progress(progress_path, match_run(num_games, leela_model_name, stockfish_target_elo))
+  tasks = [(game_number, game_number < num_games // 2) for game_number in range(num_games) if game_number not in records]
+  with open(pgn_path, "w") as pgn_file:
+    for game_number in sorted(records):
+      pgn_file.write(records[game_number]["pgn"] + "\n\n")
+  return records, tasks
+
+
+def report_match(records: dict, leela_model_name: str, stockfish_target_elo: int):
+  leela_white_outcomes = [record_to_outcome(r) for (_, r) in sorted(records.items()) if r["leela_move_first"]]
+  leela_black_outcomes = [record_to_outcome(r) for (_, r) in sorted(records.items()) if not r["leela_move_first"]]
+  report_results(leela_white_outcomes, leela_model_name, stockfish_target_elo, True)
+  report_results(leela_black_outcomes, leela_model_name, stockfish_target_elo, False)
+
+
+def run_match(num_games: int = NUM_GAMES_PLAYED,
+              processes: int = None,
+              engine_command=STOCKFISH_BINARY_PATH,
+              stockfish_target_elo: int = STOCKFISH_TARGET_ELO,
+              leela_model_class: str = "BGNet",
+              leela_model_name: str = "bgnet",
+              quantize: bool = True,
+              cuda: bool = False,
+              progress_path: str = MATCH_PROGRESS_PATH,
+              pgn_path: str = MATCH_PGN_PATH,
+              book_path: str = None,
+              tablebase_path: str = None,
+              search_nodes: int = None):
+  """
+  Plays `num_games` games (Leela as white for the first half) across a pool
+  of `processes` workers, each with its own engine and net. Finished games
+  are appended to `progress_path` as they arrive, so an interrupted match
+  resumes where it stopped (given the same games, model and Elo; see
+  `load_match_progress`), and every game is written to `pgn_path`. With
+  `book_path` or `tablebase_path`, Leela plays known positions from the
+  opening book / Syzygy tables instead of the net (see `KnownPositions`).
+  With `search_nodes`, Leela picks its moves with a PUCT search of that many
+  playouts (see `PUCTSearch`) rather than the raw policy argmax.
+  """
+  records, tasks = start_match(num_games, leela_model_name, stockfish_target_elo, progress_path, pgn_path)
+
+  if len(tasks) > 0:
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+      # --- Built (and quantized) once; workers map the snapshot instead of rebuilding the net ---
+      leela_model = getattr(badgyal_local, leela_model_class)(cuda=False)
+      if quantize:
+        leela_model.quantize_parameters()
+      snapshot_path = os.path.join(snapshot_dir, f"{leela_model_name}.snapshot")
+      leela_model.save_snapshot(snapshot_path)
+      del leela_model
+
+      processes = min(processes or os.cpu_count(), len(tasks))
+      context = multiprocessing.get_context("spawn")
+      initargs = (engine_command, stockfish_target_elo, leela_model_class, leela_model_name, snapshot_path, cuda,
+                  book_path, tablebase_path, search_nodes)
+      with context.Pool(processes, initializer=init_match_worker, initargs=initargs) as pool, \
+          open(progress_path, "a") as progress_file, open(pgn_path, "a") as pgn_file:
+        for record in tqdm(pool.imap_unordered(play_match_game, tasks), total=len(tasks)):
+          progress_file.write(json.dumps(record) + "\n")
+          progress_file.flush()
+          pgn_file.write(record["pgn"] + "\n\n")
+          pgn_file.flush()
+          records[record["game_number"]] = record
+
+  report_match(records, leela_model_name, stockfish_target_elo)
+  return records
+
+
+# --------- Async match runner ---------
+async def play_game_async(evaluator: BatchingEvaluator, opponent_pool: UCIOpponentPool, leela_move_first: bool):
+  """
+  `play_game` for one of many concurrent games: Leela's evals go through the
+  shared `evaluator` (batched with the other games') and the opponent's
+  searches through `opponent_pool`. Returns the final board and the (ply,
+  source) pairs of Leela's moves.
+  """
+  board = chess.Board()
+  leela_sources = list()
+  while not board.is_game_over():
+    if (board.turn == chess.WHITE) == leela_move_first:
+      policy, _, source = await evaluator.eval_async(board, with_source=True)
+      move = chess.Move.from_uci(max(policy.items(), key=lambda x: x[1])[0])
+      leela_sources.append((board.ply(), source))
+    else:
+      move = await opponent_pool.play(board)
+    board.push(move)
+  return board, leela_sources
+
+
+async def play_games_concurrently(leela_model: badgyal_local.abstractnet.AbstractNet,
+                                  opponent_pool: UCIOpponentPool, tasks: list, concurrent_games: int,
+                                  stats: dict = None):
+  """
+  Plays the (game_number, leela_move_first) `tasks`, up to `concurrent_games`
+  at once, each game on its own coroutine (see `play_game_async`). Yields
+  (game_number, leela_move_first, final_board, leela_sources) as games finish.
+  Once all have, the `BatchingEvaluator` stats are written into `stats`.
+  """
+  game_slots = asyncio.Semaphore(concurrent_games)
+
+  async def play_task(evaluator, game_number, leela_move_first):
+    async with game_slots:
+      final_board, leela_sources = await play_game_async(evaluator, opponent_pool, leela_move_first)
+    return game_number, leela_move_first, final_board, leela_sources
+
+  with BatchingEvaluator(leela_model, max_batch=concurrent_games, softmax_temp=1) as evaluator:
+    for game in asyncio.as_completed([play_task(evaluator, *task) for task in tasks]):
+      yield await game
+  if stats is not None:
+    stats.update(evaluator.stats())
+
+
+async def play_games_lockstep(leela_model: badgyal_local.abstractnet.AbstractNet,
+                              opponent_pool: UCIOpponentPool, tasks: list, concurrent_games: int,
+                              stats: dict = None):
+  """
+  Plays the (game_number, leela_move_first) `tasks` with `concurrent_games`
+  boards in flight, advancing all of them one ply per step: every board where
+  it is Leela's turn goes through one `bulk_eval`, while the opponent moves of
+  the others are searched on `opponent_pool`. Finished games are replaced from
+  the queue. Yields (game_number, leela_move_first, final_board, leela_sources)
+  as games finish. Once all have, the `bulk_eval` batch stats are written
+  into `stats`.
+  """
+  queued = collections.deque(tasks)
+  active = list()
+  num_batches, num_boards = 0, 0
+  while len(queued) > 0 or len(active) > 0:
+    while len(queued) > 0 and len(active) < concurrent_games:
+      game_number, leela_move_first = queued.popleft()
+      active.append((game_number, leela_move_first, chess.Board(), list()))
+
+    leela_games = [game for game in active if (game[2].turn == chess.WHITE) == game[1]]
+    opponent_boards = [board for (_, leela_move_first, board, _) in active if (board.turn == chess.WHITE) != leela_move_first]
+    leela_boards = [board for (_, _, board, _) in leela_games]
+
+    # --- The forward pass runs off the event loop, so the engines search meanwhile ---
+    async def leela_moves():
+      if len(leela_boards) == 0:
+        return []
+      policies, _, sources = await asyncio.to_thread(leela_model.bulk_eval, leela_boards, softmax_temp=1,
+                                                     as_dict=False, with_source=True)
+      for (_, _, board, leela_sources), source in zip(leela_games, sources):
+        leela_sources.append((board.ply(), source))
+      return [decode_move_key(policy.keys[np.argmax(policy.probs)]) for policy in policies]
+
+    moves, *opponent_moves = await asyncio.gather(leela_moves(), *[opponent_pool.play(board) for board in opponent_boards])
+    for board, move in zip(leela_boards + opponent_boards, moves + opponent_moves):
+      board.push(move)
+    if len(leela_boards) > 0:
+      num_batches += 1
+      num_boards += len(leela_boards)
+
+    for game in [game for game in active if game[2].is_game_over()]:
+      active.remove(game)
+      yield game
+  if stats is not None:
+    stats.update({
+        "batches": num_batches,
+        "boards": num_boards,
+        "mean_batch_size": num_boards / num_batches if num_batches > 0 else 0.0,
+    })
+
+
+async def run_match_async(num_games: int = NUM_GAMES_PLAYED,
+                          concurrent_games: int = 16,
+                          engines: int = None,
+                          engine_command=STOCKFISH_BINARY_PATH,
+                          stockfish_target_elo: int = STOCKFISH_TARGET_ELO,
+                          move_time: float = DEFAULT_MOVE_TIME,
+                          leela_model_class: str = "BGNet",
+                          leela_model_name: str = "bgnet",
+                          quantize: bool = True,
+                          cuda: bool = False,
+                          progress_path: str = MATCH_PROGRESS_PATH,
+                          pgn_path: str = MATCH_PGN_PATH,
+                          lockstep: bool = False,
+                          book_path: str = None,
+                          tablebase_path: str = None):
+  """
+  `run_match` in one process: up to `concurrent_games` games are in flight
+  at once against a pool of `engines` engine processes (default: one per
+  core), so while some games wait on an engine search, the others' positions
+  are evaluated together in one batched forward pass. With `lockstep`, games
+  advance together one ply at a time (see `play_games_lockstep`) rather than
+  each at its own pace. `book_path` and `tablebase_path` are as in `run_match`.
+  Returns the records and {"leela_evals": ..., "known_positions": ...} stats
+  (empty if there was nothing left to play).
+  """
+  stats = dict()
+  records, tasks = start_match(num_games, leela_model_name, stockfish_target_elo, progress_path, pgn_path)
+
+  if len(tasks) > 0:
+    leela_model = getattr(badgyal_local, leela_model_class)(cuda=cuda)
+    if quantize:
+      leela_model.quantize_parameters()
+    if book_path is not None or tablebase_path is not None:
+      leela_model.open_known_positions(book_path, tablebase_path)
+    engines = min(engines or os.cpu_count(), len(tasks))
+    play_games = play_games_lockstep if lockstep else play_games_concurrently
+
+    with open(progress_path, "a") as progress_file, open(pgn_path, "a") as pgn_file:
+      async with UCIOpponentPool(engine_command, engines, engine_options(stockfish_target_elo),
+                                 chess.engine.Limit(time=move_time)) as opponent_pool:
+        progress = tqdm(total=len(tasks))
+        stats["leela_evals"] = dict()
+        async for game_number, leela_move_first, final_board, leela_sources in play_games(
+            leela_model, opponent_pool, tasks, concurrent_games, stats["leela_evals"]):
+          record = game_record(final_board, game_number, leela_move_first, leela_model_name, stockfish_target_elo,
+                               leela_sources)
+          progress.update()
+          progress_file.write(json.dumps(record) + "\n")
+          progress_file.flush()
+          pgn_file.write(record["pgn"] + "\n\n")
+          pgn_file.flush()
+          records[record["game_number"]] = record
+        progress.close()
+    if leela_model.known_positions is not None:
+      stats["known_positions"] = leela_model.known_positions.stats()
+
+  report_match(records, leela_model_name, stockfish_target_elo)
+  return records, stats
+
+
+def main(num_games: int = NUM_GAMES_PLAYED,
+         engine_command=STOCKFISH_BINARY_PATH,
+         stockfish_target_elo: int = STOCKFISH_TARGET_ELO,
+         leela_model_class: str = "BGNet",
+         leela_model_name: str = "bgnet",
+         cuda: bool = True,
+         book_path: str = None,
+         tablebase_path: str = None,
+         search_nodes: int = None):
+  """
+  Plays the match sequentially in this process, without resuming or a PGN
+  file. The arguments are as in `run_match`.
+  """
+
+  # -------- Stockfish stuff --------
+  stockfish_engine = open_engine(engine_command, stockfish_target_elo)
 
   # --- Leela shenanigans ---
-  leela_model_name = "bgnet"
-  leela_model = badgyal_local.badgyal_local.bgnet.BGNet(cuda=True)
-  leela_model.net.quantize_parameters()
+  leela_model = getattr(badgyal_local, leela_model_class)(cuda=cuda)
+  leela_model.quantize_parameters()
+  if book_path is not None or tablebase_path is not None:
+    leela_model.open_known_positions(book_path, tablebase_path)
+  leela_search = PUCTSearch(leela_model, nodes=search_nodes) if search_nodes else None
   # model = badgyal.GGNet(cuda=False)
   # model = badgyal.LENet(cuda=False)
   # model = badgyal.BGTorchNet(cuda=False)
@@ -217,16 +609,19 @@ def main():
   leela_white_move_histories = list()
   leela_black_outcomes = list()
   leela_black_move_histories = list()
-  for game_number in tqdm(range(NUM_GAMES_PLAYED)):
+  for game_number in tqdm(range(num_games)):
 
     # --- Leela plays white for half and black for the other half of games ---
     leela_move_first = False
-    if game_number < NUM_GAMES_PLAYED // 2:
+    if game_number < num_games // 2:
       leela_move_first = True
-    final_board, move_history, _, _ = play_game(leela_model, leela_model_name,
+    if leela_search is not None:
+      leela_search.table.clear()
+    final_board, move_history, _, _, _ = play_game(leela_model, leela_model_name,
                                                 stockfish_engine,
                                                 stockfish_target_elo,
-                                                leela_move_first)
+                                                leela_move_first,
+                                                leela_search=leela_search)
     if leela_move_first:
       leela_white_outcomes.append(final_board.outcome())
       leela_white_move_histories.append(move_history)
@@ -241,4 +636,44 @@ def main():
   stockfish_engine.close()
 
 if __name__ == "__main__":
-  main()
+  argparser = argparse.ArgumentParser(description="Play Leela against Stockfish.")
+  argparser.add_argument("--games", type=int, default=NUM_GAMES_PLAYED)
+  argparser.add_argument("--processes", type=int, default=None,
+                         help="worker processes (default: one per core); 0 plays sequentially in this process, "
+                         "without --progress/--pgn")
+  argparser.add_argument("--engine", type=str, default=STOCKFISH_BINARY_PATH,
+                         help="UCI engine binary, or 'standin' for standin_uci_engine.py")
+  argparser.add_argument("--model", type=str, default="BGNet", help="badgyal_local net class, e.g. BGNet or MGNet")
+  argparser.add_argument("--concurrent-games", type=int, default=None,
+                         help="play this many games at once in one process (asyncio), instead of a process pool")
+  argparser.add_argument("--lockstep", action="store_true",
+                         help="with --concurrent-games, advance all games together, one bulk_eval per ply")
+  argparser.add_argument("--engines", type=int, default=None,
+                         help="engine processes for --concurrent-games (default: one per core)")
+  argparser.add_argument("--move-time", type=float, default=DEFAULT_MOVE_TIME,
+                         help="engine seconds per move for --concurrent-games")
+  argparser.add_argument("--book", type=str, default=None, help="Polyglot opening book Leela plays from")
+  argparser.add_argument("--tablebases", type=str, default=None, help="Syzygy tablebase directory Leela plays from")
+  argparser.add_argument("--search-nodes", type=int, default=None,
+                         help="PUCT playouts per Leela move (process-pool runner; default: raw policy argmax)")
+  argparser.add_argument("--progress", type=str, default=MATCH_PROGRESS_PATH)
+  argparser.add_argument("--pgn", type=str, default=MATCH_PGN_PATH)
+  args = argparser.parse_args()
+  engine_command = STANDIN_ENGINE_COMMAND if args.engine == "standin" else args.engine
+  if args.processes == 0:
+    if args.concurrent_games is not None:
+      argparser.error("--processes 0 plays one game at a time; it cannot be combined with --concurrent-games")
+    main(args.games, engine_command, leela_model_class=args.model, leela_model_name=args.model.lower(),
+         book_path=args.book, tablebase_path=args.tablebases, search_nodes=args.search_nodes)
+  elif args.concurrent_games is not None:
+    _, stats = asyncio.run(
+        run_match_async(args.games, args.concurrent_games, args.engines, engine_command, move_time=args.move_time,
+                        leela_model_class=args.model, leela_model_name=args.model.lower(),
+                        progress_path=args.progress, pgn_path=args.pgn, lockstep=args.lockstep,
+                        book_path=args.book, tablebase_path=args.tablebases))
+    for (name, value) in stats.items():
+      print(f"{name}: {value}")
+  else:
+    run_match(args.games, args.processes, engine_command, leela_model_class=args.model,
+              leela_model_name=args.model.lower(), progress_path=args.progress, pgn_path=args.pgn,
+              book_path=args.book, tablebase_path=args.tablebases, search_nodes=args.search_nodes)
@@ -0,0 +1,116 @@
+"""
+Minimal UCI engine (python-chess, material-only alpha-beta) that stands in
+for Stockfish when no binary is available, e.g. to smoke-test the match
+runner in `leela_v_stockfish.py`:
+
+  python leela_v_stockfish.py --engine standin --games 4
+"""
+import random
+import sys
+
+import chess
+
+PIECE_VALUES = {
+    chess.PAWN: 100,
+    chess.KNIGHT: 300,
+    chess.BISHOP: 320,
+    chess.ROOK: 500,
+    chess.QUEEN: 900,
+    chess.KING: 0,
+}
+MATE_SCORE = 100000
+DEFAULT_DEPTH = 2
+
+
+def evaluate(board: chess.Board):
+  """
+  Material balance from the side to move's perspective.
+  """
+  score = 0
+  for piece_type, value in PIECE_VALUES.items():
+    score += value * (len(board.pieces(piece_type, board.turn)) - len(board.pieces(piece_type, not board.turn)))
+  return score
+
+
+def ordered_moves(board: chess.Board):
+  # --- Captures first, so alpha-beta cuts early ---
+  return sorted(board.legal_moves, key=lambda move: not board.is_capture(move))
+
+
+def negamax(board: chess.Board, depth: int, alpha: int, beta: int):
+  if board.is_checkmate():
+    return -MATE_SCORE
+  if board.is_game_over():
+    return 0
+  if depth == 0:
+    return evaluate(board)
+  for move in ordered_moves(board):
+    board.push(move)
+    score = -negamax(board, depth - 1, -beta, -alpha)
+    board.pop()
+    if score >= beta:
+      return beta
+    alpha = max(alpha, score)
+  return alpha
+
+
+def best_move(board: chess.Board, depth: int, rng: random.Random):
+  """
+  Best move at `depth` plies, ties broken at random so repeated games differ.
+  """
+  best_score, best_moves = None, []
+  for move in ordered_moves(board):
+    board.push(move)
+    score = -negamax(board, depth - 1, -MATE_SCORE, MATE_SCORE)
+    board.pop()
+    if best_score is None or score > best_score:
+      best_score, best_moves = score, [move]
+    elif score == best_score:
+      best_moves.append(move)
+  return rng.choice(best_moves)
+
+
+def parse_position(tokens: list[str]):
+  """
+  `position [startpos | fen <fen>] [moves <uci> ...]` -> board.
+  """
+  moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+  if tokens[1] == "fen":
+    board = chess.Board(" ".join(tokens[2:moves]))
+  else:
+    board = chess.Board()
+  for uci in tokens[moves + 1:]:
+    board.push_uci(uci)
+  return board
+
+
+def main():
+  board = chess.Board()
+  depth = DEFAULT_DEPTH
+  rng = random.Random()
+  for line in sys.stdin:
+    tokens = line.split()
+    if len(tokens) == 0:
+      continue
+    command = tokens[0]
+    if command == "uci":
+      print("id name standin")
+      print(f"option name Depth type spin default {DEFAULT_DEPTH} min 1 max 4")
+      print("uciok")
+    elif command == "isready":
+      print("readyok")
+    elif command == "setoption" and len(tokens) >= 5 and tokens[2] == "Depth":
+      depth = int(tokens[4])
+    elif command == "ucinewgame":
+      board = chess.Board()
+    elif command == "position":
+      board = parse_position(tokens)
+    elif command == "go":
+      print(f"bestmove {best_move(board, depth, rng).uci()}")
+    elif command == "quit":
+      break
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+  main()
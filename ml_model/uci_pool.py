@@ -0,0 +1,96 @@
+"""
+asyncio pool of UCI engine processes for match harnesses. Many games can be
+in flight in one process: while some wait on an engine search, others wait
+on (batched) net inference.
+"""
+import asyncio
+import contextlib
+
+import chess
+import chess.engine
+
+DEFAULT_MOVE_TIME = 0.1
+# --- Seconds a failed engine gets to quit before it is abandoned ---
+QUIT_TIMEOUT = 1.0
+# --- Left on the idle queue once the last engine is dropped: every `play` waiting on it raises ---
+NO_ENGINES = None
+
+
+class UCIOpponentPool:
+  """
+  `size` processes of `engine_command`, each configured with `options` (only
+  those the engine declares, e.g. `UCI_Elo`). `play` borrows an idle engine,
+  searches with `limit` and returns it to the pool. An engine that crashes
+  or breaks protocol is replaced by a fresh process (or dropped, if that
+  fails to start too) before the error reaches the caller. Once none are
+  left, `play` raises RuntimeError, including for callers already waiting.
+  """
+
+  def __init__(self, engine_command, size: int, options: dict = None, limit: chess.engine.Limit = None):
+    self.engine_command = engine_command
+    self.size = size
+    self.options = options or dict()
+    self.limit = limit or chess.engine.Limit(time=DEFAULT_MOVE_TIME)
+    self.engines = list()
+    self.idle = None
+
+    # --- Counters ---
+    self.num_searches = 0
+    self.num_restarts = 0
+
+  async def __aenter__(self):
+    await self.start()
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self.close()
+
+  async def open_engine(self):
+    _, engine = await chess.engine.popen_uci(self.engine_command)
+    await engine.configure({k: v for (k, v) in self.options.items() if k in engine.options})
+    return engine
+
+  async def start(self):
+    self.idle = asyncio.Queue()
+    self.engines = list(await asyncio.gather(*[self.open_engine() for _ in range(self.size)]))
+    for engine in self.engines:
+      self.idle.put_nowait(engine)
+
+  async def replace_engine(self, engine):
+    """
+    Quits the failed `engine` and returns a freshly opened one in its place,
+    or None (dropping it from the pool) if none starts.
+    """
+    self.engines.remove(engine)
+    with contextlib.suppress(Exception):
+      await asyncio.wait_for(engine.quit(), QUIT_TIMEOUT)
+    try:
+      engine = await self.open_engine()
+    except Exception:
+      if len(self.engines) == 0:
+        self.idle.put_nowait(NO_ENGINES)
+      return None
+    self.engines.append(engine)
+    self.num_restarts += 1
+    return engine
+
+  async def play(self, board: chess.Board):
+    engine = await self.idle.get()
+    if engine is NO_ENGINES:
+      # --- Passed on, so the next waiter wakes up too ---
+      self.idle.put_nowait(NO_ENGINES)
+      raise RuntimeError("no engines left in the pool")
+    try:
+      result = await engine.play(board, self.limit)
+    except (chess.engine.EngineTerminatedError, chess.engine.EngineError):
+      engine = await self.replace_engine(engine)
+      raise
+    finally:
+      if engine is not None:
+        self.idle.put_nowait(engine)
+    self.num_searches += 1
+    return result.move
+
+  async def close(self):
+    await asyncio.gather(*[engine.quit() for engine in self.engines], return_exceptions=True)
+    self.engines = list()